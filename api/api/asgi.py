@@ -8,9 +8,40 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
 import os
+from functools import lru_cache
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
+from django.urls import NoReverseMatch, Resolver404, resolve, reverse
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Under ASGI, login and public registration are served by their async variants,
+# which hash passwords in a bounded pool instead of pinning the worker.
+ASYNC_ROUTES = {
+    '/api/login/': '/api/async/login/',
+    '/api/public/register/': '/api/async/public/register/',
+}
+
+
+@lru_cache(maxsize=4096)
+def async_read_path(path):
+    """The async twin ('<route name>-async', diaspora/async_views.py) of a read endpoint, if it has one."""
+    try:
+        match = resolve(path)
+        return reverse(f'{match.url_name}-async', args=match.args, kwargs=match.kwargs)
+    except (Resolver404, NoReverseMatch):
+        return None
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        path = ASYNC_ROUTES.get(scope['path'])
+        if path is None and scope['method'] in ('GET', 'HEAD') and getattr(settings, 'ASYNC_READS', True):
+            # list/retrieve and reports: awaited on the async ORM instead of holding a thread
+            path = async_read_path(scope['path'])
+        if path is not None:
+            scope = dict(scope, path=path, raw_path=path.encode())
+    await django_application(scope, receive, send)
@@ -44,6 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # outermost, so its query count and timings cover the whole request (diaspora/instrumentation.py)
+    "diaspora.instrumentation.RequestInstrumentationMiddleware",
+    # per-request primary/replica routing state (diaspora/routing.py)
+    "diaspora.routing.DatabaseRoutingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -60,9 +64,13 @@ REST_FRAMEWORK = {
     
     'DEFAULT_AUTHENTICATION_CLASSES': (
         
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # role/groups/office come from the token claims, no User query per request
+        'diaspora.authentication.ClaimsJWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
-    )
+    ),
+    # keyset pagination on created_at/ordering fields + pk (diaspora/pagination.py)
+    'DEFAULT_PAGINATION_CLASS': 'diaspora.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
     
 }
 
@@ -71,8 +79,14 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),  # Change this to your desired refresh token expiration time
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_USER_CLASS': 'diaspora.authentication.ClaimsUser',
 }
 
+# full_user() keeps User rows for claims-authenticated requests this many seconds. It is also
+# how long another worker may keep accepting tokens of a user deactivated or deleted elsewhere.
+AUTH_USER_CACHE_TTL = 60
+AUTH_USER_CACHE_SIZE = 1024
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -99,9 +113,129 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {},  # the hardened SQLite profile below adds its connection options
+        # a file rather than the shared in-memory database, which fails concurrent writers with
+        # "database table is locked" instead of waiting: tests exercise parallel registrations
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    # Read replicas, listed in DATABASE_ROUTING['REPLICAS']. Locally, SQLite copies kept
+    # up to date by `manage.py sync_replicas` stand in for them:
+    # 'replica1': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': BASE_DIR / 'db.replica1.sqlite3',
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+# Primary/replica routing (diaspora/routing.py). Writes always go to PRIMARY; report
+# actions and safe list/detail reads go to a healthy replica, except for users who wrote
+# in the last MAX_LAG seconds (read-your-writes) or requests sending "X-DB-Route: primary".
+DATABASE_ROUTERS = ['diaspora.routing.PrimaryReplicaRouter']
+DATABASE_ROUTING = {
+    'PRIMARY': 'default',
+    'REPLICAS': [],  # e.g. ['replica1']
+    'MAX_LAG': 5,  # seconds replicas may trail the primary (heartbeat age) and writers stay pinned
+    'HEALTH_CHECK_INTERVAL': 10,  # seconds between checks of each replica, per process
+}
+
+# Hardened SQLite profile (diaspora/sqlite.py). PRAGMAS run on every new SQLite connection;
+# with SERIALIZED_WRITES, registrations and viewset create/update/delete go through one
+# writer thread that commits up to GROUP_COMMIT_MAX of them per transaction, waiting at most
+# GROUP_COMMIT_WAIT_MS for more to arrive. No effect on other database backends.
+SQLITE_PROFILE = {
+    'ENABLED': True,
+    'BUSY_TIMEOUT': 20,  # seconds a connection waits for the write lock
+    # take the write lock at BEGIN: a deferred transaction that reads first and then
+    # writes can't wait for the lock and fails with "database is locked" instead
+    'TRANSACTION_MODE': 'IMMEDIATE',
+    'PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,  # 256 MiB
+        'cache_size': -65536,  # KiB, i.e. 64 MiB per connection
+        'temp_store': 'MEMORY',
+    },
+    'SERIALIZED_WRITES': True,
+    'GROUP_COMMIT_MAX': 64,
+    'GROUP_COMMIT_WAIT_MS': 2,
+}
+
+# the busy timeout and transaction mode are connection options, not PRAGMAs
+if SQLITE_PROFILE['ENABLED'] and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['OPTIONS'].update({
+        'timeout': SQLITE_PROFILE['BUSY_TIMEOUT'],
+        'transaction_mode': SQLITE_PROFILE['TRANSACTION_MODE'],
+    })
+
+
+# Caches
+# "reports" backs the ReportsViewSet response cache (diaspora/report_cache.py).
+# Point it at Redis/Memcached to share entries between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'reports',
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+REPORT_CACHE_ALIAS = 'reports'
+REPORT_CACHE_TIMEOUT = 300  # seconds; writes invalidate earlier
+
+# Where ReportsViewSet reads from: "rollup" (daily rollup tables) or "live" (source tables)
+REPORTS_SOURCE = 'rollup'
+
+# Per-request instrumentation (diaspora/instrumentation.py): Server-Timing header with
+# query count / DB / serializer / render time, and a JSON line on the diaspora.requests
+# logger, at WARNING once one statement repeats this many times in a request (N+1).
+REQUEST_SERVER_TIMING = True
+REQUEST_DUPLICATE_QUERY_WARN = 5
+
+# Full-text search index (diaspora/search.py). Backend defaults to the one matching the DB vendor.
+# SEARCH_INDEX_BACKEND = 'diaspora.search.SqliteFtsIndex'
+SEARCH_INDEX_MAX_HITS = 500  # matches ranked by relevance per search; any beyond still match, unranked
+
+# list actions serialize through compiled values() projections (diaspora/compiled.py)
+COMPILED_LIST_SERIALIZERS = True
+
+# Referral push to receiving offices' systems (diaspora/outbox.py, `manage.py sync_referrals`).
+# DESTINATIONS is keyed by the receiving office code; `manage.py referral_sync_stub` serves a
+# local endpoint for testing, e.g. {"HRO-INV": {"URL": "http://127.0.0.1:8765/referrals/"}}.
+REFERRAL_SYNC = {
+    'BATCH_SIZE': 200,
+    'MAX_ATTEMPTS': 8,
+    'DESTINATIONS': {
+        # 'HRO-INV': {'URL': 'https://investment.example/api/referrals/', 'CONCURRENCY': 4, 'TIMEOUT': 10},
+        # 'HRO-LAND': {'URL': 'https://land.example/api/referrals/', 'CONCURRENCY': 2, 'TIMEOUT': 10},
+    },
 }
 
+# Seconds each process keeps its copy of the Office table (diaspora/offices.py) when no Office
+# write reaches it: generation bumps only cross workers through a shared "reports" cache.
+OFFICE_REGISTRY_TTL = 300
+
+# diaspora_id numbers each process reserves per round-trip (diaspora/ids.py)
+DIASPORA_ID_BLOCK_SIZE = 100
+
+# Password-hashing workers for bulk imports (diaspora/importer.py); None = one per CPU.
+# Processes for `manage.py import_diasporas`, threads for the upload endpoint.
+IMPORT_HASH_WORKERS = None
+
+# Off-event-loop password hashing for the ASGI login/register views (diaspora/hashing.py):
+# at most MAX_WORKERS hashes run at once, MAX_QUEUE more may wait, the rest get 503.
+PASSWORD_HASHING = {
+    'MAX_WORKERS': 4,
+    'MAX_QUEUE': 64,
+}
+
+# Under ASGI, GET/HEAD on list/retrieve and report endpoints are served by their async
+# variants on the async ORM (diaspora/async_views.py, routed in api/asgi.py)
+ASYNC_READS = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class DiasporaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'diaspora'
+
+    def ready(self):
+        # signal receivers
+        from django.db.models.signals import post_migrate
+        from . import rollups, stage_history, report_cache, search, outbox, sqlite, facets  # noqa: F401
+
+        post_migrate.connect(search.ensure_index, sender=self)
@@ -0,0 +1,141 @@
+# diaspora/async_views.py
+"""
+Async read endpoints for ASGI deployments.
+
+A sync DRF view holds a worker thread for its whole run, most of it spent
+waiting on the database. The read-only actions – list/retrieve on the model
+viewsets and the dashboard reports – also come as ``a<action>`` methods that
+await the async ORM instead, and the reports issue their independent queries
+together (``asyncio.gather``, see ``report`` in diaspora/reports.py).
+
+``async_view()`` serves such a method as a plain async Django view,
+``async_urlpatterns()`` mounts one per action under ``async/`` and api/asgi.py
+sends GET/HEAD requests there. Everything around the ORM calls stays DRF:
+authentication, permissions, replica routing, exception handling and
+rendering. The steps that may query synchronously – ``initial()`` (replica
+health checks, the read-your-writes pin), full-text search filters and
+serializers that aren't compiled – go through ``sync_to_async``.
+"""
+from asgiref.sync import sync_to_async
+
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.urls import path, re_path, reverse
+from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+READ_METHODS = ("GET", "HEAD")
+
+
+class AsyncReadMixin:
+    """
+    Default ``alist``/``aretrieve`` for a GenericAPIView. Sits right before the
+    viewset base class, so ConditionalGetMixin and CompiledListMixin refine them
+    the same way they refine ``list``/``retrieve``.
+    """
+
+    async def afilter_queryset(self, queryset):
+        if self.request.query_params.get(api_settings.SEARCH_PARAM):
+            # the full-text filter looks its hits up while filtering
+            return await sync_to_async(self.filter_queryset)(queryset)
+        return self.filter_queryset(queryset)
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        if hasattr(self.paginator, "apaginate_queryset"):
+            return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+        return await sync_to_async(self.paginate_queryset)(queryset)
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(await sync_to_async(self._serialize)(page, many=True))
+        rows = [obj async for obj in queryset]
+        return Response(await sync_to_async(self._serialize)(rows, many=True))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(await sync_to_async(self._serialize)(instance))
+
+    def _serialize(self, instance, many=False):
+        # model serializers may follow relations the queryset didn't select
+        return self.get_serializer(instance, many=many).data
+
+
+def async_view(viewset, action, url_name=None, **initkwargs):
+    """
+    A plain async Django view running ``viewset``'s ``a<action>`` for GET/HEAD.
+    With ``url_name`` the request keeps the path of that (sync) route, so
+    pagination links and ETags don't depend on which variant answered.
+    """
+
+    async def view(request, *args, **kwargs):
+        if url_name is not None:
+            request.path = reverse(url_name, args=args, kwargs=kwargs)
+        self = viewset(**initkwargs)
+        self.action_map = {"get": action, "head": action}
+        self.args, self.kwargs = args, kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            if request.method not in READ_METHODS:
+                raise MethodNotAllowed(request.method)
+            # authentication, permissions, throttles, replica choice
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await getattr(self, f"a{action}")(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    view.csrf_exempt = True
+    view.cls = viewset
+    view.initkwargs = initkwargs
+    view.actions = {"get": action}
+    return view
+
+
+def async_urlpatterns(router):
+    """
+    ``async/<prefix>/…`` twins of the ``router`` routes whose viewset has an
+    async variant of the action, named ``<route name>-async``.
+    """
+    patterns = []
+    for prefix, viewset, basename in router.registry:
+        if hasattr(viewset, "alist"):
+            patterns.append(path(
+                f"async/{prefix}/", async_view(viewset, "list", f"{basename}-list", basename=basename, detail=False),
+                name=f"{basename}-list-async",
+            ))
+        for extra in viewset.get_extra_actions():
+            if extra.detail or not hasattr(viewset, f"a{extra.__name__}"):
+                continue
+            name = f"{basename}-{extra.url_name}"
+            patterns.append(path(
+                f"async/{prefix}/{extra.url_path}/", async_view(viewset, extra.__name__, name, basename=basename, detail=False),
+                name=f"{name}-async",
+            ))
+        # after the extra actions, whose paths the lookup pattern would also match
+        if hasattr(viewset, "aretrieve"):
+            lookup = router.get_lookup_regex(viewset)
+            patterns.append(re_path(
+                rf"^async/{prefix}/{lookup}/$", async_view(viewset, "retrieve", f"{basename}-detail", basename=basename, detail=True),
+                name=f"{basename}-detail-async",
+            ))
+    return patterns
@@ -0,0 +1,208 @@
+# diaspora/authentication.py
+"""
+JWTs that carry the user's role, groups and owning office.
+
+- ``DiasporaRefreshToken.for_user`` stamps the claims at login; access tokens
+  inherit them.
+- ``ClaimsJWTAuthentication`` turns a valid access token into a ``ClaimsUser``
+  straight from those claims. Only ``is_active`` is checked against the
+  database, through the ``full_user()`` cache: at most one query per user per
+  AUTH_USER_CACHE_TTL seconds and process. A deactivated or deleted user is
+  locked out at once by the worker that saved the change, and by the others
+  within the TTL.
+- ``full_user()`` returns the real ``User`` row where a model instance is
+  required (e.g. ``created_by`` foreign keys), through a small per-process TTL
+  cache. ``ClaimsUser`` answers ``groups`` and permission checks from it too.
+- ``login_rows()`` / ``login_candidates()`` load everything a login needs
+  (password hash, groups, office) in a single query; ``login_payload()``
+  stamps ``last_login`` with one UPDATE, as ``login()`` used to.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Diaspora
+
+User = get_user_model()
+
+DEFAULT_ROLE = "Diaspora"
+
+
+class DiasporaRefreshToken(RefreshToken):
+
+    @classmethod
+    def for_user(cls, user, groups=None, office_id=None):
+        """``groups`` (names, role first) and ``office_id`` are looked up if not given."""
+        token = super().for_user(user)
+        if groups is None:
+            groups = list(user.groups.order_by("pk").values_list("name", flat=True))
+            office_id = Diaspora.objects.filter(user=user).values_list("owner_office_id", flat=True).first()
+        token["username"] = user.get_username()
+        token["role"] = groups[0] if groups else DEFAULT_ROLE
+        token["groups"] = list(groups)
+        token["office"] = office_id
+        token["is_staff"] = user.is_staff
+        token["is_superuser"] = user.is_superuser
+        return token
+
+
+class ClaimsUser(TokenUser):
+    """Request user built from token claims; ``full_user()`` resolves the DB row on demand."""
+
+    @cached_property
+    def role(self):
+        return self.token.get("role", DEFAULT_ROLE)
+
+    @cached_property
+    def group_names(self):
+        return list(self.token.get("groups", []))
+
+    @cached_property
+    def office_id(self):
+        return self.token.get("office")
+
+    # groups and permissions aren't in the token: ask the User row
+    @property
+    def groups(self):
+        return full_user(self).groups
+
+    @property
+    def user_permissions(self):
+        return full_user(self).user_permissions
+
+    def get_group_permissions(self, obj=None):
+        return full_user(self).get_group_permissions(obj)
+
+    def get_all_permissions(self, obj=None):
+        return full_user(self).get_all_permissions(obj)
+
+    def has_perm(self, perm, obj=None):
+        return full_user(self).has_perm(perm, obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return full_user(self).has_perms(perm_list, obj)
+
+    def has_module_perms(self, module):
+        return full_user(self).has_module_perms(module)
+
+    def __str__(self):
+        return self.username or f"user {self.id}"
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """JWTAuthentication with the User query replaced by the ``full_user()`` cache."""
+
+    def get_user(self, validated_token):
+        super().get_user(validated_token)  # validates the user id claim
+        user = ClaimsUser(validated_token)
+        try:
+            active = full_user(user).is_active
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+
+# ---------------------------
+# Full user rows (per-process TTL cache)
+# ---------------------------
+
+_users = {}
+_users_lock = threading.Lock()
+
+
+def full_user(user):
+    """The ``User`` model instance behind ``user`` (which may be a ClaimsUser)."""
+    if not isinstance(user, TokenUser):
+        return user
+    pk = int(user.pk)
+    now = time.monotonic()
+    with _users_lock:
+        hit = _users.get(pk)
+        if hit and hit[0] > now:
+            return hit[1]
+    obj = User.objects.get(pk=pk)
+    with _users_lock:
+        if len(_users) >= getattr(settings, "AUTH_USER_CACHE_SIZE", 1024):
+            _users.clear()
+        _users[pk] = (now + getattr(settings, "AUTH_USER_CACHE_TTL", 60), obj)
+    return obj
+
+
+def _forget_user(sender, instance, **kwargs):
+    with _users_lock:
+        _users.pop(instance.pk, None)
+
+
+post_save.connect(_forget_user, sender=User, dispatch_uid="auth-user-cache-save")
+post_delete.connect(_forget_user, sender=User, dispatch_uid="auth-user-cache-delete")
+
+
+# ---------------------------
+# Login
+# ---------------------------
+
+LOGIN_FIELDS = (
+    "pk", "username", "email", "password", "is_active", "is_staff", "is_superuser",
+    "groups__pk", "groups__name", "diaspora_profile__owner_office_id",
+)
+
+
+def login_rows(identifier):
+    """One query: the matching user(s), one row per group, with the owning office."""
+    match = Q(username=identifier)
+    if "@" in identifier:
+        match |= Q(email=identifier)
+    return User.objects.filter(match).values_list(*LOGIN_FIELDS).order_by("pk", "groups__pk")
+
+
+def login_candidates(rows, identifier):
+    """
+    Fold login_rows() into (user, group names, office id) tuples: the username
+    match first, then e-mail matches – the order user_login has always tried.
+    """
+    found = {}
+    for pk, username, email, password, is_active, is_staff, is_superuser, _, group, office in rows:
+        if pk not in found:
+            user = User(pk=pk, username=username, email=email, password=password,
+                        is_active=is_active, is_staff=is_staff, is_superuser=is_superuser)
+            user._state.adding = False
+            found[pk] = (user, [], office)
+        if group:
+            found[pk][1].append(group)
+    return sorted(found.values(), key=lambda c: c[0].username != identifier)
+
+
+def verify_password(user, password):
+    """check_password + is_active, upgrading the stored hash if the hasher changed."""
+    def setter(raw):
+        user.set_password(raw)
+        User.objects.filter(pk=user.pk).update(password=user.password)
+    return check_password(password, user.password, setter) and user.is_active
+
+
+def login_payload(user, groups, office_id):
+    # an UPDATE rather than save(): no signals, and the row loaded by login_rows() is partial
+    user.last_login = timezone.now()
+    User.objects.filter(pk=user.pk).update(last_login=user.last_login)
+    refresh = DiasporaRefreshToken.for_user(user, groups=groups, office_id=office_id)
+    return {
+        'access': str(refresh.access_token),
+        'refresh': str(refresh),
+        'user_id': user.id,
+        'role': refresh["role"],
+    }
@@ -0,0 +1,198 @@
+# diaspora/compiled.py
+"""
+Compiled read path for the registry list endpoints.
+
+DRF serializes a list by walking every field object for every row. Here a
+serializer's field list is compiled once per serializer class and
+``?fields=``/``?expand=`` shape into
+
+- a ``values()`` projection of exactly the columns the serializer reads, and
+- a flat function turning one values() row into the dict the serializer
+  would have produced (nested objects included).
+
+The output is byte-identical to the serializer's. Computed fields declare
+their input lookups in ``Meta.field_sources`` and the function combining them
+in ``Meta.compiled_fields``; ``get_FOO_display`` sources are handled
+automatically. A field the compiler doesn't understand makes that shape fall
+back to the regular serializer. COMPILED_LIST_SERIALIZERS = False turns the
+fast path off.
+"""
+import json
+import re
+import threading
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.encoding import force_str
+from django.utils.hashable import make_hashable
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .instrumentation import serializer_timer
+
+# serializer fields whose to_representation() is the identity for values read from their column
+IDENTITY_FIELDS = {
+    serializers.CharField, serializers.EmailField, serializers.BooleanField, serializers.IntegerField,
+    serializers.ChoiceField, serializers.JSONField, serializers.ReadOnlyField,
+}
+DISPLAY_SOURCE = re.compile(r"^get_(\w+)_display$")
+
+
+class NotCompilable(Exception):
+    pass
+
+
+class CompiledSerializer:
+
+    def __init__(self, projection, to_dict):
+        self.projection = projection
+        self.to_dict = to_dict
+
+    def values(self, queryset):
+        """values() rows with the projection plus the ordering keys (read back by keyset cursors)."""
+        keys = [k.lstrip("-") for k in queryset.query.order_by if isinstance(k, str)]
+        return queryset.values(*dict.fromkeys([*self.projection, *keys, "pk"]))
+
+
+def _converter(field):
+    return None if type(field) in IDENTITY_FIELDS else field.to_representation
+
+
+def _column(path, projection, convert=None):
+    projection.append(path)
+    if convert is None:
+        return itemgetter(path)
+
+    def get(row):
+        value = row[path]
+        return None if value is None else convert(value)
+    return get
+
+
+def _computed(paths, fn, convert, projection):
+    projection.extend(paths)
+    convert = convert or (lambda value: value)
+
+    def get(row):
+        value = fn(*[row[p] for p in paths])
+        return None if value is None else convert(value)
+    return get
+
+
+def _display(path, model_field, convert, projection):
+    labels = dict(make_hashable(model_field.flatchoices))
+    projection.append(path)
+    convert = convert or (lambda value: value)
+
+    def get(row):
+        value = row[path]
+        value = force_str(labels.get(make_hashable(value), value), strings_only=True)
+        return None if value is None else convert(value)
+    return get
+
+
+def _nested(path, to_dict):
+    def get(row):
+        return None if row[path] is None else to_dict(row)
+    return get
+
+
+def _compile_field(name, field, meta, model, prefix, projection):
+    if isinstance(field, serializers.ListSerializer) or field.source == "*" or "." in field.source:
+        raise NotCompilable(name)
+    if isinstance(field, serializers.BaseSerializer):
+        related = model._meta.get_field(field.source).related_model
+        if related is None:
+            raise NotCompilable(name)
+        path = prefix + field.source
+        projection.append(path)
+        return _nested(path, _compile(field, related, path + "__", projection))
+    if name in getattr(meta, "compiled_fields", {}):
+        paths = [prefix + p for p in meta.field_sources[name]]
+        return _computed(paths, meta.compiled_fields[name], _converter(field), projection)
+    display = DISPLAY_SOURCE.match(field.source)
+    if display:
+        model_field = model._meta.get_field(display[1])
+        return _display(prefix + model_field.name, model_field, _converter(field), projection)
+
+    model_field = model._meta.get_field(field.source)
+    if not model_field.concrete or model_field.many_to_many:
+        raise NotCompilable(name)
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        return _column(prefix + field.source, projection)  # the FK column is the pk DRF renders
+    if isinstance(field, serializers.RelatedField):
+        raise NotCompilable(name)
+    return _column(prefix + field.source, projection, _converter(field))
+
+
+def _compile(serializer, model, prefix, projection):
+    meta = getattr(serializer, "Meta", None)
+    steps = [
+        (name, _compile_field(name, field, meta, model, prefix, projection))
+        for name, field in serializer.fields.items() if not field.write_only
+    ]
+
+    def to_dict(row):
+        return {name: get(row) for name, get in steps}
+    return to_dict
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def get_compiled(serializer_class, sparse=None):
+    """The CompiledSerializer for ``serializer_class`` in the given fieldset, or None if it can't be compiled."""
+    key = (serializer_class, json.dumps(sparse, sort_keys=True))
+    if key in _compiled:
+        return _compiled[key]
+    serializer = serializer_class(context={"sparse": sparse} if sparse else {})
+    try:
+        projection = []
+        to_dict = _compile(serializer, serializer.Meta.model, "", projection)
+        compiled = CompiledSerializer(list(dict.fromkeys(projection)), to_dict)
+    except (NotCompilable, FieldDoesNotExist):
+        compiled = None
+    with _compiled_lock:
+        if len(_compiled) >= 256:
+            _compiled.clear()
+        _compiled[key] = compiled
+    return compiled
+
+
+class CompiledListMixin:
+    """Serve the list action through the compiled serializer when its shape allows it."""
+
+    def list(self, request, *args, **kwargs):
+        compiled = self._compiled_list()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        return self._compiled_response(compiled, rows, page is not None)
+
+    async def alist(self, request, *args, **kwargs):
+        # values() rows and to_dict() never touch the database: only the fetch is awaited
+        compiled = self._compiled_list()
+        if compiled is None:
+            return await super().alist(request, *args, **kwargs)
+
+        queryset = compiled.values(await self.afilter_queryset(self.get_queryset()))
+        page = await self.apaginate_queryset(queryset)
+        rows = page if page is not None else [row async for row in queryset]
+        return self._compiled_response(compiled, rows, page is not None)
+
+    def _compiled_list(self):
+        if not getattr(settings, "COMPILED_LIST_SERIALIZERS", True):
+            return None
+        return get_compiled(self.get_serializer_class(), self.get_serializer_context().get("sparse"))
+
+    def _compiled_response(self, compiled, rows, paginated):
+        with serializer_timer():
+            data = [compiled.to_dict(row) for row in rows]
+        if paginated:
+            return self.get_paginated_response(data)
+        return Response(data)
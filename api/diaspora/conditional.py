@@ -0,0 +1,126 @@
+# diaspora/conditional.py
+"""
+Conditional GET (ETag / Last-Modified) for read endpoints.
+
+The validators are computed *before* the response is built, from a cheap
+query on the timestamp columns the representation depends on:
+
+- retrieve: ``values_list(*conditional_fields)`` for the one row;
+- list (opt-in via ``conditional_actions``): ``MAX(...)`` plus ``COUNT(*)``
+  over the filtered queryset, so deletes change the validator too. Lists
+  only get an ETag: a Last-Modified from ``MAX(updated_at)`` would not move
+  when a row is deleted.
+
+A client that sends back a matching ``If-None-Match`` / ``If-Modified-Since``
+gets ``304 Not Modified`` and nothing is fetched or serialized. The ETag also
+covers the query string, so ``?fields=``, ``?expand=`` and pagination get
+their own validators. It is weak: it tracks the rows' ``updated_at``, not
+the rendered bytes.
+
+Diaspora representations embed their User, which has no ``updated_at`` of
+its own. Views list the embedded user columns in ``conditional_values``:
+their current values go into the retrieve ETag, so editing a name changes
+the validator without touching the Diaspora row. Such a view serves an ETag
+only, like a list: no timestamp of the user's would move Last-Modified.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# User fields embedded in Diaspora representations (UserSlimSerializer); logins save last_login only
+EMBEDDED_USER_FIELDS = ("username", "email", "first_name", "last_name", "date_joined")
+
+
+class ConditionalGetMixin:
+    # timestamp lookups whose newest value dates the representation
+    conditional_fields = ("updated_at",)
+    # retrieve only: lookups without a timestamp of their own, compared by value through the ETag
+    conditional_values = ()
+    conditional_actions = ("retrieve",)
+    conditional_cache_control = "private, no-cache"
+
+    def list(self, request, *args, **kwargs):
+        if "list" not in self.conditional_actions:
+            return super().list(request, *args, **kwargs)
+        row = self.filter_queryset(self.get_queryset()).order_by().aggregate(**self._list_aggregates())
+        stamps = [row[f"m{i}"] for i in range(len(self.conditional_fields))]
+        return self._conditional(request, ("list", row["n"], *stamps), (), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if "retrieve" not in self.conditional_actions:
+            return super().retrieve(request, *args, **kwargs)
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        row = self._stamps(self.filter_queryset(self.get_queryset()), lookup).first()
+        if row is None:
+            return super().retrieve(request, *args, **kwargs)  # the usual 404
+        return self._conditional(request, (lookup, *row), self._dated(row), super().retrieve, *args, **kwargs)
+
+    # async twins (diaspora/async_views.py): the same validators, read through the async ORM
+
+    async def alist(self, request, *args, **kwargs):
+        if "list" not in self.conditional_actions:
+            return await super().alist(request, *args, **kwargs)
+        queryset = await self.afilter_queryset(self.get_queryset())
+        row = await queryset.order_by().aaggregate(**self._list_aggregates())
+        stamps = [row[f"m{i}"] for i in range(len(self.conditional_fields))]
+        return await self._aconditional(request, ("list", row["n"], *stamps), (), super().alist, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        if "retrieve" not in self.conditional_actions:
+            return await super().aretrieve(request, *args, **kwargs)
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        row = await self._stamps(await self.afilter_queryset(self.get_queryset()), lookup).afirst()
+        if row is None:
+            return await super().aretrieve(request, *args, **kwargs)
+        return await self._aconditional(request, (lookup, *row), self._dated(row), super().aretrieve, *args, **kwargs)
+
+    def _list_aggregates(self):
+        return dict(n=Count("pk"), **{f"m{i}": Max(f) for i, f in enumerate(self.conditional_fields)})
+
+    def _stamps(self, queryset, lookup):
+        try:
+            queryset = queryset.filter(**{self.lookup_field: lookup})
+        except (TypeError, ValueError, ValidationError):
+            queryset = queryset.none()  # a malformed id: left to get_object()'s 404
+        return queryset.order_by().values_list(*self.conditional_fields, *self.conditional_values)
+
+    def _dated(self, row):
+        # the stamps Last-Modified may come from: none if undated values feed the representation
+        return () if self.conditional_values else row
+
+    def _conditional(self, request, parts, stamps, render, *args, **kwargs):
+        etag, last_modified = self._validators(request, parts, stamps)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render(request, *args, **kwargs)
+            if not 200 <= response.status_code < 300:
+                return response
+        return self._with_validators(response, etag, last_modified)
+
+    async def _aconditional(self, request, parts, stamps, render, *args, **kwargs):
+        etag, last_modified = self._validators(request, parts, stamps)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await render(request, *args, **kwargs)
+            if not 200 <= response.status_code < 300:
+                return response
+        return self._with_validators(response, etag, last_modified)
+
+    def _validators(self, request, parts, stamps):
+        model = self.get_queryset().model._meta.label_lower
+        digest = hashlib.sha1(
+            "|".join(map(str, (model, request.get_full_path(), *parts))).encode()
+        ).hexdigest()
+        newest = max((s for s in stamps if s is not None), default=None)
+        return f'W/"{digest}"', int(newest.timestamp()) if newest else None
+
+    def _with_validators(self, response, etag, last_modified):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        response["Cache-Control"] = self.conditional_cache_control
+        return response
+
@@ -0,0 +1,169 @@
+# diaspora/facets.py
+"""
+Faceted counts for the registry filter sidebar.
+
+``GET /api/diasporas/facets/`` answers every facet (country, gender, returnee,
+language, owner office, case stage) for the current search and filters in one
+query. Instead of one GROUP BY per facet, the filtered set is scanned once and
+grouped by all facet columns together. That gives at most one row per distinct
+combination, so never more rows than the filtered set has. Each facet's counts
+are then summed from those rows in Python. Adding a facet adds a column, not a
+query.
+
+Countries are free text. ``country_canonical`` (kept by the save receivers
+below and set explicitly by the bulk paths) holds the normalized name, so
+"usa", "U.S.A." and "United States" are counted and filtered as one value.
+``manage.py normalize_countries`` backfills it.
+
+``FacetFilter`` applies the same facets as list filters (``?country=UK&gender=FEMALE``),
+so the sidebar's selection narrows the list, the export and the counts alike.
+"""
+import string
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Q
+from django.db.models.signals import post_save, pre_save
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.response import Response
+
+from .models import Diaspora
+from .offices import registry
+
+# facet / query param -> Diaspora lookup
+FACETS = {
+    "country": "country_canonical",
+    "gender": "gender",
+    "is_returnee": "is_returnee",
+    "preferred_language": "preferred_language",
+    "owner_office": "owner_office_id",
+    "case_stage": "case__current_stage",
+}
+
+# spellings seen in registrations -> the canonical name (keys casefolded, dots and extra spaces removed)
+COUNTRY_ALIASES = {
+    "us": "USA", "usa": "USA", "united states": "USA", "united states of america": "USA", "america": "USA",
+    "uk": "UK", "united kingdom": "UK", "great britain": "UK", "britain": "UK", "england": "UK",
+    "uae": "UAE", "united arab emirates": "UAE", "emirates": "UAE", "dubai": "UAE",
+    "ksa": "Saudi Arabia", "saudi": "Saudi Arabia", "saudi arabia": "Saudi Arabia",
+    "kingdom of saudi arabia": "Saudi Arabia",
+    "rsa": "South Africa", "south africa": "South Africa",
+    "deutschland": "Germany", "sverige": "Sweden", "norge": "Norway", "italia": "Italy",
+}
+
+BOOLEANS = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+
+
+def normalize_country(value):
+    """Canonical spelling of a free-text country: alias table, else capitalized words."""
+    value = " ".join((value or "").replace(".", "").split())
+    if not value:
+        return ""
+    return COUNTRY_ALIASES.get(value.casefold(), string.capwords(value))
+
+
+def facet_counts(queryset):
+    """
+    ``{"count": n, "facets": {facet: [{"value", "count"[, "label"]}, …]}}`` for
+    ``queryset``, from a single GROUP BY over all facet columns. Values are
+    ordered by count, most frequent first.
+    """
+    lookups = list(FACETS.values())
+    rows = queryset.order_by().values(*lookups).annotate(n=Count("pk"))
+    return _payload(rows)
+
+
+async def afacet_counts(queryset):
+    lookups = list(FACETS.values())
+    rows = [row async for row in queryset.order_by().values(*lookups).annotate(n=Count("pk"))]
+    # labels come from the office registry, which may have to (re)load it
+    return await sync_to_async(_payload)(rows)
+
+
+def _payload(rows):
+    counts = {facet: Counter() for facet in FACETS}
+    total = 0
+    for row in rows:
+        total += row["n"]
+        for facet, lookup in FACETS.items():
+            counts[facet][row[lookup]] += row["n"]
+
+    facets = {}
+    for facet, counter in counts.items():
+        facets[facet] = [
+            {"value": value, "count": n}
+            for value, n in sorted(counter.items(), key=lambda item: (-item[1], str(item[0])))
+        ]
+    offices = registry.in_bulk({e["value"] for e in facets["owner_office"]})
+    for entry in facets["owner_office"]:
+        office = offices.get(entry["value"])
+        entry["label"] = office.name if office else None
+    return {"count": total, "facets": facets}
+
+
+class FacetFilter(BaseFilterBackend):
+    """
+    ``?<facet>=value`` for every facet in ``FACETS``; repeat the parameter or
+    comma-separate values to match any of them. ``null`` matches unset values
+    (no country, no gender, no owner office, no case).
+    """
+
+    def _values(self, request, facet):
+        values = []
+        for raw in request.query_params.getlist(facet):
+            values.extend(v.strip() for v in raw.split(",") if v.strip())
+        null = "null" in values
+        values = [v for v in values if v != "null"]
+        if facet == "country":
+            values = [normalize_country(v) for v in values]
+        elif facet == "is_returnee":
+            try:
+                values = [BOOLEANS[v.lower()] for v in values]
+            except KeyError:
+                raise ValidationError({facet: "Expected true or false."})
+        elif facet == "owner_office" and not all(v.isdigit() for v in values):
+            raise ValidationError({facet: "Expected office ids."})
+        return values, null
+
+    def filter_queryset(self, request, queryset, view):
+        for facet, lookup in FACETS.items():
+            values, null = self._values(request, facet)
+            if not values and not null:
+                continue
+            condition = Q(**{f"{lookup}__in": values}) if values else Q()
+            if null:
+                # a blank country is stored as "", the other facets' unset values as NULL
+                condition |= Q(**{lookup: ""}) if facet == "country" else Q(**{f"{lookup}__isnull": True})
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+class FacetMixin:
+    """
+    Adds ``GET <list>/facets/`` to the Diaspora viewset: facet counts over the
+    list's search and filters (include ``FacetFilter`` in ``filter_backends``).
+    """
+
+    @action(detail=False, methods=["GET"])
+    def facets(self, request):
+        return Response(facet_counts(self.filter_queryset(self.get_queryset())))
+
+    async def afacets(self, request):
+        return Response(await afacet_counts(await self.afilter_queryset(self.get_queryset())))
+
+
+def _normalize(sender, instance, raw=False, **kwargs):
+    instance.country_canonical = normalize_country(instance.country_of_residence)
+
+
+def _save_canonical(sender, instance, raw=False, update_fields=None, **kwargs):
+    # save(update_fields=[..., "country_of_residence"]) doesn't write the field
+    # _normalize just set, and pre_save can't add to the frozenset: write it here
+    if update_fields and "country_of_residence" in update_fields and "country_canonical" not in update_fields:
+        Diaspora.objects.filter(pk=instance.pk).update(country_canonical=instance.country_canonical)
+
+
+pre_save.connect(_normalize, sender=Diaspora, dispatch_uid="facets-normalize-country")
+post_save.connect(_save_canonical, sender=Diaspora, dispatch_uid="facets-save-canonical-country")
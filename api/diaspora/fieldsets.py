@@ -0,0 +1,173 @@
+# diaspora/fieldsets.py
+"""
+Sparse fieldsets (``?fields=``) and opt-in expansion (``?expand=``) for the
+read serializers.
+
+    /api/cases/?fields=id,current_stage,overall_status,diaspora.full_name
+    /api/referrals/?expand=to_office,case.diaspora
+
+- ``fields`` keeps only the listed fields; a dotted name reaches into a
+  nested object (and implies expanding it).
+- ``expand`` renders a relation as its nested object instead of its primary
+  key. ``Meta.default_expand`` keeps the shapes the API has always returned
+  (a case embeds its diaspora, a diaspora its user).
+
+On list/retrieve the viewset mixin trims the queryset to the same shape with
+``only()`` / ``select_related()``, so unrequested columns and joins are never
+fetched. Serializer fields that are not plain model fields declare the
+lookups they read in ``Meta.field_sources``.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .instrumentation import serializer_timer
+
+
+def parse_spec(value):
+    """``"a,b.c,b.d"`` -> ``{"a": {}, "b": {"c": {}, "d": {}}}``; None when empty/absent."""
+    if not value:
+        return None
+    tree = {}
+    for path in value.split(","):
+        node = tree
+        for part in path.strip().split("."):
+            if part.strip():
+                node = node.setdefault(part.strip(), {})
+    return tree or None
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer side. ``Meta.expandable`` maps relation names to the serializer
+    used when expanded; the fieldset comes from the ``fields``/``expand``
+    kwargs (nested serializers) or the ``sparse`` context set by the view.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and expand is None:
+            fields, expand = self._context.get("sparse") or (None, None)
+        self._wanted = fields
+        self._expand = expand or {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        meta = self.Meta
+        expandable = getattr(meta, "expandable", {})
+        wanted = self._wanted
+
+        unknown = sorted(set(wanted or ()) - set(fields))
+        if unknown:
+            raise ValidationError({"fields": [f"Unknown field(s): {', '.join(unknown)}."]})
+        unknown = sorted(set(self._expand) - set(expandable))
+        if unknown:
+            raise ValidationError({"expand": [f"Cannot expand: {', '.join(unknown)}."]})
+
+        expand = {name: {} for name in getattr(meta, "default_expand", ())}
+        expand.update(self._expand)
+        for name in list(fields):
+            field = fields[name]
+            if wanted is not None and name not in wanted and not field.write_only:
+                del fields[name]
+                continue
+            if name not in expandable:
+                continue
+            sub = wanted.get(name) if wanted else None
+            if name in expand or sub:
+                fields[name] = expandable[name](read_only=True, fields=sub or None, expand=expand.get(name, {}))
+            elif isinstance(field, serializers.BaseSerializer):
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+# ---------------------------
+# Queryset shaping
+# ---------------------------
+
+def _add_path(model, prefix, path, lookups, joins):
+    """Add a ``a__b__c`` lookup (and the joins it walks); False if it isn't a forward field path."""
+    parts = path.split("__")
+    for i, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return False
+        if not field.concrete or field.many_to_many:
+            return False
+        lookups.add(prefix + part)
+        if field.is_relation and i < len(parts) - 1:
+            joins.add(prefix + part)
+            prefix += part + "__"
+            model = field.related_model
+            lookups.add(prefix + model._meta.pk.name)
+    return True
+
+
+def _all_columns(model, prefix, lookups):
+    for field in model._meta.concrete_fields:
+        lookups.add(prefix + field.name)
+
+
+def _plan(serializer, model, prefix, lookups, joins):
+    lookups.add(prefix + model._meta.pk.name)
+    sources = getattr(serializer.Meta, "field_sources", {})
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.ListSerializer):
+            _all_columns(model, prefix, lookups)
+        elif isinstance(field, serializers.BaseSerializer):
+            path = prefix + field.source
+            joins.add(path)
+            lookups.add(path)
+            _plan(field, model._meta.get_field(field.source).related_model, path + "__", lookups, joins)
+        else:
+            paths = sources.get(name, (field.source.replace(".", "__"),))
+            if not all(_add_path(model, prefix, p, lookups, joins) for p in paths):
+                _all_columns(model, prefix, lookups)
+
+
+def shape_queryset(queryset, serializer):
+    """only()/select_related() for exactly what ``serializer`` (and the ordering) reads."""
+    lookups, joins = set(), set()
+    _plan(serializer, queryset.model, "", lookups, joins)
+    for key in queryset.query.order_by:
+        if isinstance(key, str):
+            # keyset pagination reads the ordering values back off the last row
+            _add_path(queryset.model, "", key.lstrip("-"), lookups, joins)
+    queryset = queryset.select_related(None)
+    if joins:
+        queryset = queryset.select_related(*sorted(joins))
+    return queryset.only(*sorted(lookups))
+
+
+class SparseFieldsetViewMixin:
+    """Viewset side: parses ?fields=/?expand= and shapes the queryset on read actions."""
+    fields_param = "fields"
+    expand_param = "expand"
+    sparse_actions = ("list", "retrieve")
+
+    def get_sparse_fieldset(self):
+        if getattr(self, "action", None) not in self.sparse_actions:
+            return None
+        params = self.request.query_params
+        return parse_spec(params.get(self.fields_param)), parse_spec(params.get(self.expand_param))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        sparse = self.get_sparse_fieldset()
+        if sparse is not None:
+            context["sparse"] = sparse
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.get_sparse_fieldset() is None:
+            return queryset
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return shape_queryset(queryset, serializer)
@@ -0,0 +1,34 @@
+# diaspora/filters.py
+from datetime import datetime
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .reports import datetime_window
+
+
+class CreatedWindowFilter(BaseFilterBackend):
+    """
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD on ``created_at`` (both bounds optional and
+    inclusive), applied as a half-open datetime range so the created_at index is used.
+    """
+    from_param = "from"
+    to_param = "to"
+
+    def _date(self, request, param):
+        value = request.query_params.get(param)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, "%Y-%m-%d").date()
+        except ValueError:
+            raise ValidationError({param: "Expected a date in YYYY-MM-DD format."})
+
+    def filter_queryset(self, request, queryset, view):
+        from_date = self._date(request, self.from_param)
+        to_date = self._date(request, self.to_param)
+        if from_date:
+            queryset = queryset.filter(created_at__gte=datetime_window(from_date, from_date)[0])
+        if to_date:
+            queryset = queryset.filter(created_at__lt=datetime_window(to_date, to_date)[1])
+        return queryset
@@ -0,0 +1,51 @@
+# diaspora/hashing.py
+"""
+Bounded executor for password hashing / verification off the event loop.
+
+PBKDF2 releases the GIL, so a small thread pool hashes in parallel while the
+ASGI event loop keeps serving other requests. Admission is capped at
+MAX_WORKERS running + MAX_QUEUE waiting; anything beyond that is rejected
+straight away (HashingBusy -> 503) instead of queueing without bound.
+
+Configured with settings.PASSWORD_HASHING = {"MAX_WORKERS": .., "MAX_QUEUE": ..}.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingGate:
+
+    def __init__(self, max_workers=4, max_queue=64):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pwhash")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._slots.release()
+
+
+_gate = None
+_gate_lock = threading.Lock()
+
+
+def get_gate():
+    global _gate
+    if _gate is None:
+        with _gate_lock:
+            if _gate is None:
+                conf = getattr(settings, "PASSWORD_HASHING", {})
+                _gate = HashingGate(conf.get("MAX_WORKERS", 4), conf.get("MAX_QUEUE", 64))
+    return _gate
@@ -0,0 +1,110 @@
+# diaspora/ids.py
+"""
+Sequence-backed diaspora_id allocation: HR-DIAS-YYYY-NNNNNN.
+
+Each process reserves a block of numbers per year with one atomic UPDATE of
+DiasporaIdSequence and hands them out from memory, so inserts never collide
+and most of them cost no extra query. Numbers left in a block when the
+process exits are simply skipped.
+
+A block reserved inside a transaction is only kept for later use once that
+transaction commits – if it rolls back, the sequence row rolls back too and
+another process may be handed the same numbers.
+
+Legacy ids (4 hex characters) are shorter than the 6-digit numbers and can
+never clash with them.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import Diaspora, DiasporaIdSequence
+
+WIDTH = 6
+
+
+def format_id(year, number):
+    return f"HR-DIAS-{year}-{number:0{WIDTH}d}"
+
+
+def _first_free(year, using):
+    """Seed for a year with no sequence row yet: one past the highest id already issued."""
+    prefix = format_id(year, 0)[:-WIDTH]
+    last = (
+        Diaspora.objects.using(using)
+        .annotate(id_length=Length("diaspora_id"))
+        .filter(diaspora_id__startswith=prefix, id_length=len(prefix) + WIDTH)
+        .order_by("-diaspora_id").values_list("diaspora_id", flat=True).first()
+    )
+    return int(last[len(prefix):]) + 1 if last else 1
+
+
+def reserve(year, size, using):
+    """Atomically reserve ``size`` numbers for ``year``; returns the half-open range (start, end)."""
+    seq = DiasporaIdSequence.objects.using(using)
+    with transaction.atomic(using=using):
+        if not seq.filter(year=year).update(next_value=F("next_value") + size):
+            try:
+                with transaction.atomic(using=using):
+                    seq.create(year=year, next_value=_first_free(year, using) + size)
+            except IntegrityError:  # another process created the row first
+                seq.filter(year=year).update(next_value=F("next_value") + size)
+        end = seq.filter(year=year).values_list("next_value", flat=True).get()
+    return end - size, end
+
+
+class BlockAllocator:
+
+    def __init__(self, block_size=None):
+        self._block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}  # (db alias, year) -> [next, end)
+
+    @property
+    def block_size(self):
+        return self._block_size or getattr(settings, "DIASPORA_ID_BLOCK_SIZE", 100)
+
+    def take(self, n, year=None, using=None):
+        """``n`` fresh diaspora_ids; reserves at most one new block."""
+        year = year or timezone.now().year
+        using = using or router.db_for_write(Diaspora)
+        key = (using, year)
+        with self._lock:
+            block = self._blocks.get(key)
+            numbers = []
+            if block:
+                k = min(n, block[1] - block[0])
+                numbers = list(range(block[0], block[0] + k))
+                block[0] += k
+        missing = n - len(numbers)
+        if missing:
+            start, end = reserve(year, max(missing, self.block_size), using)
+            numbers += range(start, start + missing)
+            if start + missing < end:
+                spare = [start + missing, end]
+                if transaction.get_connection(using).in_atomic_block:
+                    transaction.on_commit(lambda: self._keep(key, spare), using=using)
+                else:
+                    self._keep(key, spare)
+        return [format_id(year, i) for i in numbers]
+
+    def _keep(self, key, spare):
+        with self._lock:
+            block = self._blocks.get(key)
+            if not block or block[0] >= block[1]:
+                self._blocks[key] = spare
+
+
+allocator = BlockAllocator()
+
+
+def next_diaspora_id():
+    return allocator.take(1)[0]
+
+
+def take_diaspora_ids(n):
+    return allocator.take(n)
@@ -0,0 +1,273 @@
+# diaspora/importer.py
+"""
+Bulk diaspora import from CSV / XLSX (embassy spreadsheets).
+
+Rows are processed in chunks. Each chunk is validated in memory, its
+passwords are hashed in parallel (PBKDF2 dominates the cost of a
+registration), and then its User rows, 'Diaspora' group memberships and
+Diaspora rows are written with bulk_create in one transaction. Bad rows are
+skipped and reported with their spreadsheet row number; they never abort
+the chunk. If the chunk still hits a unique constraint (an account created
+meanwhile), its rows are retried one by one and the clashing ones reported.
+
+Hashing runs in a process pool from ``manage.py import_diasporas``; the upload
+endpoint uses threads instead (``processes=False``) so a web worker never
+forks. PBKDF2 releases the GIL, so threads hash in parallel too.
+
+bulk_create sends no model signals, so the rollups, search index and report
+cache are updated explicitly for every committed chunk.
+"""
+import csv
+import io
+import os
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from rest_framework import serializers
+
+from .models import Office, Diaspora
+from .ids import take_diaspora_ids
+from .facets import normalize_country
+from . import rollups, report_cache, search
+
+User = get_user_model()
+
+DEFAULT_PASSWORD = "123456"  # same fallback as DiasporaWriteSerializer.create
+
+
+class DiasporaImportRowSerializer(serializers.Serializer):
+    """One spreadsheet row. Flat user columns + Diaspora columns; no per-row DB validators."""
+    email = serializers.EmailField()
+    username = serializers.CharField(required=False, allow_blank=True, max_length=150)
+    first_name = serializers.CharField(required=False, allow_blank=True, max_length=150)
+    last_name = serializers.CharField(required=False, allow_blank=True, max_length=150)
+    password = serializers.CharField(required=False, allow_blank=True, write_only=True)
+
+    gender = serializers.ChoiceField(choices=Diaspora.Gender.choices, required=False, allow_blank=True, allow_null=True)
+    dob = serializers.DateField(required=False, allow_null=True)
+    primary_phone = serializers.CharField(required=False, allow_blank=True, max_length=20)
+    whatsapp = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=20)
+    country_of_residence = serializers.CharField(required=False, allow_blank=True, max_length=80)
+    city_of_residence = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=120)
+    arrival_date = serializers.DateField(required=False, allow_null=True)
+    expected_stay_duration = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=50)
+    is_returnee = serializers.BooleanField(required=False, default=False)
+    preferred_language = serializers.CharField(required=False, allow_blank=True, max_length=30)
+    communication_opt_in = serializers.BooleanField(required=False, default=True)
+    address_local = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    emergency_contact_name = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=120)
+    emergency_contact_phone = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=20)
+    passport_no = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=50)
+    id_number = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=50)
+    owner_office = serializers.CharField(required=False, allow_blank=True, allow_null=True)  # id or code
+
+    USER_FIELDS = ("email", "username", "first_name", "last_name", "password")
+
+    def to_internal_value(self, data):
+        # spreadsheets give "" for empty cells; treat them as missing so defaults/nulls apply
+        data = {k: v for k, v in data.items() if k and v not in ("", None)}
+        for k, v in data.items():
+            if isinstance(v, datetime):  # XLSX date cells
+                data[k] = v.date()
+        return super().to_internal_value(data)
+
+
+# ---------------------------
+# Reading
+# ---------------------------
+
+def read_rows(fileobj, filename):
+    """Yield dicts keyed by the (lower-cased) header row of a .csv or .xlsx file."""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("XLSX import requires the 'openpyxl' package; upload a CSV instead.")
+        sheet = load_workbook(fileobj, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+        headers = [str(h or "").strip().lower() for h in next(rows, [])]
+        for values in rows:
+            if any(v not in (None, "") for v in values):
+                yield {h: ("" if v is None else v) for h, v in zip(headers, values)}
+        return
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="") if not isinstance(fileobj, io.TextIOBase) else fileobj
+    reader = csv.DictReader(text)
+    reader.fieldnames = [(h or "").strip().lower() for h in reader.fieldnames or []]
+    yield from reader
+
+
+# ---------------------------
+# Password hashing
+# ---------------------------
+
+def _init_worker(settings_module):
+    # spawn-based platforms start workers without Django configured
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+    django.setup()
+
+
+def _hash(password):
+    return make_password(password)
+
+
+class PasswordHasherPool:
+    """make_password() fanned out over worker processes (or threads); inline when workers <= 1."""
+
+    def __init__(self, workers=None, processes=True):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.processes = processes
+        self._pool = None
+
+    def __enter__(self):
+        if self.workers > 1 and self.processes:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker,
+                initargs=(os.environ.get("DJANGO_SETTINGS_MODULE", "api.settings"),),
+            )
+        elif self.workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="import-hash")
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool:
+            self._pool.shutdown()
+
+    def hash_many(self, passwords):
+        if not self._pool:
+            return [_hash(p) for p in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._pool.map(_hash, passwords, chunksize=chunksize))
+
+
+# ---------------------------
+# Import
+# ---------------------------
+
+class DiasporaImporter:
+
+    def __init__(self, created_by=None, chunk_size=1000, workers=None, processes=True, dry_run=False):
+        self.created_by = created_by
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.processes = processes
+        self.dry_run = dry_run
+        self.offices = {}
+        for pk, code in Office.objects.values_list("pk", "code"):
+            self.offices[str(pk)] = pk
+            self.offices[code.lower()] = pk
+        self.seen_emails, self.seen_usernames = set(), set()
+        self.report = {"rows": 0, "created": 0, "failed": 0, "errors": []}
+
+    def run(self, rows):
+        group = None if self.dry_run else Group.objects.get_or_create(name="Diaspora")[0]
+        numbered = enumerate(rows, start=2)  # row 1 is the header
+        with PasswordHasherPool(1 if self.dry_run else self.workers, self.processes) as hasher:
+            while True:
+                chunk = list(islice(numbered, self.chunk_size))
+                if not chunk:
+                    break
+                self._import_chunk(chunk, group, hasher)
+        self.report["errors"].sort(key=lambda e: e["row"])
+        return self.report
+
+    def _error(self, rowno, errors):
+        self.report["failed"] += 1
+        self.report["errors"].append({"row": rowno, "errors": errors})
+
+    def _validate(self, chunk):
+        valid = []
+        for rowno, raw in chunk:
+            self.report["rows"] += 1
+            ser = DiasporaImportRowSerializer(data=raw)
+            if not ser.is_valid():
+                self._error(rowno, ser.errors)
+                continue
+            data = dict(ser.validated_data)
+            data["email"] = data["email"].strip().lower()
+            data["username"] = (data.get("username") or data["email"]).strip()
+            office = data.pop("owner_office", None)
+            if office:
+                data["owner_office_id"] = self.offices.get(str(office).strip().lower())
+                if data["owner_office_id"] is None:
+                    self._error(rowno, {"owner_office": [f"Unknown office '{office}'."]})
+                    continue
+            if data["email"] in self.seen_emails:
+                self._error(rowno, {"email": ["Duplicate of an earlier row in this file."]})
+                continue
+            if data["username"].lower() in self.seen_usernames:
+                self._error(rowno, {"username": ["Duplicate of an earlier row in this file."]})
+                continue
+            self.seen_emails.add(data["email"])
+            self.seen_usernames.add(data["username"].lower())
+            valid.append((rowno, data))
+
+        # one query each for clashes with existing accounts
+        emails = [d["email"] for _, d in valid]
+        usernames = [d["username"] for _, d in valid]
+        # stored emails may have any case; the file's are lower-cased above
+        taken_emails = set(
+            User.objects.annotate(email_lower=Lower("email")).filter(email_lower__in=emails)
+            .values_list("email_lower", flat=True)
+        )
+        taken_usernames = set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+        result = []
+        for rowno, data in valid:
+            if data["email"] in taken_emails:
+                self._error(rowno, {"email": ["An account with this email already exists."]})
+            elif data["username"] in taken_usernames:
+                self._error(rowno, {"username": ["This username is already taken."]})
+            else:
+                result.append((rowno, data))
+        return result
+
+    def _import_chunk(self, chunk, group, hasher):
+        valid = self._validate(chunk)
+        if self.dry_run or not valid:
+            return
+
+        hashes = hasher.hash_many([d.get("password") or DEFAULT_PASSWORD for _, d in valid])
+        rows = []
+        for (rowno, data), password in zip(valid, hashes):
+            user_data = {f: data.pop(f, "") for f in DiasporaImportRowSerializer.USER_FIELDS}
+            user_data.update(password=password, first_name=user_data["first_name"] or "", last_name=user_data["last_name"] or "")
+            rows.append((rowno, user_data, data))
+
+        try:
+            with transaction.atomic():
+                created = self._write(rows, group)
+        except IntegrityError:
+            created = 0
+            for rowno, user_data, data in rows:
+                try:
+                    with transaction.atomic():
+                        created += self._write([(rowno, user_data, data)], group)
+                except IntegrityError:
+                    self._error(rowno, {"non_field_errors": ["Clashes with an account created during the import."]})
+        self.report["created"] += created
+
+    def _write(self, rows, group):
+        users = [User(**user_data) for _, user_data, _ in rows]
+        User.objects.bulk_create(users)
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=u.pk, group_id=group.pk) for u in users]
+        )
+        diasporas = [
+            Diaspora(
+                user=u, diaspora_id=diaspora_id, created_by=self.created_by,
+                country_canonical=normalize_country(data.get("country_of_residence")), **data,
+            )
+            for u, diaspora_id, (_, _, data) in zip(users, take_diaspora_ids(len(users)), rows)
+        ]
+        Diaspora.objects.bulk_create(diasporas)
+        rollups.add(Diaspora, diasporas)
+        pks = [d.pk for d in diasporas]
+        transaction.on_commit(lambda: search.safe_reindex(pks, fresh=True))
+        transaction.on_commit(lambda: report_cache.bump(Diaspora))
+        return len(diasporas)
@@ -0,0 +1,229 @@
+# diaspora/instrumentation.py
+"""
+Per-request query and timing instrumentation.
+
+``RequestInstrumentationMiddleware`` collects, for every request:
+
+- the number of queries and the time spent executing them,
+- duplicate queries: statements run more than once with the same shape
+  (parameters, numbers and IN-list lengths ignored) – the N+1 signature,
+- time spent in serializers (SparseFieldsetMixin serializers and the
+  compiled list path) and in rendering,
+
+and reports them in a ``Server-Timing`` header (visible in the browser's
+network panel) and one JSON log line on the ``diaspora.requests`` logger –
+at WARNING when a statement repeats ``REQUEST_DUPLICATE_QUERY_WARN`` times.
+
+Queries are counted by a DB execute wrapper installed on every connection,
+which reports to the ``collect()`` block active in the current context, so
+queries made through sync_to_async threads count too. ``query_budget()`` uses
+the same collector to fail a block that runs more queries than allowed;
+viewsets declare their budgets in ``query_budget``; the tests in
+diaspora/tests.py enforce them on fixtures and ``manage.py check_query_budgets``
+on a real (seeded) database.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+
+logger = logging.getLogger("diaspora.requests")
+
+_current = ContextVar("diaspora_request_stats", default=None)
+
+_IN_LIST = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+def fingerprint(sql):
+    """Statement shape: placeholders already stand in for values; fold IN-lists and inlined numbers."""
+    return _NUMBER.sub("?", _IN_LIST.sub("(...)", sql))
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.statements = Counter()
+        self._serializing = False
+
+    def duplicates(self):
+        return {sql: n for sql, n in self.statements.most_common() if n > 1}
+
+    def record(self, sql, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        self.statements[fingerprint(sql)] += 1
+
+
+def _execute(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record(sql, time.perf_counter() - start)
+
+
+def _install(connection):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _install(connection)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid="diaspora-instrumentation")
+
+
+@contextmanager
+def collect():
+    """Count the queries (and serializer time) of the enclosed block; nests."""
+    for connection in connections.all(initialized_only=True):
+        _install(connection)
+    outer = _current.get()
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.queries += stats.queries
+            outer.db_time += stats.db_time
+            outer.serializer_time += stats.serializer_time
+            outer.statements.update(stats.statements)
+
+
+@contextmanager
+def serializer_timer():
+    """Add the enclosed block, less its queries, to the request's serializer time (outermost block only)."""
+    stats = _current.get()
+    if stats is None or stats._serializing:
+        yield
+        return
+    stats._serializing = True
+    start, db_time = time.perf_counter(), stats.db_time
+    try:
+        yield
+    finally:
+        # lazy queries run while serializing are DB time, not serializer time
+        stats.serializer_time += time.perf_counter() - start - (stats.db_time - db_time)
+        stats._serializing = False
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(limit, label="block"):
+    """Raise QueryBudgetExceeded if the enclosed block runs more than ``limit`` queries."""
+    with collect() as stats:
+        yield stats
+    if stats.queries > limit:
+        detail = "\n".join(f"  {n}x {sql}" for sql, n in stats.statements.most_common(10))
+        raise QueryBudgetExceeded(f"{label}: {stats.queries} queries, budget {limit}\n{detail}")
+
+
+def budget_url(viewset, basename, action):
+    """URL to GET for ``action`` of a router-registered ``viewset``; None if there's no row to retrieve."""
+    extra = {a.__name__: a for a in viewset.get_extra_actions()}
+    if action == "list":
+        return reverse(f"{basename}-list")
+    if action == "retrieve" or (action in extra and extra[action].detail):
+        pk = viewset.queryset.order_by("pk").values_list("pk", flat=True).first()
+        if pk is None:
+            return None
+        name = "detail" if action == "retrieve" else extra[action].url_name
+        return reverse(f"{basename}-{name}", kwargs={"pk": pk})
+    return reverse(f"{basename}-{extra[action].url_name}")
+
+
+# ---------------------------
+# Middleware
+# ---------------------------
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, "REQUEST_SERVER_TIMING", True)
+        self.duplicate_warn = getattr(settings, "REQUEST_DUPLICATE_QUERY_WARN", 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with collect() as stats:
+            response = self.get_response(request)
+        return self._report(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with collect() as stats:
+            response = await self.get_response(request)
+        return self._report(request, response, stats, time.perf_counter() - start)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns; time that separately
+        stats = _current.get()
+        if stats is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                stats.render_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def _report(self, request, response, stats, total):
+        duplicates = stats.duplicates()
+        repeated = sum(n - 1 for n in duplicates.values())
+        app = max(0.0, total - stats.db_time - stats.serializer_time - stats.render_time)
+        if self.server_timing:
+            response["Server-Timing"] = ", ".join([
+                f'db;dur={_ms(stats.db_time)};desc="{stats.queries} queries, {repeated} repeated"',
+                f"serializer;dur={_ms(stats.serializer_time)}",
+                f"render;dur={_ms(stats.render_time)}",
+                f"app;dur={_ms(app)}",
+                f"total;dur={_ms(total)}",
+            ])
+        worst = max(duplicates.values(), default=0)
+        level = logging.WARNING if worst >= self.duplicate_warn else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "total_ms": _ms(total),
+                "queries": stats.queries,
+                "db_ms": _ms(stats.db_time),
+                "serializer_ms": _ms(stats.serializer_time),
+                "render_ms": _ms(stats.render_time),
+                "duplicates": [{"count": n, "sql": sql[:300]} for sql, n in list(duplicates.items())[:5]],
+            }))
+        return response
@@ -0,0 +1,228 @@
+# diaspora/management/commands/bench_api.py
+import json
+import platform
+import statistics
+import subprocess
+import time
+import uuid
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from diaspora import report_cache
+from diaspora.instrumentation import collect
+from diaspora.management.commands.bench_login_storm import percentile
+from diaspora.models import Office, Diaspora, Purpose, Case, Referral, Announcement
+from diaspora.urls import router
+
+User = get_user_model()
+
+# endpoints dominated by password hashing get fewer requests (--hashing-requests)
+HASHING = ("login", "public_register")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API endpoint in-process through the full middleware stack: router lists, "
+        "details, searches and creates, each report action (cold cache), login and public "
+        "registration. Reports throughput, p50/p95/p99 latency and query counts as JSON; "
+        "--compare prints the change against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="measured requests per endpoint")
+        parser.add_argument("--warmup", type=int, default=3, help="unmeasured requests per endpoint")
+        parser.add_argument("--hashing-requests", type=int, default=10,
+                            help="measured requests for login/registration (password hashing dominates)")
+        parser.add_argument("--min-diasporas", type=int, default=0,
+                            help="top the dataset up with seed_diaspora --diasporas first")
+        parser.add_argument("--only", action="append", help="substring of the endpoint names to run")
+        parser.add_argument("--output", help="also write the JSON report to this file")
+        parser.add_argument("--compare", help="earlier JSON report to diff against")
+
+    def handle(self, *args, **options):
+        missing = options["min_diasporas"] - Diaspora.objects.count()
+        if missing > 0:
+            call_command("seed_diaspora", diasporas=missing, stdout=self.stdout)
+        if not Diaspora.objects.exists():
+            raise CommandError("No data to benchmark against; run seed_diaspora --diasporas N first.")
+
+        self.password = uuid.uuid4().hex
+        self.user = User.objects.create_superuser(
+            username=f"bench-{uuid.uuid4().hex[:8]}", email="", password=self.password,
+        )
+        self.created = []
+        try:
+            self.client = Client()
+            token = self.client.post(
+                "/api/login/", {"username": self.user.username, "password": self.password},
+                content_type="application/json",
+            ).json()["access"]
+            self.client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+            results = {}
+            for name, scenario in self.scenarios(options):
+                if options["only"] and not any(s in name for s in options["only"]):
+                    continue
+                results[name] = self.measure(name, scenario, options)
+                self.stderr.write(f"  {name}: p50 {results[name]['p50_ms']} ms, {results[name]['queries']['median']} queries")
+        finally:
+            self.cleanup()
+
+        report = {"meta": self.meta(options), "endpoints": results}
+        data = json.dumps(report, indent=2)
+        self.stdout.write(data)
+        if options["output"]:
+            Path(options["output"]).write_text(data)
+        if options["compare"]:
+            self.stdout.write(self.compare(json.loads(Path(options["compare"]).read_text()), report))
+
+    # ---------------------------
+    # Scenarios: name -> callable(i) that makes request i and returns the response
+    # ---------------------------
+
+    def scenarios(self, options):
+        n = options["requests"] + options["warmup"]
+        get = self.client.get
+        for prefix, viewset, basename in router.registry:
+            if prefix == "reports":
+                continue
+            pks = [str(pk) for pk in viewset.queryset.order_by().values_list("pk", flat=True)[:n]]
+            yield f"{prefix}.list", lambda i, b=basename: get(reverse(f"{b}-list"))
+            if pks:
+                yield f"{prefix}.detail", lambda i, b=basename, pks=pks: get(reverse(f"{b}-detail", args=[pks[i % len(pks)]]))
+            if getattr(viewset, "search_fields", None):
+                terms = self.search_terms(n)
+                yield f"{prefix}.search", lambda i, b=basename, terms=terms: get(reverse(f"{b}-list"), {"search": terms[i % len(terms)]})
+
+        reports_viewset = dict((p, v) for p, v, _ in router.registry)["reports"]
+        for action in reports_viewset.get_extra_actions():
+            if action.__name__ == "cache_stats":
+                continue
+            yield f"reports.{action.__name__}", lambda i, a=action: self.cold_report(reverse(f"reports-{a.url_name}"))
+
+        yield from self.create_scenarios()
+
+        body = {"username": self.user.username, "password": self.password}
+        yield "login", lambda i: self.client.post("/api/login/", body, content_type="application/json")
+        yield "login.async", lambda i: self.client.post("/api/async/login/", body, content_type="application/json")
+        yield "public_register", lambda i: self.register("/api/public/register/")
+        yield "public_register.async", lambda i: self.register("/api/async/public/register/")
+
+    def create_scenarios(self):
+        offices = list(Office.objects.values_list("pk", flat=True)[:2])
+        diasporas = [str(pk) for pk in Diaspora.objects.values_list("pk", flat=True)[:100]]
+        cases = list(Case.objects.values_list("pk", flat=True)[:100])
+        post = self.client.post
+        yield "announcements.create", lambda i: self.keep(Announcement, post(
+            "/api/announcements/", {"title": f"Bench {i}", "content": "Benchmark announcement."},
+            content_type="application/json",
+        ))
+        if diasporas:
+            yield "purposes.create", lambda i: self.keep(Purpose, post(
+                "/api/purposes/", {"diaspora": diasporas[i % len(diasporas)], "type": "TOURISM", "description": "bench"},
+                content_type="application/json",
+            ))
+        if cases and len(offices) == 2:
+            yield "referrals.create", lambda i: self.keep(Referral, post(
+                "/api/referrals/", {"case": cases[i % len(cases)], "from_office": offices[0],
+                                    "to_office": offices[1], "reason": "bench"},
+                content_type="application/json",
+            ))
+
+    def search_terms(self, n):
+        names = User.objects.exclude(last_name="").values_list("last_name", flat=True).distinct()[:max(5, n // 5)]
+        return list(names) or ["a"]
+
+    def cold_report(self, url):
+        report_cache.bump(*report_cache.DEPENDENCIES)
+        return self.client.get(url)
+
+    def register(self, path):
+        username = f"bench-{uuid.uuid4().hex[:12]}"
+        response = self.client.post(path, {
+            "user": {"username": username, "email": f"{username}@example.com", "password": self.password,
+                     "first_name": "Bench", "last_name": "Mark"},
+            "primary_phone": "+251900000000", "country_of_residence": "UAE",
+        }, content_type="application/json")
+        self.created.append((User, User.objects.filter(username=username).values_list("pk", flat=True).first()))
+        return response
+
+    def keep(self, model, response):
+        if response.status_code == 201:
+            self.created.append((model, response.json()["id"]))
+        return response
+
+    def cleanup(self):
+        # regular deletes, so rollups, search and caches follow
+        for model, pk in reversed(self.created):
+            if pk is not None:
+                for obj in model.objects.filter(pk=pk):
+                    obj.delete()
+        self.user.delete()
+
+    # ---------------------------
+    # Measurement
+    # ---------------------------
+
+    def measure(self, name, scenario, options):
+        count = options["hashing_requests"] if name.startswith(HASHING) else options["requests"]
+        for i in range(options["warmup"]):
+            scenario(i)
+        times, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for i in range(options["warmup"], options["warmup"] + count):
+            with collect() as stats:
+                start = time.perf_counter()
+                response = scenario(i)
+                if response.streaming:
+                    b"".join(response.streaming_content)
+                times.append((time.perf_counter() - start) * 1000)
+            queries.append(stats.queries)
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+        return {
+            "requests": count,
+            "errors": errors,
+            "throughput_rps": round(count / elapsed, 1),
+            "mean_ms": round(statistics.fmean(times), 2),
+            **{f"p{q}_ms": round(percentile(times, q), 2) for q in (50, 95, 99)},
+            "queries": {"median": statistics.median(queries), "max": max(queries)},
+        }
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "dataset": {m.__name__: m.objects.count() for m in (Office, Diaspora, Purpose, Case, Referral, Announcement)},
+            "requests": options["requests"],
+            "warmup": options["warmup"],
+        }
+
+    def compare(self, before, after):
+        lines = [f"\nvs {before['meta'].get('commit')} ({before['meta'].get('timestamp')}):"]
+        for name, now in after["endpoints"].items():
+            old = before["endpoints"].get(name)
+            if not old:
+                lines.append(f"  {name:32} new")
+                continue
+            p50 = (now["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0
+            p95 = (now["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0
+            dq = now["queries"]["median"] - old["queries"]["median"]
+            lines.append(f"  {name:32} p50 {p50:+6.1f}%  p95 {p95:+6.1f}%  queries {dq:+g}")
+        return "\n".join(lines)
@@ -0,0 +1,89 @@
+# diaspora/management/commands/bench_diaspora_ids.py
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from diaspora.models import Diaspora
+from diaspora.serializers import DiasporaWriteSerializer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Register diasporas from many threads at once and check the allocated diaspora_ids: "
+        "no duplicates, no failed inserts, and sequence round-trips per insert."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--per-thread", type=int, default=50)
+        parser.add_argument("--keep", action="store_true", help="don't delete the registered users")
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        password_hash = make_password("123456")  # hash once; this measures ids, not PBKDF2
+        ids, errors, sequence_queries = [], Counter(), [0]
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options["threads"])
+
+        def count_sequence_queries(execute, sql, params, many, context):
+            if "diaspora_diasporaidsequence" in sql:
+                with lock:
+                    sequence_queries[0] += 1
+            return execute(sql, params, many, context)
+
+        def worker(t):
+            start_barrier.wait()
+            try:
+                with connection.execute_wrapper(count_sequence_queries):
+                    for i in range(options["per_thread"]):
+                        email = f"idbench-{run}-{t}-{i}@example.com"
+                        ser = DiasporaWriteSerializer(
+                            data={"user": {"email": email}}, context={"password_hash": password_hash},
+                        )
+                        try:
+                            ser.is_valid(raise_exception=True)
+                            diaspora = ser.save()
+                        except Exception as exc:
+                            with lock:
+                                errors[type(exc).__name__] += 1
+                            continue
+                        with lock:
+                            ids.append(diaspora.diaspora_id)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(t,)) for t in range(options["threads"])]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        elapsed = time.perf_counter() - started
+
+        stored = list(Diaspora.objects.filter(user__email__startswith=f"idbench-{run}-")
+                      .values_list("diaspora_id", flat=True))
+        duplicates = [i for i, n in Counter(stored).items() if n > 1]
+        if not options["keep"]:
+            User.objects.filter(email__startswith=f"idbench-{run}-").delete()
+
+        self.stdout.write(json.dumps({
+            "registrations": options["threads"] * options["per_thread"],
+            "created": len(ids),
+            "errors": dict(errors),
+            "duplicate_ids": len(duplicates),
+            "sequence_queries": sequence_queries[0],
+            "sequence_queries_per_insert": round(sequence_queries[0] / max(1, len(ids)), 3),
+            "registrations_per_s": round(len(ids) / elapsed, 1),
+            "sample": sorted(ids)[:3],
+        }, indent=2))
+        if duplicates or errors.get("IntegrityError"):
+            raise CommandError(f"diaspora_id collisions: {duplicates[:10]}")
@@ -0,0 +1,82 @@
+# diaspora/management/commands/bench_login_storm.py
+import asyncio
+import json
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+User = get_user_model()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency of a cheap read (GET /api/offices/) while a storm of logins runs, "
+        "through the in-process ASGI handler: sync /api/login/ vs the async /api/async/login/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=200, help="logins per run")
+        parser.add_argument("--concurrency", type=int, default=32, help="logins in flight")
+        parser.add_argument("--reads", type=int, default=100, help="reads measured per run")
+
+    def handle(self, *args, **options):
+        username = f"bench-{uuid.uuid4().hex[:8]}"
+        password = uuid.uuid4().hex
+        user = User.objects.create_user(username=username, email=f"{username}@example.com", password=password)
+        try:
+            token = str(RefreshToken.for_user(user).access_token)
+            results = {}
+            for label, path in (("before (sync /api/login/)", "/api/login/"),
+                                ("after (async /api/async/login/)", "/api/async/login/")):
+                results[label] = asyncio.run(self._run(path, username, password, token, options))
+        finally:
+            User.objects.filter(pk=user.pk).delete()
+        self.stdout.write(json.dumps(results, indent=2))
+
+    async def _run(self, login_path, username, password, token, options):
+        client = AsyncClient()
+        body = {"username": username, "password": password}
+        remaining = options["logins"]
+        login_times, statuses = [], {}
+
+        async def login_worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                r = await client.post(login_path, body, content_type="application/json")
+                login_times.append((time.perf_counter() - start) * 1000)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        async def reader():
+            times = []
+            await asyncio.sleep(0.05)  # let the storm build up
+            for _ in range(options["reads"]):
+                start = time.perf_counter()
+                await client.get("/api/offices/", HTTP_AUTHORIZATION=f"Bearer {token}")
+                times.append((time.perf_counter() - start) * 1000)
+            return times
+
+        started = time.perf_counter()
+        storm = [asyncio.create_task(login_worker()) for _ in range(options["concurrency"])]
+        read_times = await reader()
+        await asyncio.gather(*storm)
+        elapsed = time.perf_counter() - started
+        return {
+            "read_ms": {p: round(percentile(read_times, q), 2) for p, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+            "login_ms": {p: round(percentile(login_times, q), 2) for p, q in (("p50", 50), ("p99", 99))},
+            "login_statuses": statuses,
+            "logins_per_s": round(options["logins"] / elapsed, 1),
+        }
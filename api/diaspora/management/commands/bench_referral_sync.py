@@ -0,0 +1,82 @@
+# diaspora/management/commands/bench_referral_sync.py
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from diaspora import outbox, rollups
+from diaspora.models import Case, Office, Referral, ReferralOutbox
+from diaspora.sync_stub import StubDestination
+
+
+class Command(BaseCommand):
+    help = (
+        "Create throwaway referrals, enqueue one outbox message each and drain them into two "
+        "in-process stub destinations; reports throughput, retries and whether every message "
+        "arrived exactly once. The referrals are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=4, help="in-flight requests per destination")
+        parser.add_argument("--latency-ms", type=int, default=5)
+        parser.add_argument("--fail-rate", type=float, default=0.1)
+        parser.add_argument("--throttle-rate", type=float, default=0.02)
+
+    def handle(self, *args, **options):
+        case = Case.objects.first()
+        offices = list(Office.objects.all()[:2])
+        if case is None or len(offices) < 2:
+            raise CommandError("Needs a case and two offices; run seed_diaspora first.")
+        stubs = {
+            code: StubDestination(port=0, latency_ms=options["latency_ms"], fail_rate=options["fail_rate"],
+                                  throttle_rate=options["throttle_rate"], retry_after=0).start()
+            for code in ("BENCH-A", "BENCH-B")
+        }
+        codes = list(stubs)
+
+        referrals = Referral.objects.bulk_create([
+            Referral(case=case, from_office=offices[0], to_office=offices[1], reason=f"sync bench #{i}")
+            for i in range(options["messages"])
+        ])
+        rollups.add(Referral, referrals)  # bulk_create sends no signals; the delete below does
+        for i, referral in enumerate(referrals):
+            outbox.enqueue(referral, codes[i % 2])
+
+        worker = outbox.OutboxWorker(
+            batch_size=options["batch_size"],
+            destinations={code: {"URL": s.url, "CONCURRENCY": options["concurrency"], "TIMEOUT": 5}
+                          for code, s in stubs.items()},
+        )
+        worker.conf.update(BACKOFF_BASE=0.05, BACKOFF_MAX=0.5)  # keep retries inside the benchmark
+        messages = ReferralOutbox.objects.filter(referral__in=referrals)
+        started = time.perf_counter()
+        try:
+            while messages.filter(status=ReferralOutbox.Status.PENDING).exists():
+                if not worker.drain():
+                    time.sleep(0.05)
+        finally:
+            worker.close()
+        elapsed = time.perf_counter() - started
+
+        statuses = dict(messages.values_list("status").annotate(n=Count("pk")).order_by())
+        synced = Referral.objects.filter(pk__in=[r.pk for r in referrals], last_synced_at__isnull=False).count()
+        for s in stubs.values():
+            s.shutdown()
+            s.server_close()
+        for referral in referrals:
+            referral.delete()
+
+        accepted = sum(s.stats["accepted"] for s in stubs.values())
+        self.stdout.write(json.dumps({
+            "messages": len(referrals),
+            "outbox_statuses": statuses,
+            "referrals_synced": synced,
+            "worker": worker.stats,
+            "stub": {code: {**s.stats, "unique_keys": len(s.keys)} for code, s in stubs.items()},
+            "delivered_once": accepted == statuses.get("SENT", 0),
+            "messages_per_s": round(len(referrals) / elapsed, 1),
+            "elapsed_s": round(elapsed, 2),
+        }, indent=2))
@@ -0,0 +1,152 @@
+# diaspora/management/commands/bench_registrations.py
+import json
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from diaspora.management.commands.bench_login_storm import percentile
+from diaspora.sqlite import writer
+
+User = get_user_model()
+
+# the stock SQLite setup: rollback journal, deferred transactions, sqlite3's 5 s busy timeout
+BASELINE = {"profile": {"ENABLED": False}, "options": {"timeout": 5}, "journal_mode": "delete"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Registration throughput on SQLite with many concurrent clients (threads posting to "
+        "/api/public/register/ while others read /api/diasporas/): the stock SQLite setup vs the "
+        "hardened profile from settings (SQLITE_PROFILE, diaspora/sqlite.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=32, help="concurrent registering clients")
+        parser.add_argument("--registrations", type=int, default=500, help="registrations per run")
+        parser.add_argument("--readers", type=int, default=4, help="concurrent clients reading meanwhile")
+        parser.add_argument("--read-interval", type=float, default=0.05, help="seconds each reader pauses between reads")
+        parser.add_argument("--real-hashing", action="store_true",
+                            help="keep PASSWORD_HASHERS; by default a cheap hasher isolates the database")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("This benchmark is about the SQLite backend.")
+        hardened = {
+            "profile": settings.SQLITE_PROFILE,
+            "options": dict(connection.settings_dict["OPTIONS"]),
+            "journal_mode": settings.SQLITE_PROFILE.get("PRAGMAS", {}).get("journal_mode", "wal").lower(),
+        }
+        hashers = settings.PASSWORD_HASHERS if options["real_hashing"] else ["django.contrib.auth.hashers.MD5PasswordHasher"]
+        reader = User.objects.create_user(username=f"bench-{uuid.uuid4().hex[:8]}")
+        token = str(RefreshToken.for_user(reader).access_token)
+        original = dict(connection.settings_dict["OPTIONS"])
+        request_logger = logging.getLogger("django.request")
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)  # failed registrations are counted, not logged
+        results = {}
+        try:
+            for label, mode in (("before (stock SQLite)", BASELINE), ("after (hardened profile)", hardened)):
+                with override_settings(SQLITE_PROFILE=mode["profile"], PASSWORD_HASHERS=hashers):
+                    self.configure(mode)
+                    results[label] = self.run(token, options)
+        finally:
+            request_logger.setLevel(level)
+            connection.settings_dict["OPTIONS"] = original
+            connection.close()
+            User.objects.filter(username__startswith="benchreg-").delete()
+            reader.delete()
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def configure(self, mode):
+        # new connections (one per thread) pick up the options; the journal mode lives in the file
+        connection.close()
+        connection.settings_dict["OPTIONS"] = {**mode["options"]}
+        try:
+            with connection.cursor() as cur:
+                cur.execute(f"PRAGMA journal_mode = {mode['journal_mode']}")
+                actual = cur.fetchone()[0]
+        except OperationalError as exc:
+            raise CommandError(f"Can't switch journal_mode ({exc}): run on a database nothing else has open.")
+        finally:
+            connection.close()
+        if actual != mode["journal_mode"]:
+            raise CommandError(f"journal_mode is {actual}, not {mode['journal_mode']}: run on a database nothing else has open.")
+
+    def run(self, token, options):
+        remaining = list(range(options["registrations"]))
+        lock = threading.Lock()
+        times, statuses, failures = [], {}, {}
+        done = threading.Event()
+        reads = []
+        run_id = uuid.uuid4().hex[:8]
+        commits_before = dict(writer.stats)
+
+        def register():
+            client = Client(raise_request_exception=False)
+            try:
+                while True:
+                    with lock:
+                        if not remaining:
+                            return
+                        i = remaining.pop()
+                    username = f"benchreg-{run_id}-{i}"
+                    start = time.perf_counter()
+                    response = client.post("/api/public/register/", {
+                        "user": {"username": username, "email": f"{username}@example.com",
+                                 "password": "Bench-pass-1", "first_name": "Bench", "last_name": "Mark"},
+                        "primary_phone": "+251900000000", "country_of_residence": "UAE",
+                    }, content_type="application/json")
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        times.append(elapsed)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                        if response.status_code >= 500 and response.exc_info:
+                            failures[str(response.exc_info[1])] = failures.get(str(response.exc_info[1]), 0) + 1
+            finally:
+                connections.close_all()
+
+        def read():
+            client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f"Bearer {token}")
+            try:
+                while not done.is_set():
+                    start = time.perf_counter()
+                    response = client.get("/api/diasporas/")
+                    with lock:
+                        reads.append(((time.perf_counter() - start) * 1000, response.status_code))
+                    done.wait(options["read_interval"])
+            finally:
+                connections.close_all()
+
+        readers = [threading.Thread(target=read) for _ in range(options["readers"])]
+        clients = [threading.Thread(target=register) for _ in range(options["clients"])]
+        started = time.perf_counter()
+        for thread in readers + clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        created = statuses.get(201, 0)
+        commits = writer.stats["commits"] - commits_before["commits"]
+        jobs = writer.stats["jobs"] - commits_before["jobs"]
+        read_times = [t for t, _ in reads]
+        return {
+            "registrations_per_s": round(created / elapsed, 1),
+            "statuses": statuses,
+            "failures": failures,
+            "register_ms": {f"p{q}": round(percentile(times, q), 2) for q in (50, 95, 99)},
+            "reads": {"count": len(reads), "failed": sum(s >= 400 for _, s in reads),
+                      **({f"p{q}_ms": round(percentile(read_times, q), 2) for q in (50, 95)} if reads else {})},
+            "group_commit": {"commits": commits, "jobs_per_commit": round(jobs / commits, 1) if commits else None},
+        }
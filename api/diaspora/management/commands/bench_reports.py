@@ -0,0 +1,97 @@
+# diaspora/management/commands/bench_reports.py
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncYear
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from diaspora.models import Diaspora, Purpose, Case, Referral
+from diaspora.reports import LiveReports, RollupReports
+
+
+class LegacyReports:
+    """The pre-engine report queries (created_at__date casts, one GROUP BY per breakdown), kept as the baseline."""
+
+    def summary(self, f, t):
+        window = dict(created_at__date__gte=f, created_at__date__lte=t)
+        return {
+            "total_diasporas": Diaspora.objects.filter(**window).count(),
+            "active_cases": Case.objects.exclude(overall_status="DONE").count(),
+            "referrals_by_status": list(Referral.objects.filter(**window).values("status").annotate(count=Count("id")).order_by("status")),
+            "purposes_breakdown": list(Purpose.objects.filter(**window).values("type").annotate(count=Count("id")).order_by("type")),
+        }
+
+    def diasporas_by_period(self, group, f, t):
+        qs = Diaspora.objects.filter(created_at__date__gte=f, created_at__date__lte=t)
+        bucket = TruncYear("created_at") if group == "yearly" else TruncQuarter("created_at") if group == "quarterly" else TruncMonth("created_at")
+        data = qs.annotate(period=bucket).values("period").annotate(count=Count("id")).order_by("period")
+        return [{"period": d["period"].date().isoformat(), "count": d["count"]} for d in data]
+
+    def progress_by_purpose(self, f, t, ptype=None):
+        qs = Purpose.objects.filter(created_at__date__gte=f, created_at__date__lte=t)
+        if ptype: qs = qs.filter(type=ptype)
+        return list(qs.values("type", "status").annotate(count=Count("id")).order_by("type", "status"))
+
+    def cases_by_status(self):
+        qs = Case.objects.all()
+        return {
+            "by_stage": list(qs.values("current_stage").annotate(count=Count("id")).order_by("current_stage")),
+            "by_overall_status": list(qs.values("overall_status").annotate(count=Count("id")).order_by("overall_status")),
+        }
+
+    def referrals_by_office(self, f, t):
+        qs = Referral.objects.filter(created_at__date__gte=f, created_at__date__lte=t)
+        return {
+            "totals": list(qs.values("to_office__id", "to_office__name", "to_office__code").annotate(total=Count("id")).order_by("to_office__name")),
+            "by_status": list(qs.values("to_office__id", "to_office__name", "status").annotate(count=Count("id")).order_by("to_office__name", "status")),
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare query count and wall time of the report queries: legacy (date casts, one query per "
+        "breakdown), live engine (datetime ranges, conditional aggregation) and the rollup tables. "
+        "Seed a large dataset first for meaningful numbers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="from_date", type=date.fromisoformat, help="YYYY-MM-DD (default: one year ago)")
+        parser.add_argument("--to", dest="to_date", type=date.fromisoformat, help="YYYY-MM-DD (default: today)")
+        parser.add_argument("--group", default="monthly", choices=["monthly", "quarterly", "yearly"],
+                            help="diasporas_by_period bucket")
+        parser.add_argument("--type", dest="ptype", help="progress_by_purpose purpose type (default: all)")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        t = options["to_date"] or timezone.localdate()
+        f = options["from_date"] or t.replace(year=t.year - 1)
+        reports = {
+            "summary": lambda s: s.summary(f, t),
+            "diasporas_by_period": lambda s: s.diasporas_by_period(options["group"], f, t),
+            "progress_by_purpose": lambda s: s.progress_by_purpose(f, t, options["ptype"]),
+            "cases_by_status": lambda s: s.cases_by_status(),
+            "referrals_by_office": lambda s: s.referrals_by_office(f, t),
+        }
+        sources = {"legacy": LegacyReports(), "live": LiveReports(), "rollup": RollupReports()}
+
+        self.stdout.write(f"Diasporas: {Diaspora.objects.count()}, Purposes: {Purpose.objects.count()}, "
+                          f"Cases: {Case.objects.count()}, Referrals: {Referral.objects.count()}  window {f}..{t}")
+        self.stdout.write(f"{'report':<22}{'source':<8}{'queries':>8}{'mean ms':>10}{'min ms':>10}  same")
+        for name, run in reports.items():
+            baseline = None
+            for label, source in sources.items():
+                timings = []
+                for _ in range(options["repeat"]):
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        result = run(source)
+                        timings.append((time.perf_counter() - start) * 1000)
+                baseline = result if baseline is None else baseline
+                self.stdout.write(
+                    f"{name:<22}{label:<8}{len(ctx.captured_queries):>8}"
+                    f"{sum(timings) / len(timings):>10.1f}{min(timings):>10.1f}  {'yes' if result == baseline else 'NO'}"
+                )
@@ -0,0 +1,83 @@
+# diaspora/management/commands/bench_serializers.py
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from diaspora.api import CaseViewSet, DiasporaViewSet, PurposeViewSet, ReferralViewSet
+from diaspora.compiled import get_compiled
+from diaspora.fieldsets import parse_spec, shape_queryset
+
+VIEWSETS = {
+    "diasporas": DiasporaViewSet,
+    "cases": CaseViewSet,
+    "purposes": PurposeViewSet,
+    "referrals": ReferralViewSet,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Rows/s of the list serializers vs the compiled fast path (diaspora/compiled.py), "
+        "query + serialization + JSON rendering, and check both render identical bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=2000, help="rows per endpoint")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--fields", help="?fields= applied to every endpoint")
+        parser.add_argument("--expand", help="?expand= applied to every endpoint")
+        parser.add_argument("--only", choices=sorted(VIEWSETS), action="append")
+
+    def handle(self, *args, **options):
+        sparse = (parse_spec(options["fields"]), parse_spec(options["expand"]))
+        renderer = JSONRenderer()
+        results = {}
+        for name in options["only"] or VIEWSETS:
+            viewset = VIEWSETS[name]
+            serializer_class = _list_serializer(viewset)
+            compiled = get_compiled(serializer_class, sparse)
+            if compiled is None:
+                raise CommandError(f"{serializer_class.__name__} does not compile for this fieldset")
+            template = serializer_class(context={"sparse": sparse})
+            queryset = shape_queryset(viewset.queryset.all(), template)[: options["rows"]]
+            values = compiled.values(viewset.queryset.all())[: options["rows"]]
+
+            def drf():
+                # .all() clones, so every run pays for its query
+                return renderer.render(serializer_class(queryset.all(), many=True, context={"sparse": sparse}).data)
+
+            def fast():
+                return renderer.render([compiled.to_dict(row) for row in values.all()])
+
+            before, after = drf(), fast()
+            if before != after:
+                raise CommandError(f"{name}: compiled output differs from the serializer")
+            rows = len(values.all())
+            results[name] = {
+                "rows": rows,
+                "bytes": len(after),
+                "serializer_rows_per_s": _rate(drf, rows, options["repeat"]),
+                "compiled_rows_per_s": _rate(fast, rows, options["repeat"]),
+            }
+            results[name]["speedup"] = round(
+                results[name]["compiled_rows_per_s"] / max(1, results[name]["serializer_rows_per_s"]), 1
+            )
+        self.stdout.write(json.dumps(results, indent=2))
+
+
+def _list_serializer(viewset):
+    view = viewset()
+    view.action = "list"
+    return view.get_serializer_class()
+
+
+def _rate(fn, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(rows / best) if best else 0
@@ -0,0 +1,57 @@
+# diaspora/management/commands/check_query_budgets.py
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from diaspora import report_cache, routing
+from diaspora.instrumentation import budget_url, collect
+from diaspora.urls import router
+
+
+class Command(BaseCommand):
+    help = (
+        "GET every read action that declares a query_budget on its viewset (diaspora/api.py) and "
+        "fail when one runs more queries than budgeted. Run it on a seeded database (seed_diaspora) "
+        "so lists and details have rows to render; the report cache is invalidated first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="username to authenticate as (default: the first superuser)")
+        parser.add_argument("--verbose-sql", action="store_true", help="print the statements of every endpoint")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User.objects.filter(username=options["user"]) if options["user"] else User.objects.filter(is_superuser=True)
+        user = users.order_by("pk").first()
+        if user is None:
+            raise CommandError("No user to authenticate as; create a superuser or pass --user.")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        report_cache.bump(*report_cache.DEPENDENCIES)
+        # replica health checks are periodic, not per request: don't charge them to the first endpoint
+        for alias in routing.replicas():
+            routing.health.healthy(alias)
+
+        over = []
+        for prefix, viewset, basename in router.registry:
+            for action, budget in getattr(viewset, "query_budget", {}).items():
+                url = budget_url(viewset, basename, action)
+                if url is None:
+                    self.stdout.write(f"  skip  {prefix}.{action}: no rows to retrieve")
+                    continue
+                with collect() as stats:
+                    response = client.get(url)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                if response.status_code != 200:
+                    raise CommandError(f"{url}: HTTP {response.status_code}")
+                ok = stats.queries <= budget
+                self.stdout.write(f"  {'ok  ' if ok else 'OVER'}  {prefix}.{action}: {stats.queries}/{budget} queries  {url}")
+                if options["verbose_sql"] or not ok:
+                    for sql, n in stats.statements.most_common():
+                        self.stdout.write(f"          {n}x {sql[:160]}")
+                if not ok:
+                    over.append(f"{prefix}.{action}")
+        if over:
+            raise CommandError(f"Query budget exceeded: {', '.join(over)}")
+        self.stdout.write(self.style.SUCCESS("All endpoints within budget."))
@@ -0,0 +1,32 @@
+# diaspora/management/commands/evaluate_sla.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from diaspora import sla
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark referrals whose SLA deadline passed since the last run (diaspora/sla.py). "
+        "Run it from cron, or keep it running with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="re-scan every open referral, ignoring the watermark")
+        parser.add_argument("--interval", type=int, default=0, help="seconds between runs; 0 = run once")
+
+    def handle(self, *args, **options):
+        full = options["full"]
+        while True:
+            started = time.perf_counter()
+            breached = sla.evaluate(full=full)
+            self.stdout.write(
+                f"{timezone.now():%Y-%m-%d %H:%M:%S} {breached} referral(s) breached SLA "
+                f"({(time.perf_counter() - started) * 1000:.1f} ms)"
+            )
+            if not options["interval"]:
+                return
+            full = False
+            time.sleep(options["interval"])
@@ -0,0 +1,38 @@
+# diaspora/management/commands/import_diasporas.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from diaspora.importer import DiasporaImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk-import diaspora registrations (User + Diaspora) from a CSV or XLSX file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=None, help="password hashing processes (default: CPU count)")
+        parser.add_argument("--dry-run", action="store_true", help="validate only, write nothing")
+        parser.add_argument("--errors", help="write the per-row error report to this JSON file")
+
+    def handle(self, *args, **options):
+        importer = DiasporaImporter(
+            chunk_size=options["chunk_size"], workers=options["workers"], dry_run=options["dry_run"],
+        )
+        try:
+            with open(options["path"], "rb") as fh:
+                report = importer.run(read_rows(fh, options["path"]))
+        except (OSError, ValueError, UnicodeDecodeError) as exc:
+            raise CommandError(str(exc))
+
+        if options["errors"]:
+            with open(options["errors"], "w") as out:
+                json.dump(report["errors"], out, indent=2, default=str)
+        for err in report["errors"][:20]:
+            self.stdout.write(self.style.WARNING(f"row {err['row']}: {err['errors']}"))
+        verb = "Validated" if options["dry_run"] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {verb} {report['rows'] - report['failed']} of {report['rows']} rows "
+            f"({report['created']} created, {report['failed']} failed)."
+        ))
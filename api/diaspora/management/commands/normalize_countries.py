@@ -0,0 +1,26 @@
+# diaspora/management/commands/normalize_countries.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from diaspora.facets import normalize_country
+from diaspora.models import Diaspora
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Diaspora.country_canonical from country_of_residence (diaspora/facets.py): "
+        "after adding the column, or after changing COUNTRY_ALIASES."
+    )
+
+    def handle(self, *args, **options):
+        raw = Diaspora.objects.order_by().values_list("country_of_residence", flat=True).distinct()
+        changed = 0
+        with transaction.atomic():
+            # one UPDATE per distinct spelling, not per row
+            for value in list(raw):
+                changed += (
+                    Diaspora.objects.filter(country_of_residence=value)
+                    .exclude(country_canonical=normalize_country(value))
+                    .update(country_canonical=normalize_country(value))
+                )
+        self.stdout.write(self.style.SUCCESS(f"✅ Normalized the country of {changed} diasporas."))
@@ -0,0 +1,20 @@
+# diaspora/management/commands/rebuild_rollups.py
+from django.core.management.base import BaseCommand
+
+from diaspora.models import Diaspora, Purpose, Case, Referral
+from diaspora import rollups, report_cache, stage_history
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily report rollup tables from Diaspora, Purpose, Case and Referral, "
+        "and the stage funnel rollups from the case stage history."
+    )
+
+    def handle(self, *args, **options):
+        for model in (Diaspora, Purpose, Case, Referral):
+            buckets = rollups.rebuild(model)
+            self.stdout.write(f"{model.__name__}: {buckets} buckets")
+        self.stdout.write(f"Case stage history: {stage_history.rebuild()} buckets")
+        report_cache.bump(Diaspora, Purpose, Case, Referral)
+        self.stdout.write(self.style.SUCCESS("✅ Rollups rebuilt."))
@@ -0,0 +1,18 @@
+# diaspora/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from diaspora import search
+
+
+class Command(BaseCommand):
+    help = "Create the diaspora full-text search index if needed and repopulate it from Diaspora/User."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if search.get_index() is None:
+            self.stdout.write(self.style.WARNING("No search index backend for this database; searches use icontains."))
+            return
+        total = search.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"✅ Indexed {total} diasporas."))
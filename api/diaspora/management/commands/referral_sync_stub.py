@@ -0,0 +1,30 @@
+# diaspora/management/commands/referral_sync_stub.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from diaspora.sync_stub import StubDestination
+
+
+class Command(BaseCommand):
+    help = "Serve a local referral endpoint (diaspora/sync_stub.py) to test sync_referrals offline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms", type=int, default=0)
+        parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered 500")
+        parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered 429")
+
+    def handle(self, *args, **options):
+        stub = StubDestination(
+            port=options["port"], latency_ms=options["latency_ms"],
+            fail_rate=options["fail_rate"], throttle_rate=options["throttle_rate"],
+        )
+        self.stdout.write(f"Accepting referrals at {stub.url} (Ctrl-C to stop)")
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.server_close()
+            self.stdout.write(json.dumps({**stub.stats, "unique_keys": len(stub.keys)}))
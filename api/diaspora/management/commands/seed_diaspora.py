@@ -1,20 +1,59 @@
 # diaspora/management/commands/seed_diaspora.py
 import uuid
 from datetime import date, timedelta
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.utils import timezone
 
 from diaspora.models import Office, Diaspora, Purpose, Case, Referral
+from diaspora.synthetic import SyntheticGenerator
 
 User = get_user_model()
 
 
 class Command(BaseCommand):
-    help = "Seed 5 records for each table: Office, User, Diaspora, Purpose, Case, Referral."
+    help = (
+        "Seed 5 records for each table: Office, User, Diaspora, Purpose, Case, Referral. "
+        "With --diasporas N, also generate N synthetic registrations (with purposes, cases and "
+        "referrals) for benchmarks, deterministically from --seed (diaspora/synthetic.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--diasporas", type=int, default=0, help="synthetic registrations to generate")
+        parser.add_argument("--purposes-per", type=float, default=1.5, help="mean purposes per diaspora")
+        parser.add_argument("--case-rate", type=float, default=0.9, help="share of diasporas with a case")
+        parser.add_argument("--referral-rate", type=float, default=0.4, help="share of cases with referrals")
+        parser.add_argument("--days", type=int, default=730, help="spread created_at over this many days")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--chunk-size", type=int, default=5000)
 
     def handle(self, *args, **options):
+        if not options["diasporas"] or not Office.objects.exists():
+            self.seed_demo()
+        if options["diasporas"]:
+            self.generate(options)
+
+    def generate(self, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Generating {options['diasporas']} synthetic registrations…"))
+
+        def progress(stats):
+            self.stdout.write(
+                f"  {stats['diasporas']}/{stats['target']} diasporas, {stats['purposes']} purposes, "
+                f"{stats['cases']} cases, {stats['referrals']} referrals "
+                f"({stats['rows_per_s']:,.0f} rows/s, {stats['elapsed']:.0f}s)"
+            )
+
+        generator = SyntheticGenerator(
+            seed=options["seed"], purposes_per=options["purposes_per"], case_rate=options["case_rate"],
+            referral_rate=options["referral_rate"], days=options["days"], chunk_size=options["chunk_size"],
+            progress=progress,
+        )
+        generator.run(options["diasporas"])
+        self.stdout.write(self.style.SUCCESS("✅ Synthetic data complete."))
+
+    def seed_demo(self):
         self.stdout.write(self.style.MIGRATE_HEADING("Seeding diaspora demo data…"))
 
         # 1) Groups
@@ -210,6 +249,9 @@ class Command(BaseCommand):
                 r.save(update_fields=["status", "to_office"])
             referrals.append(r)
 
+        # created_at was back-dated with QuerySet.update(), which skips the rollup signals
+        call_command("rebuild_rollups", stdout=self.stdout)
+
         # Summary
         self.stdout.write(self.style.SUCCESS("✅ Seed complete."))
         self.stdout.write(
@@ -0,0 +1,31 @@
+# diaspora/management/commands/sync_referrals.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from diaspora.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = "Push pending referral outbox messages to the receiving offices (settings.REFERRAL_SYNC)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="drain what is due now and exit")
+        parser.add_argument("--interval", type=int, default=5, help="seconds to sleep when nothing is due")
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(batch_size=options["batch_size"])
+        if not worker.destinations:
+            self.stdout.write(self.style.WARNING("No REFERRAL_SYNC['DESTINATIONS'] configured; nothing to do."))
+            return
+        try:
+            if options["once"]:
+                handled = worker.drain()
+                self.stdout.write(f"{handled} message(s) handled: {json.dumps(worker.stats)}")
+            else:
+                worker.run(interval=options["interval"])
+        except KeyboardInterrupt:
+            self.stdout.write(json.dumps(worker.stats))
+        finally:
+            worker.close()
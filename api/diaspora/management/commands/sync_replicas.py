@@ -0,0 +1,61 @@
+# diaspora/management/commands/sync_replicas.py
+import os
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from diaspora import routing
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over each SQLite replica in DATABASE_ROUTING, so local "
+        "SQLite files can stand in for read replicas, then health-check every replica. "
+        "--interval keeps copying, simulating replication that trails the primary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="seconds between copies; 0 copies once and exits")
+        parser.add_argument("--check", action="store_true", help="only health-check the replicas")
+
+    def handle(self, *args, **options):
+        aliases = routing.replicas()
+        if not aliases:
+            raise CommandError("No replicas configured in DATABASE_ROUTING['REPLICAS'].")
+        try:
+            while True:
+                if not options["check"]:
+                    self.sync(aliases)
+                for alias, ok in routing.health.status().items():
+                    self.stdout.write(f"  {alias}: {'healthy' if ok else 'UNHEALTHY'}")
+                if options["check"] or not options["interval"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+    def sync(self, aliases):
+        source = connections[routing.primary()].settings_dict
+        if source["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("Only SQLite primaries can be copied; use the database's own replication.")
+        started = time.perf_counter()
+        routing.health.beat()  # the copies carry this stamp, so the health check can tell their age
+        with sqlite3.connect(source["NAME"]) as src:
+            for alias in aliases:
+                target = connections[alias].settings_dict
+                if target["ENGINE"] != "django.db.backends.sqlite3":
+                    self.stdout.write(f"  {alias}: not SQLite, skipped")
+                    continue
+                connections[alias].close()
+                # copy next to the replica and swap it in, so readers never open a half-written file
+                tmp = f"{target['NAME']}.sync"
+                dst = sqlite3.connect(tmp)
+                try:
+                    src.backup(dst)
+                finally:
+                    dst.close()
+                os.replace(tmp, target["NAME"])
+        self.stdout.write(f"Copied {source['NAME']} to {len(aliases)} replica(s) in {time.perf_counter() - started:.2f}s")
@@ -1,6 +1,7 @@
 # diaspora/models.py
 import uuid
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.contrib.auth.models import Group
@@ -8,8 +9,9 @@ from django.contrib.auth.models import Group
 User = get_user_model()
 
 def default_diaspora_id():
-    now = timezone.now()
-    return f"HR-DIAS-{now.year}-{uuid.uuid4().hex[:4].upper()}"
+    # HR-DIAS-YYYY-NNNNNN from the block allocator in diaspora/ids.py
+    from .ids import next_diaspora_id
+    return next_diaspora_id()
 
 class Office(models.Model):
     class OfficeType(models.TextChoices):
@@ -48,6 +50,8 @@ class Diaspora(models.Model):
     whatsapp = models.CharField(max_length=20, null=True, blank=True)
 
     country_of_residence = models.CharField(max_length=80, blank=True)
+    # country_of_residence normalized (diaspora/facets.py): what facet counts and filters compare
+    country_canonical = models.CharField(max_length=80, blank=True, db_index=True, editable=False)
     city_of_residence = models.CharField(max_length=120, null=True, blank=True)
 
     arrival_date = models.DateField(null=True, blank=True)
@@ -70,10 +74,18 @@ class Diaspora(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["created_at"]), models.Index(fields=["owner_office", "created_at"])]
+
     @property
     def full_name(self):
         # source of truth = user
-        return f"{(self.user.first_name or '').strip()} {(self.user.last_name or '').strip()}".strip() or (self.user.email or self.user.username)
+        user = self.user
+        return self.format_full_name(user.first_name, user.last_name, user.email, user.username)
+
+    @staticmethod
+    def format_full_name(first_name, last_name, email, username):
+        return f"{(first_name or '').strip()} {(last_name or '').strip()}".strip() or (email or username)
 
     def __str__(self):
         return f"{self.full_name} ({self.diaspora_id})"
@@ -112,7 +124,11 @@ class Purpose(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        indexes = [models.Index(fields=["type"]), models.Index(fields=["status"])]
+        indexes = [
+            models.Index(fields=["type"]), models.Index(fields=["status"]),
+            # range scans on created_at that also cover the type/status breakdowns
+            models.Index(fields=["created_at", "type", "status"]),
+        ]
 
     def __str__(self): return f"{self.get_type_display()} for {self.diaspora.full_name}"
 
@@ -132,6 +148,27 @@ class Case(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
+class CaseStageTransition(models.Model):
+    """
+    Append-only history of Case stage/status changes (written by diaspora/stage_history.py).
+    The office and purpose type are snapshotted when the transition happens.
+    """
+    # kept when the case is deleted: the funnel describes what happened
+    case = models.ForeignKey(Case, null=True, on_delete=models.SET_NULL, related_name="stage_history")
+    from_stage = models.CharField(max_length=20, choices=Case.Stage.choices, null=True, blank=True)  # null: case created
+    to_stage = models.CharField(max_length=20, choices=Case.Stage.choices)
+    from_status = models.CharField(max_length=20, choices=Case.OverallStatus.choices, null=True, blank=True)
+    to_status = models.CharField(max_length=20, choices=Case.OverallStatus.choices)
+    stage_since = models.DateTimeField()  # when the case entered to_stage
+    stage_seconds = models.BigIntegerField(null=True, blank=True)  # time spent in from_stage, if this left it
+    owner_office = models.ForeignKey(Office, null=True, on_delete=models.SET_NULL, related_name="+")
+    purpose_type = models.CharField(max_length=20, choices=Purpose.PurposeType.choices, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["case", "created_at"]), models.Index(fields=["created_at"])]
+
+
 class Referral(models.Model):
     class ReferralStatus(models.TextChoices):
         SENT="SENT","Sent"; RECEIVED="RECEIVED","Received"; IN_PROGRESS="IN_PROGRESS","In Progress"
@@ -147,14 +184,53 @@ class Referral(models.Model):
     received_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     sla_due_at = models.DateTimeField(null=True, blank=True)
+    sla_breached_at = models.DateTimeField(null=True, blank=True)  # set by the SLA evaluator (diaspora/sla.py)
 
     created_at = models.DateTimeField(auto_now_add=True)
     last_synced_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
-        indexes = [models.Index(fields=["status"]), models.Index(fields=["to_office","status"])]
+        indexes = [
+            models.Index(fields=["status"]), models.Index(fields=["to_office","status"]),
+            models.Index(fields=["created_at", "to_office", "status"]),
+            models.Index(fields=["status", "sla_due_at"]),
+        ]
+
+    def __str__(self):
+        from .offices import registry  # offices.py imports this module
+        office = registry.get(self.to_office_id)
+        return f"{self.case_id} → {office.code if office else self.to_office_id} [{self.status}]"
+
+    def save(self, *args, **kwargs):
+        # the outbox row written on post_save (diaspora/outbox.py) commits or rolls back with the referral
+        with transaction.atomic(using=kwargs.get("using") or router.db_for_write(Referral, instance=self)):
+            super().save(*args, **kwargs)
+
+
+class ReferralOutbox(models.Model):
+    """A referral snapshot waiting to be pushed to the receiving office's system."""
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        SENT = "SENT", "Sent"
+        SUPERSEDED = "SUPERSEDED", "Superseded"  # a newer snapshot of the same referral was sent instead
+        DEAD = "DEAD", "Dead"
+
+    referral = models.ForeignKey(Referral, on_delete=models.CASCADE, related_name="outbox")
+    destination = models.CharField(max_length=50)  # receiving office code, key of REFERRAL_SYNC["DESTINATIONS"]
+    idempotency_key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+
+    status = models.CharField(max_length=12, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.UUIDField(null=True, blank=True)  # batch that currently holds the row
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
 
-    def __str__(self): return f"{self.case_id} → {self.to_office.code} [{self.status}]"
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
 
 class Announcement(models.Model):
     title       = models.CharField(max_length=200)
@@ -171,4 +247,83 @@ class Announcement(models.Model):
         ordering = ["-created_at"]
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+# ---------------------------
+# Report rollups (maintained by diaspora/rollups.py)
+# ---------------------------
+
+class DiasporaIdSequence(models.Model):
+    """Next unreserved diaspora_id number per registration year (see diaspora/ids.py)."""
+    year = models.PositiveIntegerField(primary_key=True)
+    next_value = models.BigIntegerField()
+
+
+class Watermark(models.Model):
+    """High-water mark of a periodic job, e.g. how far the SLA evaluator has scanned."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.DateTimeField()
+
+
+class DiasporaDailyRollup(models.Model):
+    day = models.DateField()
+    owner_office = models.ForeignKey(Office, null=True, on_delete=models.SET_NULL, related_name="+")
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("day", "owner_office")]
+
+
+class PurposeDailyRollup(models.Model):
+    day = models.DateField()
+    type = models.CharField(max_length=20, choices=Purpose.PurposeType.choices)
+    status = models.CharField(max_length=20)
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("day", "type", "status")]
+
+
+class CaseDailyRollup(models.Model):
+    day = models.DateField()
+    current_stage = models.CharField(max_length=20, choices=Case.Stage.choices)
+    overall_status = models.CharField(max_length=20, choices=Case.OverallStatus.choices)
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("day", "current_stage", "overall_status")]
+
+
+class ReferralDailyRollup(models.Model):
+    day = models.DateField()
+    to_office = models.ForeignKey(Office, on_delete=models.CASCADE, related_name="+")
+    status = models.CharField(max_length=20, choices=Referral.ReferralStatus.choices)
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("day", "to_office", "status")]
+
+
+class CaseStageEntryDailyRollup(models.Model):
+    """Cases entering each stage per day: the funnel (diaspora/stage_history.py)."""
+    day = models.DateField()
+    stage = models.CharField(max_length=20, choices=Case.Stage.choices)
+    owner_office = models.ForeignKey(Office, null=True, on_delete=models.SET_NULL, related_name="+")
+    purpose_type = models.CharField(max_length=20, blank=True)
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("day", "stage", "owner_office", "purpose_type")]
+
+
+class CaseStageDurationDailyRollup(models.Model):
+    """Histogram of time spent in a stage, per day the cases left it (diaspora/stage_history.py)."""
+    day = models.DateField()
+    stage = models.CharField(max_length=20, choices=Case.Stage.choices)
+    owner_office = models.ForeignKey(Office, null=True, on_delete=models.SET_NULL, related_name="+")
+    purpose_type = models.CharField(max_length=20, blank=True)
+    bucket = models.PositiveSmallIntegerField()
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("day", "stage", "owner_office", "purpose_type", "bucket")]
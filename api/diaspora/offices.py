@@ -0,0 +1,104 @@
+# diaspora/offices.py
+"""
+Process-local registry of Office rows.
+
+Offices are a handful of almost static rows, yet referral and registration
+writes used to look them up (and reports joined to them) on every request.
+``registry`` loads the whole table once and serves lookups from memory.
+
+It is invalidated by the Office generation counter that report_cache.py
+keeps in the "reports" cache (bumped after commit on every Office save or
+delete). That reaches every worker only when the cache is shared
+(Redis/Memcached); with the default per-process LocMemCache it only covers
+this process. So the registry doesn't rely on it alone:
+
+- a lookup that misses reloads the table (at most once per
+  MISS_RELOAD_INTERVAL), so an office created through another worker is
+  found on first use;
+- every copy is reloaded after OFFICE_REGISTRY_TTL seconds, which bounds how
+  long another worker's edit (a rename, a new code) can go unseen.
+
+Saves in this process also drop the local copy straight away. Writes don't
+trust a hit alone: OfficeField (serializers.py) confirms the office still
+exists before a row points at it.
+
+The Office instances handed out are shared: treat them as read-only.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from . import report_cache, routing
+from .models import Office
+
+
+MISS_RELOAD_INTERVAL = 1.0  # seconds; unknown ids/codes can't turn every lookup into a query
+
+
+class OfficeRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._loaded_at = float("-inf")
+        self._by_pk = {}
+        self._by_code = {}
+
+    def _stale(self, generation, missed):
+        age = time.monotonic() - self._loaded_at
+        return (
+            generation != self._generation
+            or age >= getattr(settings, "OFFICE_REGISTRY_TTL", 300)
+            or (missed and age >= MISS_RELOAD_INTERVAL)
+        )
+
+    def _offices(self, missed=False):
+        generation = report_cache.generations([Office])[0]
+        if self._stale(generation, missed):
+            with self._lock:
+                if self._stale(generation, missed):
+                    # never from a replica: a stale copy would stick until the next reload
+                    offices = list(Office.objects.using(routing.primary()))
+                    self._by_pk = {o.pk: o for o in offices}
+                    self._by_code = {o.code: o for o in offices}
+                    self._generation = generation
+                    self._loaded_at = time.monotonic()
+        return self._by_pk, self._by_code
+
+    def get(self, pk):
+        office = self._offices()[0].get(pk)
+        if office is None:
+            office = self._offices(missed=True)[0].get(pk)
+        return office
+
+    def by_code(self, code):
+        office = self._offices()[1].get(code)
+        if office is None:
+            office = self._offices(missed=True)[1].get(code)
+        return office
+
+    def in_bulk(self, pks):
+        by_pk = self._offices()[0]
+        if any(pk not in by_pk for pk in pks if pk is not None):
+            by_pk = self._offices(missed=True)[0]
+        return {pk: by_pk[pk] for pk in pks if pk in by_pk}
+
+    def all(self):
+        return list(self._offices()[0].values())
+
+    def clear(self):
+        with self._lock:
+            self._generation = None
+
+
+registry = OfficeRegistry()
+
+
+def _invalidate(sender, **kwargs):
+    registry.clear()
+
+
+post_save.connect(_invalidate, sender=Office, dispatch_uid="office-registry-save")
+post_delete.connect(_invalidate, sender=Office, dispatch_uid="office-registry-delete")
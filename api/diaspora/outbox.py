@@ -0,0 +1,297 @@
+# diaspora/outbox.py
+"""
+Transactional outbox pushing referrals to the receiving offices' systems.
+
+- Saving a Referral whose ``to_office`` has a configured destination writes a
+  ReferralOutbox snapshot in the same transaction (Referral.save is atomic),
+  so a referral is never committed without its message or vice versa.
+- ``OutboxWorker`` drains the outbox in batches. A batch is claimed with one
+  UPDATE (safe with several workers) and delivery runs on one bounded thread
+  pool per destination.
+- Only the newest snapshot per (referral, destination) is ever sent: a new
+  snapshot supersedes the older pending ones (``supersede()``), and a claim
+  skips any message that has a newer snapshot, whatever its state – so a
+  retry waiting on backoff never overwrites newer data at the receiver.
+- Every message carries an ``Idempotency-Key`` header, so redelivery after a
+  timeout or crash is harmless for the receiver. 409 counts as delivered.
+- Failures retry with exponential backoff and jitter; 4xx other than
+  408/409/429 and messages out of attempts go DEAD.
+- Backpressure: a 429/503, or a run of consecutive failures, pauses that
+  destination – its remaining messages are deferred without using up an
+  attempt, and other destinations keep flowing.
+- Results are written back in bulk: one UPDATE for the sent messages, one for
+  ``Referral.last_synced_at``, one bulk_update for the retries. An exception
+  from a delivery counts as a failed attempt of that message only.
+
+Configured with settings.REFERRAL_SYNC (see api/settings.py);
+``manage.py referral_sync_stub`` serves a local destination for testing.
+"""
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import Referral, ReferralOutbox
+from .offices import registry as office_registry
+
+DEFAULTS = {
+    "BATCH_SIZE": 200,
+    "MAX_ATTEMPTS": 8,
+    "BACKOFF_BASE": 2,      # seconds before the first retry, doubled per attempt
+    "BACKOFF_MAX": 600,
+    "LEASE": 120,           # seconds a claimed batch is hidden from other workers
+    "PAUSE_AFTER_FAILURES": 5,
+    "DESTINATIONS": {},
+}
+
+SENT, RETRY, DEAD, DEFERRED = "sent", "retry", "dead", "deferred"
+
+
+def sync_settings():
+    return {**DEFAULTS, **getattr(settings, "REFERRAL_SYNC", {})}
+
+
+def backoff(attempts, conf):
+    delay = min(conf["BACKOFF_MAX"], conf["BACKOFF_BASE"] * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# ---------------------------
+# Enqueue
+# ---------------------------
+
+def referral_payload(referral, offices):
+    return {
+        "id": referral.pk,
+        "case_id": referral.case_id,
+        "from_office": offices[referral.from_office_id].code,
+        "to_office": offices[referral.to_office_id].code,
+        "reason": referral.reason,
+        "payload": referral.payload_json,
+        "status": referral.status,
+        "received_at": referral.received_at,
+        "completed_at": referral.completed_at,
+        "sla_due_at": referral.sla_due_at,
+        "created_at": referral.created_at,
+    }
+
+
+def enqueue(referral, destination=None):
+    offices = office_registry.in_bulk([referral.from_office_id, referral.to_office_id])
+    destination = destination or offices[referral.to_office_id].code
+    payload = json.loads(json.dumps(referral_payload(referral, offices), cls=DjangoJSONEncoder))
+    message = ReferralOutbox.objects.create(referral=referral, destination=destination, payload=payload)
+    supersede([referral.pk])
+    return message
+
+
+def _newer():
+    return ReferralOutbox.objects.filter(
+        referral_id=OuterRef("referral_id"), destination=OuterRef("destination"), pk__gt=OuterRef("pk"),
+    )
+
+
+def supersede(referral_ids):
+    """Mark pending snapshots of ``referral_ids`` that have a newer snapshot SUPERSEDED; returns how many."""
+    return (
+        ReferralOutbox.objects.filter(referral_id__in=referral_ids, status=ReferralOutbox.Status.PENDING)
+        .filter(Exists(_newer()))
+        .update(status=ReferralOutbox.Status.SUPERSEDED, claim=None)
+    )
+
+
+def _on_referral_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and set(update_fields) <= {"last_synced_at"}):
+        return
+    destinations = sync_settings()["DESTINATIONS"]
+    if not destinations:
+        return
+    office = office_registry.get(instance.to_office_id)
+    if office is not None and office.code in destinations:
+        enqueue(instance, office.code)
+
+
+post_save.connect(_on_referral_save, sender=Referral, dispatch_uid="referral-outbox")
+
+
+# ---------------------------
+# Delivery
+# ---------------------------
+
+class Destination:
+    """One receiving system: HTTP endpoint, concurrency bound and backpressure state."""
+
+    def __init__(self, code, conf, sync_conf):
+        self.code = code
+        self.url = conf["URL"]
+        self.timeout = conf.get("TIMEOUT", 10)
+        self.concurrency = conf.get("CONCURRENCY", 4)
+        self.headers = conf.get("HEADERS", {})
+        self.sync_conf = sync_conf
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._failures = 0
+
+    def paused_for(self):
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def _pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _failed(self, throttled=False, retry_after=None):
+        with self._lock:
+            self._failures += 1
+            failures = self._failures
+        limit = self.sync_conf["PAUSE_AFTER_FAILURES"]
+        if throttled:
+            self._pause(retry_after if retry_after is not None else backoff(failures, self.sync_conf))
+        elif failures >= limit:
+            self._pause(backoff(failures - limit + 1, self.sync_conf))
+
+    def _succeeded(self):
+        with self._lock:
+            self._failures = 0
+
+    def send(self, message):
+        """(outcome, error, retry_after seconds or None)."""
+        if self.paused_for():
+            return DEFERRED, "destination paused", None
+        request = urllib.request.Request(
+            self.url, method="POST", data=json.dumps(message.payload).encode(),
+            headers={"Content-Type": "application/json", "Idempotency-Key": str(message.idempotency_key), **self.headers},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except urllib.error.HTTPError as exc:
+            if exc.code == 409:  # receiver already has this idempotency key
+                self._succeeded()
+                return SENT, "", None
+            if exc.code in (429, 503):  # receiver asks us to slow down: pause the whole destination
+                retry_after = _retry_after(exc)
+                self._failed(throttled=True, retry_after=retry_after)
+                return RETRY, f"HTTP {exc.code}", retry_after
+            if exc.code == 408 or exc.code >= 500:
+                self._failed()
+                return RETRY, f"HTTP {exc.code}", None
+            return DEAD, f"HTTP {exc.code}", None
+        except (urllib.error.URLError, OSError) as exc:
+            self._failed()
+            return RETRY, str(getattr(exc, "reason", exc))[:500], None
+        self._succeeded()
+        return SENT, "", None
+
+
+def _retry_after(exc):
+    try:
+        return max(0.0, float(exc.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+class OutboxWorker:
+
+    def __init__(self, batch_size=None, destinations=None):
+        self.conf = sync_settings()
+        self.batch_size = batch_size or self.conf["BATCH_SIZE"]
+        configured = destinations if destinations is not None else self.conf["DESTINATIONS"]
+        self.destinations = {code: Destination(code, c, self.conf) for code, c in configured.items()}
+        self._pools = {
+            code: ThreadPoolExecutor(max_workers=d.concurrency, thread_name_prefix=f"outbox-{code}")
+            for code, d in self.destinations.items()
+        }
+        self.stats = Counter()
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.shutdown()
+
+    def claim(self):
+        """Claim up to batch_size due messages for destinations that aren't paused."""
+        now = timezone.now()
+        ready = [code for code, d in self.destinations.items() if not d.paused_for()]
+        ids = list(
+            ReferralOutbox.objects.filter(
+                status=ReferralOutbox.Status.PENDING, next_attempt_at__lte=now, destination__in=ready,
+            ).exclude(Exists(_newer()))
+            .order_by("next_attempt_at", "pk").values_list("pk", flat=True)[: self.batch_size]
+        )
+        if not ids:
+            return []
+        claim = uuid.uuid4()
+        ReferralOutbox.objects.filter(
+            pk__in=ids, status=ReferralOutbox.Status.PENDING, next_attempt_at__lte=now,
+        ).update(claim=claim, next_attempt_at=now + timedelta(seconds=self.conf["LEASE"]))
+        return list(ReferralOutbox.objects.filter(claim=claim).order_by("pk"))
+
+    def process(self, batch):
+        futures = [(m, self._pools[m.destination].submit(self.destinations[m.destination].send, m)) for m in batch]
+        results = []
+        for message, future in futures:
+            try:
+                results.append((message, future.result()))
+            except Exception as exc:  # e.g. a malformed URL: fail this message, not the batch
+                results.append((message, (RETRY, f"{type(exc).__name__}: {exc}"[:500], None)))
+        self._record(results)
+
+    def _record(self, results):
+        now = timezone.now()
+        sent, changed = [], []
+        for message, (outcome, error, retry_after) in results:
+            self.stats[outcome] += 1
+            if outcome == SENT:
+                sent.append(message)
+                continue
+            message.claim = None
+            message.last_error = error
+            if outcome == DEFERRED:
+                delay = self.destinations[message.destination].paused_for()
+            else:
+                message.attempts += 1
+                delay = retry_after if retry_after is not None else backoff(message.attempts, self.conf)
+                if outcome == DEAD or message.attempts >= self.conf["MAX_ATTEMPTS"]:
+                    message.status = ReferralOutbox.Status.DEAD
+                    self.stats["dead_letters"] += 1
+            message.next_attempt_at = now + timedelta(seconds=delay)
+            changed.append(message)
+
+        with transaction.atomic():
+            ReferralOutbox.objects.filter(pk__in=[m.pk for m in sent]).update(
+                status=ReferralOutbox.Status.SENT, sent_at=now, claim=None, last_error="",
+            )
+            # QuerySet.update: no post_save, so syncing never enqueues another message
+            Referral.objects.filter(pk__in={m.referral_id for m in sent}).update(last_synced_at=now)
+            ReferralOutbox.objects.bulk_update(
+                changed, ["status", "attempts", "next_attempt_at", "claim", "last_error"], batch_size=500,
+            )
+            # snapshots enqueued while this batch was in flight make its retries stale
+            self.stats["superseded"] += supersede({m.referral_id for m, _ in results})
+
+    def drain(self):
+        """Process batches until nothing is due; returns the number of messages handled."""
+        handled = 0
+        while True:
+            batch = self.claim()
+            if not batch:
+                return handled
+            self.process(batch)
+            handled += len(batch)
+
+    def run(self, interval=5):
+        while True:
+            if not self.drain():
+                time.sleep(interval)
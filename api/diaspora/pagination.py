@@ -0,0 +1,226 @@
+# diaspora/pagination.py
+"""
+Keyset (cursor) pagination for every ModelViewSet.
+
+The page boundary is the last row's values for each ordering key plus the
+primary key as a tiebreaker, so a page is always ``WHERE (keys) > (last) …
+LIMIT n`` – no OFFSET scans, constant cost per page however deep, and rows
+inserted concurrently never shift or duplicate entries across pages.
+
+The ordering is whatever the queryset ends up with (the view's default,
+``?ordering=`` from OrderingFilter, or search relevance). Nullable keys are
+ordered NULLS LAST. Cursors are opaque base64 blobs tied to that ordering.
+"""
+import base64
+import binascii
+import datetime
+import decimal
+import hashlib
+import json
+import uuid
+from collections import namedtuple
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+Key = namedtuple("Key", ["path", "desc", "nullable"])
+Cursor = namedtuple("Cursor", ["values", "reverse"])
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()  # full precision; DjangoJSONEncoder truncates microseconds
+    if isinstance(value, (uuid.UUID, decimal.Decimal)):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self):
+        self.page_size = api_settings.PAGE_SIZE or 50
+
+    # --- ordering keys ---
+
+    def get_keys(self, queryset):
+        model = queryset.model
+        ordering = list(queryset.query.order_by) or list(model._meta.ordering) or ["-pk"]
+        keys = []
+        for item in ordering:
+            if not isinstance(item, str):
+                continue  # expression orderings are not keyset-able; the pk tiebreaker still applies
+            desc = item.startswith("-")
+            path = item.lstrip("-+")
+            if path in ("id", model._meta.pk.name):
+                path = "pk"
+            keys.append(Key(path, desc, self._nullable(model, path, queryset)))
+        if not any(k.path == "pk" for k in keys):
+            keys.append(Key("pk", keys[0].desc if keys else True, False))
+        return keys
+
+    @staticmethod
+    def _nullable(model, path, queryset):
+        if path == "pk" or path in queryset.query.annotations:
+            return False
+        for part in path.split("__"):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return True
+            if field.null:
+                return True  # nullable column, or a nullable FK on the way (LEFT JOIN)
+            model = field.related_model or model
+        return False
+
+    @staticmethod
+    def _value(obj, path):
+        if isinstance(obj, dict):
+            return obj[path]  # values() rows (diaspora/compiled.py) carry the ordering keys
+        if path == "pk":
+            return obj.pk
+        *relations, last = path.split("__")
+        for part in relations:
+            obj = getattr(obj, part, None)
+            if obj is None:
+                return None
+        meta = getattr(obj, "_meta", None)
+        field = next((f for f in meta.concrete_fields if f.name == last), None) if meta else None
+        return getattr(obj, field.attname if field is not None else last)
+
+    def _order_by(self, keys, reverse):
+        out = []
+        # walking backwards the NULLs come first (Django rejects nulls_last=False)
+        nulls = {"nulls_first": True} if reverse else {"nulls_last": True}
+        for k in keys:
+            desc = k.desc != reverse
+            if k.nullable:
+                expr = F(k.path)
+                out.append(expr.desc(**nulls) if desc else expr.asc(**nulls))
+            else:
+                out.append(f"-{k.path}" if desc else k.path)
+        return out
+
+    def _after(self, keys, values, reverse):
+        """Rows strictly after ``values`` in traversal order (tuple comparison, expanded into OR-of-ANDs)."""
+        nulls_last = not reverse
+        condition = Q(pk__in=[])
+        equal = Q()
+        for k, v in zip(keys, values):
+            desc = k.desc != reverse
+            if v is None:
+                beyond = Q(pk__in=[]) if nulls_last else Q(**{f"{k.path}__isnull": False})
+                same = Q(**{f"{k.path}__isnull": True})
+            else:
+                beyond = Q(**{f"{k.path}__{'lt' if desc else 'gt'}": v})
+                if k.nullable and nulls_last:
+                    beyond |= Q(**{f"{k.path}__isnull": True})
+                same = Q(**{k.path: v})
+            condition |= equal & beyond
+            equal &= same
+        return condition
+
+    # --- cursors ---
+
+    @staticmethod
+    def _signature(keys):
+        raw = ",".join(f"{'-' if k.desc else ''}{k.path}" for k in keys)
+        return hashlib.sha1(raw.encode()).hexdigest()[:10]
+
+    def _link(self, keys, values, reverse):
+        payload = {"o": self._signature(keys), "v": values, "r": int(reverse)}
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def encode_cursor(self, keys, obj, reverse):
+        return self._link(keys, [_jsonable(self._value(obj, k.path)) for k in keys], reverse)
+
+    def decode_cursor(self, request, keys):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if payload["o"] != self._signature(keys) or len(payload["v"]) != len(keys):
+                raise ValueError
+            return Cursor(payload["v"], bool(payload["r"]))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    # --- BasePagination API ---
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            if size > 0:
+                return min(size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        keys, cursor, qs = self._page_query(queryset, request)
+        return self._page(keys, cursor, list(qs[: self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset()`` fetching the page through the async ORM (diaspora/async_views.py)."""
+        keys, cursor, qs = self._page_query(queryset, request)
+        return self._page(keys, cursor, [row async for row in qs[: self.page_size + 1]])
+
+    def _page_query(self, queryset, request):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        keys = self.get_keys(queryset)
+        cursor = self.decode_cursor(request, keys)
+        reverse = bool(cursor and cursor.reverse)
+
+        qs = queryset.order_by(*self._order_by(keys, reverse))
+        if cursor:
+            qs = qs.filter(self._after(keys, cursor.values, reverse))
+        return keys, cursor, qs
+
+    def _page(self, keys, cursor, rows):
+        reverse = bool(cursor and cursor.reverse)
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_link = self.previous_link = None
+        more_after = True if reverse else has_more
+        more_before = has_more if reverse else cursor is not None
+        if rows:
+            if more_after:
+                self.next_link = self.encode_cursor(keys, rows[-1], reverse=False)
+            if more_before:
+                self.previous_link = self.encode_cursor(keys, rows[0], reverse=True)
+        elif cursor:
+            # walked off the end: point back the way we came
+            link = self._link(keys, cursor.values, not reverse)
+            if reverse:
+                self.next_link = link
+            else:
+                self.previous_link = link
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.next_link, "previous": self.previous_link, "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
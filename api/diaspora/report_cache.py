@@ -0,0 +1,146 @@
+# diaspora/report_cache.py
+"""
+Versioned response cache for ReportsViewSet.
+
+Every cached entry is keyed on the action, its query window/params and the
+current *generation* of each model it depends on. Writes to a model bump
+that model's generation, so only the entries that read it stop matching
+(they then age out of the bounded backend on their own).
+
+The backend is any Django cache alias (``REPORT_CACHE_ALIAS``): the default
+``reports`` alias is a size-bounded LocMemCache; point it at Redis or
+Memcached to share entries and generations between workers.
+"""
+import hashlib
+import inspect
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework.response import Response
+
+from . import routing
+from .models import Office, Diaspora, Purpose, Case, Referral
+from .reports import parse_dates
+
+KEY_PREFIX = "reports"
+DEPENDENCIES = (Office, Diaspora, Purpose, Case, Referral)
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, "REPORT_CACHE_ALIAS", "reports")]
+
+
+def _gen_key(model):
+    return f"{KEY_PREFIX}:gen:{model.__name__}"
+
+
+def generations(models):
+    cache = _cache()
+    keys = [_gen_key(m) for m in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Seed with a timestamp rather than 1: if a generation is ever evicted
+            # it must not come back at a value some stale entry was stored under.
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[k] for k in keys]
+
+
+def bump(*models):
+    cache = _cache()
+    for model in models:
+        key = _gen_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def stats():
+    with _stats_lock:
+        data = dict(_stats)
+    total = data["hits"] + data["misses"]
+    data["hit_ratio"] = round(data["hits"] / total, 4) if total else None
+    return data
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _lookup(name, request, models):
+    from_date, to_date = parse_dates(request)
+    params = request.query_params
+    parts = [name, str(from_date), str(to_date),
+             (params.get("group") or "").lower(), params.get("type") or ""]
+    parts += [str(g) for g in generations(models)]
+    key = f"{KEY_PREFIX}:{hashlib.sha1('|'.join(parts).encode()).hexdigest()}"
+    data = _cache().get(key)
+    _count("hits" if data is not None else "misses")
+    return key, data
+
+
+def _store(key, response):
+    if response.status_code == 200:
+        timeout = getattr(settings, "REPORT_CACHE_TIMEOUT", 300)
+        if routing.reading_replica():
+            # the replica may not have the write that bumped the generation yet
+            timeout = min(timeout, routing.max_lag())
+        _cache().set(key, response.data, timeout=timeout)
+    return response
+
+
+def cached_report(*models):
+    """
+    Cache a ReportsViewSet action's payload until one of ``models`` is written.
+    The key covers the action, the parsed from/to window and ``group``/``type``.
+    Async actions (``asummary`` …) share the entries of their sync twin.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            name = fn.__name__.removeprefix("a")
+
+            @wraps(fn)
+            async def awrapper(self, request, *args, **kwargs):
+                # cache backends are sync (LocMem) or block on the network: one hop for the lookup
+                key, data = await sync_to_async(_lookup)(name, request, models)
+                if data is not None:
+                    return Response(data)
+                response = await fn(self, request, *args, **kwargs)
+                return await sync_to_async(_store)(key, response)
+            return awrapper
+
+        @wraps(fn)
+        def wrapper(self, request, *args, **kwargs):
+            key, data = _lookup(fn.__name__, request, models)
+            if data is not None:
+                return Response(data)
+            return _store(key, fn(self, request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+# ---------------------------
+# Invalidation
+# ---------------------------
+
+def _invalidate(sender, **kwargs):
+    # after commit, so a concurrent read can't re-cache the pre-write state under the new generation
+    transaction.on_commit(lambda: bump(sender))
+
+
+for _model in DEPENDENCIES:
+    post_save.connect(_invalidate, sender=_model, dispatch_uid=f"report-cache-save-{_model.__name__}")
+    post_delete.connect(_invalidate, sender=_model, dispatch_uid=f"report-cache-delete-{_model.__name__}")
@@ -0,0 +1,352 @@
+# diaspora/reports.py
+"""
+Report query engine behind ReportsViewSet.
+
+Two interchangeable sources build the same payloads:
+
+- ``RollupReports`` reads the daily rollup tables kept by diaspora/rollups.py.
+- ``LiveReports`` scans the source tables. Date windows become half-open
+  ``created_at`` ranges (so the ``created_at`` indexes are usable, unlike
+  ``created_at__date``) and every breakdown of a table is computed in a single
+  query with conditional ``Count(filter=Q(...))``.
+
+``REPORTS_SOURCE`` ("rollup" or "live") picks the one the API serves. Every
+report has an async twin (``asummary`` …) for the ASGI endpoints
+(diaspora/async_views.py) that issues its queries concurrently.
+"""
+import asyncio
+from collections import Counter, namedtuple
+from datetime import datetime, time, timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncYear
+from django.utils import timezone
+
+from . import stage_history
+from .models import (
+    Diaspora, Purpose, Case, Referral, CaseStageTransition,
+    DiasporaDailyRollup, PurposeDailyRollup, CaseDailyRollup, ReferralDailyRollup,
+    CaseStageEntryDailyRollup, CaseStageDurationDailyRollup,
+)
+
+PURPOSE_STATUSES = [value for value, _ in Purpose._meta.get_field("status").choices]
+
+
+def parse_dates(request):
+    params = getattr(request, "query_params", request.GET)
+    to_str = params.get("to")
+    from_str = params.get("from")
+    now = timezone.now().date()
+    to_date = datetime.strptime(to_str, "%Y-%m-%d").date() if to_str else now
+    from_date = datetime.strptime(from_str, "%Y-%m-%d").date() if from_str else to_date.replace(year=to_date.year - 1)
+    return from_date, to_date
+
+
+def datetime_window(from_date, to_date):
+    """Inclusive date window -> half-open [start, end) aware datetimes."""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(from_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(to_date + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def in_window(from_date, to_date, field="created_at"):
+    start, end = datetime_window(from_date, to_date)
+    return Q(**{f"{field}__gte": start, f"{field}__lt": end})
+
+
+def breakdown(field, values, count="pk"):
+    """Conditional counts, one aggregate per value: {"<field>__<value>": Count(filter=...)}."""
+    return {f"{field}__{v}": Count(count, filter=Q(**{field: v})) for v in values}
+
+
+def with_offices(rows, labels=("name", "code"), order_by=(), field="to_office"):
+    """
+    Add ``<field>__<label>`` to GROUP BY rows keyed on ``<field>__id`` (the
+    receiving office unless told otherwise), from the office registry rather
+    than a join, ordered by office name (then ``order_by``) like the joined
+    query was.
+    """
+    from .offices import registry  # offices.py -> report_cache.py -> this module
+    rows = list(rows)
+    key = f"{field}__id"
+    offices = registry.in_bulk({r[key] for r in rows})
+    labelled = []
+    for row in rows:
+        office = offices.get(row[key])
+        out = {key: row[key]}
+        out.update({f"{field}__{label}": getattr(office, label, None) for label in labels})
+        out.update((k, v) for k, v in row.items() if k != key)
+        labelled.append(out)
+    labelled.sort(key=lambda r: (r[f"{field}__name"] or "", *(r[k] for k in order_by)))
+    return labelled
+
+
+def unpack(row, field, values, label="count"):
+    """Turn breakdown() columns back into GROUP BY-shaped rows, dropping empty buckets."""
+    return [{field: v, label: row[f"{field}__{v}"]} for v in sorted(values) if row[f"{field}__{v}"]]
+
+
+def _bucket(group, field):
+    return TruncYear(field) if group == "yearly" else TruncQuarter(field) if group == "quarterly" else TruncMonth(field)
+
+
+def _period(value):
+    return (value.date() if isinstance(value, datetime) else value).isoformat()
+
+
+def _stage_stats(entries, exits, dims):
+    """Funnel entries and time-in-stage percentiles per ``dims`` + stage, stages in workflow order."""
+    groups = {}
+    for rows, bucketed in ((entries, False), (exits, True)):
+        for row in rows:
+            group = groups.setdefault(tuple(row[d] for d in dims) + (row["stage"],), [0, Counter()])
+            if bucketed:
+                group[1][row["bucket"]] += row["n"]
+            else:
+                group[0] += row["n"]
+    order = {stage: i for i, stage in enumerate(Case.Stage.values)}
+    out = []
+    for key in sorted(groups, key=lambda k: (*(str(v) for v in k[:-1]), order[k[-1]])):
+        entered, histogram = groups[key]
+        out.append({
+            **dict(zip(dims, key)), "stage": key[-1], "entered": entered, "left": sum(histogram.values()),
+            "median_seconds": stage_history.percentile(histogram, 50),
+            "p90_seconds": stage_history.percentile(histogram, 90),
+        })
+    return out
+
+
+def stage_funnel_payload(entries, exits):
+    """
+    The stage funnel payload from entry counts and time-in-stage histograms,
+    rows of ``stage``, ``owner_office__id``, ``purpose_type`` (``bucket``) and ``n``.
+    """
+    by_type = _stage_stats(entries, exits, ("purpose_type",))
+    for row in by_type:
+        row["purpose_type"] = row["purpose_type"] or None
+    return {
+        "funnel": _stage_stats(entries, exits, ()),
+        "by_office": with_offices(_stage_stats(entries, exits, ("owner_office__id",)), field="owner_office"),
+        "by_purpose_type": by_type,
+    }
+
+
+# ---------------------------
+# Running a report: sync, or async with its queries in flight together
+# ---------------------------
+
+class Aggregate(namedtuple("Aggregate", ["queryset", "aggregates"])):
+    """``queryset.aggregate(**aggregates)`` as one query of a report."""
+
+
+def _evaluate(query):
+    if isinstance(query, Aggregate):
+        return query.queryset.aggregate(**query.aggregates)
+    return list(query)
+
+
+async def _aevaluate(query):
+    if isinstance(query, Aggregate):
+        return await query.queryset.aaggregate(**query.aggregates)
+    return [row async for row in query]
+
+
+class report:
+    """
+    Decorate a report *plan* – a method returning ``(queries, build)``, where
+    the queries are independent querysets/``Aggregate``s and ``build`` turns
+    their results into the payload – into two methods:
+
+    - ``name(...)`` runs the queries one after another;
+    - ``aname(...)`` runs them concurrently through the async ORM
+      (``asyncio.gather``).
+
+    ``offices=True`` marks builds that label rows from the office registry,
+    which may have to (re)load it: the async variant calls those through
+    ``sync_to_async``.
+    """
+
+    def __new__(cls, plan=None, *, offices=False):
+        if plan is None:
+            return lambda plan: cls(plan, offices=offices)
+        return super().__new__(cls)
+
+    def __init__(self, plan, *, offices=False):
+        self.plan = plan
+        self.offices = offices
+
+    def __set_name__(self, owner, name):
+        plan, offices = self.plan, self.offices
+
+        @wraps(plan)
+        def run(source, *args, **kwargs):
+            queries, build = plan(source, *args, **kwargs)
+            return build(*map(_evaluate, queries))
+
+        @wraps(plan)
+        async def arun(source, *args, **kwargs):
+            queries, build = plan(source, *args, **kwargs)
+            results = await asyncio.gather(*map(_aevaluate, queries))
+            return await sync_to_async(build)(*results) if offices else build(*results)
+
+        setattr(owner, name, run)
+        setattr(owner, f"a{name}", arun)
+
+
+class LiveReports:
+    """Reports straight from the source tables, one query per table."""
+
+    @report
+    def summary(self, from_date, to_date):
+        window = in_window(from_date, to_date)
+        statuses = Referral.ReferralStatus.values
+        types = Purpose.PurposeType.values
+
+        def build(diasporas, cases, ref, purp):
+            return {
+                "total_diasporas": diasporas["n"],
+                "active_cases": cases["n"],
+                "referrals_by_status": unpack(ref, "status", statuses),
+                "purposes_breakdown": unpack(purp, "type", types),
+            }
+        return [
+            Aggregate(Diaspora.objects.filter(window), {"n": Count("pk")}),
+            Aggregate(Case.objects.exclude(overall_status="DONE"), {"n": Count("pk")}),
+            Aggregate(Referral.objects.filter(window), breakdown("status", statuses)),
+            Aggregate(Purpose.objects.filter(window), breakdown("type", types)),
+        ], build
+
+    @report
+    def diasporas_by_period(self, group, from_date, to_date):
+        qs = Diaspora.objects.filter(in_window(from_date, to_date))
+        data = qs.annotate(period=_bucket(group, "created_at")).values("period").annotate(count=Count("pk")).order_by("period")
+        return [data], lambda rows: [{"period": _period(d["period"]), "count": d["count"]} for d in rows]
+
+    @report
+    def progress_by_purpose(self, from_date, to_date, ptype=None):
+        qs = Purpose.objects.filter(in_window(from_date, to_date))
+        if ptype: qs = qs.filter(type=ptype)
+        rows = qs.values("type").annotate(**breakdown("status", PURPOSE_STATUSES)).order_by("type")
+        return [rows], lambda rows: [
+            {"type": r["type"], "status": s["status"], "count": s["count"]}
+            for r in rows for s in unpack(r, "status", PURPOSE_STATUSES)
+        ]
+
+    @report
+    def cases_by_status(self):
+        stages, overall = Case.Stage.values, Case.OverallStatus.values
+        return [
+            Aggregate(Case.objects.all(), {**breakdown("current_stage", stages), **breakdown("overall_status", overall)}),
+        ], lambda row: {
+            "by_stage": unpack(row, "current_stage", stages),
+            "by_overall_status": unpack(row, "overall_status", overall),
+        }
+
+    @report(offices=True)
+    def referrals_by_office(self, from_date, to_date):
+        statuses = Referral.ReferralStatus.values
+
+        def build(rows):
+            totals, by_status = [], []
+            for r in with_offices(rows):
+                totals.append({k: r[k] for k in ("to_office__id", "to_office__name", "to_office__code", "total")})
+                by_status += [
+                    {"to_office__id": r["to_office__id"], "to_office__name": r["to_office__name"], **s}
+                    for s in unpack(r, "status", statuses)
+                ]
+            return {"totals": totals, "by_status": by_status}
+        return [
+            Referral.objects.filter(in_window(from_date, to_date))
+            .values("to_office__id")
+            .annotate(total=Count("pk"), **breakdown("status", statuses))
+            .order_by()
+        ], build
+
+    @report(offices=True)
+    def stage_funnel(self, from_date, to_date):
+        # every transition in the window, binned here: what the rollups save us
+        history = CaseStageTransition.objects.filter(in_window(from_date, to_date))
+        return [
+            history.exclude(from_stage=F("to_stage"))
+            .values("owner_office__id", "purpose_type", stage=F("to_stage")).annotate(n=Count("pk")).order_by(),
+            history.filter(stage_seconds__isnull=False)
+            .values_list("from_stage", "owner_office_id", "purpose_type", "stage_seconds"),
+        ], lambda entries, exits: stage_funnel_payload(entries, [
+            {"stage": stage, "owner_office__id": office, "purpose_type": ptype, "bucket": stage_history.bucket(seconds), "n": 1}
+            for stage, office, ptype, seconds in exits
+        ])
+
+
+class RollupReports:
+    """Reports from the daily rollup tables; cost is independent of registry size."""
+
+    @staticmethod
+    def _window(from_date, to_date):
+        return dict(day__gte=from_date, day__lte=to_date, row_count__gt=0)
+
+    @report
+    def summary(self, from_date, to_date):
+        window = self._window(from_date, to_date)
+        return [
+            Aggregate(DiasporaDailyRollup.objects.filter(**window), {"n": Sum("row_count")}),
+            Aggregate(CaseDailyRollup.objects.exclude(overall_status="DONE"), {"n": Sum("row_count")}),
+            ReferralDailyRollup.objects.filter(**window).values("status").annotate(count=Sum("row_count")).order_by("status"),
+            PurposeDailyRollup.objects.filter(**window).values("type").annotate(count=Sum("row_count")).order_by("type"),
+        ], lambda diasporas, cases, referrals, purposes: {
+            "total_diasporas": diasporas["n"] or 0,
+            "active_cases": cases["n"] or 0,
+            "referrals_by_status": referrals,
+            "purposes_breakdown": purposes,
+        }
+
+    @report
+    def diasporas_by_period(self, group, from_date, to_date):
+        qs = DiasporaDailyRollup.objects.filter(**self._window(from_date, to_date))
+        data = qs.annotate(period=_bucket(group, "day")).values("period").annotate(count=Sum("row_count")).order_by("period")
+        return [data], lambda rows: [{"period": _period(d["period"]), "count": d["count"]} for d in rows]
+
+    @report
+    def progress_by_purpose(self, from_date, to_date, ptype=None):
+        qs = PurposeDailyRollup.objects.filter(**self._window(from_date, to_date))
+        if ptype: qs = qs.filter(type=ptype)
+        return [qs.values("type", "status").annotate(count=Sum("row_count")).order_by("type", "status")], lambda rows: rows
+
+    @report
+    def cases_by_status(self):
+        qs = CaseDailyRollup.objects.filter(row_count__gt=0)
+        return [
+            qs.values("current_stage").annotate(count=Sum("row_count")).order_by("current_stage"),
+            qs.values("overall_status").annotate(count=Sum("row_count")).order_by("overall_status"),
+        ], lambda by_stage, by_overall: {"by_stage": by_stage, "by_overall_status": by_overall}
+
+    @report(offices=True)
+    def referrals_by_office(self, from_date, to_date):
+        qs = ReferralDailyRollup.objects.filter(**self._window(from_date, to_date))
+        return [
+            qs.values("to_office__id").annotate(total=Sum("row_count")).order_by(),
+            qs.values("to_office__id", "status").annotate(count=Sum("row_count")).order_by(),
+        ], lambda totals, by_status: {
+            "totals": with_offices(totals),
+            "by_status": with_offices(by_status, labels=("name",), order_by=("status",)),
+        }
+
+    @report(offices=True)
+    def stage_funnel(self, from_date, to_date):
+        window = self._window(from_date, to_date)
+        dims = ("stage", "owner_office__id", "purpose_type")
+        return [
+            CaseStageEntryDailyRollup.objects.filter(**window).values(*dims).annotate(n=Sum("row_count")).order_by(),
+            CaseStageDurationDailyRollup.objects.filter(**window).values(*dims, "bucket").annotate(n=Sum("row_count")).order_by(),
+        ], stage_funnel_payload
+
+
+SOURCES = {"rollup": RollupReports, "live": LiveReports}
+
+
+def get_source(name=None):
+    return SOURCES[name or getattr(settings, "REPORTS_SOURCE", "rollup")]()
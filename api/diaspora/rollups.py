@@ -0,0 +1,174 @@
+# diaspora/rollups.py
+"""
+Daily rollup tables behind ReportsViewSet.
+
+Each source row counts once in its rollup bucket (created day + the
+dimensions the reports group by). Signals move the count between buckets
+on every save/delete, so the report actions only ever read the small
+rollup tables. Bulk ``QuerySet.update()`` bypasses signals – callers doing
+that must call ``move()`` themselves, or run ``manage.py rebuild_rollups``.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.utils import timezone
+
+from .models import (
+    Diaspora, Purpose, Case, Referral,
+    DiasporaDailyRollup, PurposeDailyRollup, CaseDailyRollup, ReferralDailyRollup,
+)
+
+# source model -> (rollup model, dimension fields shared by both)
+ROLLUPS = {
+    Diaspora: (DiasporaDailyRollup, ("owner_office_id",)),
+    Purpose: (PurposeDailyRollup, ("type", "status")),
+    Case: (CaseDailyRollup, ("current_stage", "overall_status")),
+    Referral: (ReferralDailyRollup, ("to_office_id", "status")),
+}
+
+
+def _key(instance, fields, fallback=None):
+    """(day, *dimensions) read straight from __dict__ so deferred fields never hit the DB."""
+    data = instance.__dict__
+    created_at = data.get("created_at")
+    if created_at is not None:
+        values = [timezone.localdate(created_at)]
+    elif fallback is not None:
+        values = [fallback[0]]  # deferred: the day never changes, the dimensions may have
+    else:
+        return None
+    for i, f in enumerate(fields, start=1):
+        if f in data:
+            values.append(data[f])
+        elif fallback is not None:
+            values.append(fallback[i])
+        else:
+            return None
+    return tuple(values)
+
+
+def bump(rollup, fields, key, delta):
+    lookup = dict(zip(("day",) + fields, key))
+    if rollup.objects.filter(**lookup).update(row_count=F("row_count") + delta):
+        return
+    if delta < 0:
+        # bucket never existed (rows written before rollups); rebuild_rollups fixes it
+        return
+    try:
+        with transaction.atomic():
+            rollup.objects.create(row_count=delta, **lookup)
+    except IntegrityError:
+        rollup.objects.filter(**lookup).update(row_count=F("row_count") + delta)
+
+
+def bump_many(rollup, fields, deltas):
+    """
+    bump() for many buckets at once ({key: delta}): the existing buckets are
+    read in one query and incremented with one UPDATE per distinct delta,
+    the new ones are inserted with one bulk_create.
+    """
+    if len(deltas) <= 3:
+        for key, delta in deltas.items():
+            bump(rollup, fields, key, delta)
+        return
+    names = ("day",) + fields
+    days = [key[0] for key in deltas]
+    existing = {}
+    for pk, *key in rollup.objects.filter(day__gte=min(days), day__lte=max(days)).values_list("pk", *names).iterator():
+        if tuple(key) in deltas:
+            existing[tuple(key)] = pk
+    by_delta = {}
+    for key, pk in existing.items():
+        by_delta.setdefault(deltas[key], []).append(pk)
+    for delta, pks in by_delta.items():
+        for i in range(0, len(pks), 500):
+            rollup.objects.filter(pk__in=pks[i:i + 500]).update(row_count=F("row_count") + delta)
+
+    new = {key: delta for key, delta in deltas.items() if key not in existing and delta > 0}
+    try:
+        with transaction.atomic():
+            rollup.objects.bulk_create([rollup(row_count=delta, **dict(zip(names, key))) for key, delta in new.items()])
+    except IntegrityError:
+        # a concurrent writer created some of them first
+        for key, delta in new.items():
+            bump(rollup, fields, key, delta)
+
+
+def move(model, old_key, new_key, delta=1):
+    """Move ``delta`` rows of ``model`` from one bucket to another."""
+    rollup, fields = ROLLUPS[model]
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        bump(rollup, fields, old_key, -delta)
+    if new_key is not None:
+        bump(rollup, fields, new_key, delta)
+
+
+def add(model, instances):
+    """Count freshly bulk-created rows (bulk_create sends no signals)."""
+    rollup, fields = ROLLUPS[model]
+    keys = Counter()
+    for instance in instances:
+        instance._rollup_key = _key(instance, fields)
+        if instance._rollup_key is not None:
+            keys[instance._rollup_key] += 1
+    bump_many(rollup, fields, keys)
+
+
+def rebuild(model):
+    """Recompute one rollup table from its source table."""
+    rollup, fields = ROLLUPS[model]
+    rows = (
+        model.objects.annotate(day=TruncDate("created_at"))
+        .values("day", *fields).annotate(n=Count("pk")).order_by()
+    )
+    with transaction.atomic():
+        rollup.objects.all().delete()
+        rollup.objects.bulk_create(
+            [rollup(row_count=r.pop("n"), **r) for r in rows.iterator(chunk_size=2000)],
+            batch_size=1000,
+        )
+    return rollup.objects.count()
+
+
+# ---------------------------
+# Signal receivers
+# ---------------------------
+
+def _remember(sender, instance, **kwargs):
+    instance._rollup_key = _key(instance, ROLLUPS[sender][1])
+
+
+def _load_old_key(sender, instance, raw=False, **kwargs):
+    # Instances built by hand (not loaded through the ORM) have no remembered key.
+    if raw or instance._state.adding or getattr(instance, "_rollup_key", None) is not None:
+        return
+    fields = ROLLUPS[sender][1]
+    row = sender.objects.filter(pk=instance.pk).values("created_at", *fields).first()
+    if row:
+        instance._rollup_key = (timezone.localdate(row["created_at"]),) + tuple(row[f] for f in fields)
+
+
+def _on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_key = None if created else getattr(instance, "_rollup_key", None)
+    new_key = _key(instance, ROLLUPS[sender][1], fallback=old_key)
+    move(sender, old_key, new_key)
+    instance._rollup_key = new_key
+
+
+def _on_delete(sender, instance, **kwargs):
+    key = getattr(instance, "_rollup_key", None) or _key(instance, ROLLUPS[sender][1])
+    move(sender, key, None)
+
+
+for _model in ROLLUPS:
+    post_init.connect(_remember, sender=_model, dispatch_uid=f"rollup-init-{_model.__name__}")
+    pre_save.connect(_load_old_key, sender=_model, dispatch_uid=f"rollup-pre-{_model.__name__}")
+    post_save.connect(_on_save, sender=_model, dispatch_uid=f"rollup-save-{_model.__name__}")
+    post_delete.connect(_on_delete, sender=_model, dispatch_uid=f"rollup-delete-{_model.__name__}")
@@ -0,0 +1,283 @@
+# diaspora/routing.py
+"""
+Primary / read-replica database routing.
+
+``DATABASE_ROUTING`` names the primary alias and any read-replica aliases in
+``DATABASES``. Everything goes to the primary unless a request opts in:
+viewsets mixing in ``ReplicaReadMixin`` send the safe-method actions listed in
+``replica_actions`` (list/retrieve, and the report actions) to one healthy
+replica, picked once per request so every query of the request sees the same
+snapshot. The primary is used instead when
+
+- the request already wrote, or is inside a transaction on the primary,
+- the user wrote within the last ``MAX_LAG`` seconds (read-your-writes pin).
+  The pin travels with the client as a signed cookie that expires after
+  MAX_LAG, so it holds whichever worker serves the next request. It is also
+  kept in the default cache for clients that drop cookies, which only helps
+  across workers when that cache is shared.
+- the client sends ``X-DB-Route: primary`` (``replica`` skips the pin), or
+- no replica passes its health check, re-run every ``HEALTH_CHECK_INTERVAL``
+  seconds per process. Each check stamps a heartbeat (a Watermark row) on the
+  primary and reads the replica's copy of it. A replica that doesn't have the
+  primary's latest heartbeat and whose own is older than MAX_LAG has fallen
+  behind (or stopped replicating) and is skipped until it catches up.
+
+Report payloads computed on a replica are cached for at most ``MAX_LAG``
+seconds (report_cache.py), and the office registry always loads from the
+primary, so a lagging replica can't outlive its lag in a cache.
+
+Responses served from a replica carry ``X-DB-Replica: <alias>``. Locally,
+SQLite files can stand in for replicas: ``manage.py sync_replicas`` copies the
+primary into them (``--interval`` keeps doing so, simulating replication lag).
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from rest_framework.permissions import SAFE_METHODS
+
+from .models import Watermark
+
+logger = logging.getLogger(__name__)
+
+OVERRIDE_HEADER = "HTTP_X_DB_ROUTE"
+PIN_KEY_PREFIX = "db-pin"
+PIN_COOKIE = "db_pin"
+HEARTBEAT = "replication-heartbeat"
+
+_state = ContextVar("diaspora_db_routing", default=None)
+
+
+def _config():
+    return getattr(settings, "DATABASE_ROUTING", {})
+
+
+def primary():
+    return _config().get("PRIMARY", "default")
+
+
+def replicas():
+    return list(_config().get("REPLICAS", ()))
+
+
+def max_lag():
+    return _config().get("MAX_LAG", 5)
+
+
+class RoutingState:
+    """Routing of one request: the replica reads go to (None: primary) and whether it wrote."""
+
+    def __init__(self, override=None):
+        self.override = override
+        self.replica = None
+        self.wrote = False
+
+
+# ---------------------------
+# Replica health
+# ---------------------------
+
+class ReplicaHealth:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}  # alias -> (monotonic time, healthy)
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            # also fails on an empty or half-copied file, which connects fine
+            seen = Watermark.objects.using(alias).filter(name=HEARTBEAT).values_list("value", flat=True).first()
+        except DatabaseError as exc:
+            logger.warning("Replica %s failed its health check: %s", alias, exc)
+            connection.close()
+            return False
+        latest = self.beat()
+        if seen is None:
+            lag = None  # never synced a heartbeat
+        elif latest is not None and seen >= latest:
+            lag = 0  # has the primary's latest stamp
+        else:
+            lag = (timezone.now() - seen).total_seconds()
+        if lag is None or lag > max_lag():
+            logger.warning("Replica %s is behind the primary (lag %s s)", alias, lag)
+            return False
+        return True
+
+    def beat(self):
+        """Stamp the heartbeat on the primary; returns the previous stamp (None if there was none)."""
+        heartbeat = Watermark.objects.using(primary()).filter(name=HEARTBEAT)
+        previous = heartbeat.values_list("value", flat=True).first()
+        if not heartbeat.update(value=timezone.now()):
+            Watermark.objects.using(primary()).get_or_create(name=HEARTBEAT, defaults={"value": timezone.now()})
+        return previous
+
+    def healthy(self, alias):
+        interval = _config().get("HEALTH_CHECK_INTERVAL", 10)
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(alias)
+        if checked is not None and now - checked[0] < interval:
+            return checked[1]
+        ok = self.check(alias)
+        with self._lock:
+            self._checked[alias] = (now, ok)
+        return ok
+
+    def choose(self):
+        candidates = [alias for alias in replicas() if self.healthy(alias)]
+        return random.choice(candidates) if candidates else None
+
+    def status(self):
+        return {alias: self.check(alias) for alias in replicas()}
+
+    def clear(self):
+        with self._lock:
+            self._checked.clear()
+
+
+health = ReplicaHealth()
+
+
+# ---------------------------
+# Router
+# ---------------------------
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or state.wrote:
+            return primary()
+        if connections[primary()].in_atomic_block:
+            return primary()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return primary()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {primary(), *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are copies of the primary, never migrated on their own
+        return False if db in replicas() else None
+
+
+def reading_replica():
+    """The replica the current request reads from, or None."""
+    state = _state.get()
+    if state is None or state.wrote or connections[primary()].in_atomic_block:
+        return None
+    return state.replica
+
+
+def _pin_key(user):
+    return f"{PIN_KEY_PREFIX}:{user.pk}"
+
+
+def pinned(request):
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    cookie = request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_KEY_PREFIX, max_age=max_lag())
+    return cookie == str(user.pk) or bool(cache.get(_pin_key(user)))
+
+
+def route_to_replica(request):
+    """Read the rest of this request from a replica, unless something above says otherwise."""
+    state = _state.get()
+    if state is None or state.wrote or state.override == "primary" or not replicas():
+        return None
+    if state.override != "replica" and pinned(request):
+        return None
+    state.replica = health.choose()
+    return state.replica
+
+
+def pin(request, response):
+    """Keep the user's reads on the primary until replicas have caught up with their write."""
+    user = request.user
+    if replicas() and user.is_authenticated:
+        cache.set(_pin_key(user), 1, timeout=max_lag())
+        response.set_signed_cookie(
+            PIN_COOKIE, str(user.pk), salt=PIN_KEY_PREFIX, max_age=max_lag(), httponly=True, samesite="Lax",
+        )
+
+
+class ReplicaReadMixin:
+    """
+    Serve the safe-method ``replica_actions`` of a viewset from a read replica,
+    and pin users who write through it to the primary.
+    """
+    replica_actions = ("list", "retrieve")
+
+    def initial(self, request, *args, **kwargs):
+        # after authentication, so the read-your-writes pin can be looked up by user
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and self.action in self.replica_actions:
+            route_to_replica(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        state = _state.get()
+        if state is not None and state.wrote:
+            pin(request, response)
+        return response
+
+
+# ---------------------------
+# Middleware
+# ---------------------------
+
+class DatabaseRoutingMiddleware:
+    """Scope routing state, and the X-DB-Route override, to the request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self._state(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self._state(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(request, response, state)
+
+    def _state(self, request):
+        override = request.META.get(OVERRIDE_HEADER, "").lower()
+        return RoutingState(override if override in ("primary", "replica") else None)
+
+    def _finish(self, request, response, state):
+        if state.replica is not None and not state.wrote:
+            response["X-DB-Replica"] = state.replica
+        return response
@@ -0,0 +1,343 @@
+# diaspora/search.py
+"""
+Full-text search index over the diaspora registry.
+
+One document per Diaspora (names, email, username, phone, passport, ID number
+and diaspora_id) lives in a side table maintained by signals:
+
+- SQLite: an FTS5 virtual table with the trigram tokenizer, so substring
+  matches behave like the old ``icontains`` search but are index-backed and
+  ranked with bm25().
+- PostgreSQL: a plain table with a pg_trgm GIN index; ILIKE is index-backed
+  and hits are ranked by trigram similarity.
+
+``IndexedSearchFilter`` is a drop-in replacement for DRF's SearchFilter on
+views whose ``search_fields`` include every document field: those go through
+the index, any others are still matched with ``icontains``. Views searching
+only some of the document's fields (the index would match on the rest too),
+or running without the index, get plain SearchFilter behaviour.
+"""
+import logging
+import operator
+from abc import ABC, abstractmethod
+from functools import reduce
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, connections, router, transaction
+from django.db.models import Case as CaseWhen, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.utils.module_loading import import_string
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+from .models import Diaspora
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+TABLE = "diaspora_search"
+
+# Diaspora lookups that make up the indexed document.
+DOCUMENT_FIELDS = [
+    "user__first_name", "user__last_name", "user__email", "user__username",
+    "primary_phone", "passport_no", "id_number", "diaspora_id",
+]
+USER_FIELDS = {"first_name", "last_name", "email", "username"}
+DIASPORA_FIELDS = {f for f in DOCUMENT_FIELDS if "__" not in f} | {"user", "user_id"}
+
+
+def build_documents(queryset):
+    """Yield (diaspora pk as stored by the DB, document text)."""
+    for row in queryset.values_list("pk", *DOCUMENT_FIELDS).iterator(chunk_size=2000):
+        pk, values = row[0], row[1:]
+        yield pk.hex if connection.vendor == "sqlite" else str(pk), " ".join(v for v in values if v)
+
+
+def _like_pattern(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class SearchIndex(ABC):
+    """
+    Interface of a search backend. ``search`` returns diaspora pks, best match
+    first; ``matching`` the (sql, params) of a query selecting every matching
+    pk, for use as a subquery.
+    """
+
+    @abstractmethod
+    def ensure(self): ...
+
+    @abstractmethod
+    def upsert(self, docs, fresh=False): ...
+
+    @abstractmethod
+    def remove(self, pks): ...
+
+    @abstractmethod
+    def clear(self): ...
+
+    @abstractmethod
+    def search(self, terms, limit): ...
+
+    @abstractmethod
+    def matching(self, terms): ...
+
+
+class SqliteFtsIndex(SearchIndex):
+
+    def ensure(self):
+        with connection.cursor() as cur:
+            cur.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} "
+                f"USING fts5(diaspora_pk UNINDEXED, document, tokenize='trigram')"
+            )
+
+    def upsert(self, docs, fresh=False):
+        docs = list(docs)
+        with connection.cursor() as cur:
+            if not fresh:
+                # diaspora_pk is UNINDEXED: each of these deletes scans the index table
+                cur.executemany(f"DELETE FROM {TABLE} WHERE diaspora_pk = %s", [(pk,) for pk, _ in docs])
+            cur.executemany(f"INSERT INTO {TABLE} (diaspora_pk, document) VALUES (%s, %s)", docs)
+
+    def remove(self, pks):
+        with connection.cursor() as cur:
+            cur.executemany(f"DELETE FROM {TABLE} WHERE diaspora_pk = %s", [(pk,) for pk in pks])
+
+    def clear(self):
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {TABLE}")
+
+    def _where(self, terms):
+        # trigram MATCH needs >= 3 characters; shorter terms are LIKE-filtered on the (small) index table
+        long_terms = [t for t in terms if len(t) >= 3]
+        short_terms = [t for t in terms if len(t) < 3]
+        where, params = [], []
+        if long_terms:
+            where.append(f"{TABLE} MATCH %s")
+            params.append(" AND ".join('"%s"' % t.replace('"', '""') for t in long_terms))
+        for t in short_terms:
+            where.append("document LIKE %s ESCAPE '\\'")
+            params.append(_like_pattern(t))
+        return " AND ".join(where), params, bool(long_terms)
+
+    def search(self, terms, limit):
+        where, params, ranked = self._where(terms)
+        order = "ORDER BY rank" if ranked else ""
+        # the replica the request reads from, if any (diaspora/routing.py), so hits match the rows
+        with connections[router.db_for_read(Diaspora)].cursor() as cur:
+            cur.execute(f"SELECT diaspora_pk FROM {TABLE} WHERE {where} {order} LIMIT %s", params + [limit])
+            return [row[0] for row in cur.fetchall()]
+
+    def matching(self, terms):
+        where, params, _ = self._where(terms)
+        return f"SELECT diaspora_pk FROM {TABLE} WHERE {where}", params
+
+
+class PostgresTrigramIndex(SearchIndex):
+
+    def ensure(self):
+        with connection.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} (diaspora_pk uuid PRIMARY KEY, document text NOT NULL)")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_trgm ON {TABLE} USING gin (document gin_trgm_ops)")
+
+    def upsert(self, docs, fresh=False):
+        with connection.cursor() as cur:
+            cur.executemany(
+                f"INSERT INTO {TABLE} (diaspora_pk, document) VALUES (%s, %s) "
+                f"ON CONFLICT (diaspora_pk) DO UPDATE SET document = EXCLUDED.document",
+                list(docs),
+            )
+
+    def remove(self, pks):
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {TABLE} WHERE diaspora_pk = ANY(%s::uuid[])", [list(pks)])
+
+    def clear(self):
+        with connection.cursor() as cur:
+            cur.execute(f"TRUNCATE {TABLE}")
+
+    def search(self, terms, limit):
+        patterns = [_like_pattern(t) for t in terms]
+        with connections[router.db_for_read(Diaspora)].cursor() as cur:
+            cur.execute(
+                f"SELECT diaspora_pk FROM {TABLE} WHERE document ILIKE ALL(%s) "
+                f"ORDER BY similarity(document, %s) DESC LIMIT %s",
+                [patterns, " ".join(terms), limit],
+            )
+            return [str(row[0]) for row in cur.fetchall()]
+
+    def matching(self, terms):
+        return f"SELECT diaspora_pk FROM {TABLE} WHERE document ILIKE ALL(%s)", [[_like_pattern(t) for t in terms]]
+
+
+BACKENDS = {"sqlite": SqliteFtsIndex, "postgresql": PostgresTrigramIndex}
+
+
+def get_index():
+    """The configured index (SEARCH_INDEX_BACKEND) or the one matching the DB vendor; None if unsupported."""
+    path = getattr(settings, "SEARCH_INDEX_BACKEND", None)
+    if path:
+        return import_string(path)()
+    backend = BACKENDS.get(connection.vendor)
+    return backend() if backend else None
+
+
+def reindex(pks, fresh=False):
+    """(Re)build the documents of ``pks``; ``fresh`` when they were just created and can't be indexed yet."""
+    index = get_index()
+    if index is None:
+        return
+    docs = list(build_documents(Diaspora.objects.filter(pk__in=pks)))
+    found = {pk for pk, _ in docs}
+    index.upsert(docs, fresh=fresh)
+    if fresh:
+        return
+    stale = [pk.hex if connection.vendor == "sqlite" else str(pk) for pk in pks]
+    index.remove([pk for pk in stale if pk not in found])
+
+
+def rebuild(batch_size=2000):
+    index = get_index()
+    if index is None:
+        return 0
+    index.ensure()
+    total = 0
+    with transaction.atomic():
+        index.clear()
+        batch = []
+        for doc in build_documents(Diaspora.objects.order_by()):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                index.upsert(batch, fresh=True)
+                total += len(batch)
+                batch = []
+        index.upsert(batch, fresh=True)
+        total += len(batch)
+    return total
+
+
+# ---------------------------
+# Filter backend
+# ---------------------------
+
+class IndexedSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter whose diaspora/user lookups are answered by the search index.
+
+    View attributes:
+      search_index_path  lookup from the view's model to Diaspora ("" for Diaspora itself)
+    The index is only used when ``search_fields`` include all of DOCUMENT_FIELDS
+    (behind ``search_index_path``); each search term must then match the index
+    or one of the other fields.
+    Results are ordered by relevance unless an explicit ``ordering`` is requested
+    (past SEARCH_INDEX_MAX_HITS matches, the rest follow the ranked ones in the usual order).
+    """
+
+    def _split_fields(self, view, fields):
+        path = getattr(view, "search_index_path", None)
+        if path is None:
+            return [], fields
+        prefix = f"{path}__" if path else ""
+        covered = [f for f in fields if f.startswith(prefix) and f[len(prefix):] in DOCUMENT_FIELDS]
+        if {f[len(prefix):] for f in covered} != set(DOCUMENT_FIELDS):
+            # the document would also match fields this view doesn't search
+            return [], fields
+        return covered, [f for f in fields if f not in covered]
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        covered, remaining = self._split_fields(view, search_fields)
+        index = get_index() if covered else None
+        if index is None:
+            return super().filter_queryset(request, queryset, view)
+        limit = getattr(settings, "SEARCH_INDEX_MAX_HITS", 500)
+        try:
+            hits = index.search(search_terms, limit + 1)
+        except DatabaseError:
+            logger.exception("search index unavailable, falling back to icontains")
+            return super().filter_queryset(request, queryset, view)
+
+        pk_lookup = f"{view.search_index_path}__pk" if view.search_index_path else "pk"
+        if remaining:
+            # a term may match the document or another field: one condition per term
+            lookups = [self.construct_search(str(f), queryset) for f in remaining]
+            condition = reduce(operator.and_, (
+                reduce(operator.or_, (Q(**{lookup: term}) for lookup in lookups),
+                       Q(**{f"{pk_lookup}__in": RawSQL(*index.matching([term]))}))
+                for term in search_terms
+            ))
+            hits = hits[:limit]  # rows matching every term in the document rank first
+        elif len(hits) > limit:
+            # too many to list: match every hit through an index subquery, so the other
+            # filters and the count see all of them; only the top ``limit`` are ranked
+            hits = hits[:limit]
+            condition = Q(**{f"{pk_lookup}__in": RawSQL(*index.matching(search_terms))})
+        else:
+            condition = Q(**{f"{pk_lookup}__in": hits})
+        queryset = queryset.filter(condition)
+
+        if hits and not request.query_params.get(api_settings.ORDERING_PARAM):
+            rank = CaseWhen(
+                *[When(**{pk_lookup: pk, "then": Value(i)}) for i, pk in enumerate(hits)],
+                default=Value(len(hits)), output_field=IntegerField(),
+            )
+            queryset = queryset.annotate(search_rank=rank).order_by("search_rank", *queryset.query.order_by)
+        return queryset
+
+
+# ---------------------------
+# Index maintenance
+# ---------------------------
+
+def _touches(update_fields, fields):
+    return update_fields is None or bool(set(update_fields) & fields)
+
+
+def _on_diaspora_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(update_fields, DIASPORA_FIELDS):
+        return
+    pk = instance.pk
+    # a new row can't have a document yet: skip the delete that scans the index
+    transaction.on_commit(lambda: safe_reindex([pk], fresh=created))
+
+
+def _on_diaspora_delete(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: safe_reindex([pk]))
+
+
+def _on_user_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # logins save last_login only – don't reindex on those; a new user's diaspora indexes itself
+    if raw or created or not _touches(update_fields, USER_FIELDS):
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: safe_reindex(list(Diaspora.objects.filter(user_id=user_id).values_list("pk", flat=True))))
+
+
+def safe_reindex(pks, fresh=False):
+    if not pks:
+        return
+    try:
+        reindex(pks, fresh=fresh)
+    except DatabaseError:
+        # index table missing (not built yet); manage.py rebuild_search_index recovers
+        logger.warning("search index not updated for %s", pks, exc_info=True)
+
+
+def ensure_index(sender=None, **kwargs):
+    index = get_index()
+    if index is not None:
+        index.ensure()
+
+
+post_save.connect(_on_diaspora_save, sender=Diaspora, dispatch_uid="search-diaspora-save")
+post_delete.connect(_on_diaspora_delete, sender=Diaspora, dispatch_uid="search-diaspora-delete")
+post_save.connect(_on_user_save, sender=User, dispatch_uid="search-user-save")
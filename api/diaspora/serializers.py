@@ -3,25 +3,60 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from rest_framework import serializers
 from .models import Office, Diaspora, Purpose, Case, Referral, Announcement
+from .authentication import full_user
+from .fieldsets import SparseFieldsetMixin
+from .offices import registry as office_registry
+from . import routing
+from .transitions import STAGE_TRANSITIONS, STATUS_TRANSITIONS, check as check_transition
 
 User = get_user_model()
 
 # --- Slim user exposure for read ---
-class UserSlimSerializer(serializers.ModelSerializer):
+class UserSlimSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "username", "email", "first_name", "last_name", "date_joined"]
         read_only_fields = fields
 
 
-class OfficeSerializer(serializers.ModelSerializer):
+class OfficeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Office
         fields = "__all__"
 
 
+class OfficeField(serializers.PrimaryKeyRelatedField):
+    """
+    Office by pk, resolved from the in-process registry (diaspora/offices.py).
+
+    The registry may still hold an office another worker deleted, and the
+    write would then fail at commit, taking the rest of the writer's group
+    commit with it. So a hit is confirmed with a primary-key lookup on the
+    primary, inside the write transaction.
+    """
+
+    def __init__(self, **kwargs):
+        if not kwargs.get("read_only"):
+            kwargs.setdefault("queryset", Office.objects.all())  # browsable API choices only
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            office = office_registry.get(int(data))
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if office is None:
+            self.fail("does_not_exist", pk_value=data)
+        if not Office.objects.using(routing.primary()).filter(pk=office.pk).exists():
+            office_registry.clear()
+            self.fail("does_not_exist", pk_value=data)
+        return office
+
+
 # --- Diaspora read serializer (includes user fields) ---
-class DiasporaSerializer(serializers.ModelSerializer):
+class DiasporaSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user = UserSlimSerializer(read_only=True)
     full_name = serializers.CharField(read_only=True)
 
@@ -40,6 +75,11 @@ class DiasporaSerializer(serializers.ModelSerializer):
             "created_at", "updated_at",
         ]
         read_only_fields = ["id", "diaspora_id", "created_at", "updated_at", "created_by"]
+        # ?expand= / ?fields= (diaspora/fieldsets.py)
+        expandable = {"user": UserSlimSerializer, "owner_office": OfficeSerializer, "created_by": UserSlimSerializer}
+        default_expand = ("user",)
+        field_sources = {"full_name": ("user__first_name", "user__last_name", "user__email", "user__username")}
+        compiled_fields = {"full_name": Diaspora.format_full_name}  # list fast path (diaspora/compiled.py)
 
 
 # --- Nested write serializer for registration / update ---
@@ -58,6 +98,7 @@ class UserForDiasporaWriteSerializer(serializers.Serializer):
 
 class DiasporaWriteSerializer(serializers.ModelSerializer):
     user = UserForDiasporaWriteSerializer(write_only=True)
+    owner_office = OfficeField(required=False, allow_null=True)
 
     class Meta:
         model = Diaspora
@@ -85,6 +126,8 @@ class DiasporaWriteSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user_data = validated_data.pop("user", {})
         user_id = user_data.get("id")
+        # async registration hashes the password off the event loop and passes the result in
+        password_hash = self.context.get("password_hash")
 
         if user_id:
             user = User.objects.get(pk=user_id)
@@ -92,7 +135,9 @@ class DiasporaWriteSerializer(serializers.ModelSerializer):
                 val = user_data.get(f)
                 if val:
                     setattr(user, f, val)
-            if user_data.get("password"):
+            if password_hash:
+                user.password = password_hash
+            elif user_data.get("password"):
                 user.set_password(user_data["password"])
             else:
                 user.set_password("123456")
@@ -104,17 +149,27 @@ class DiasporaWriteSerializer(serializers.ModelSerializer):
             # Generate random password if not provided
             password = user_data.get("password") or "123456"
             
-            user = User.objects.create_user(
-                username=username,
-                email=user_data.get("email"),
-                password=password,
-                first_name=user_data.get("first_name", ""),
-                last_name=user_data.get("last_name", ""),
-            )
+            if password_hash:
+                user = User(
+                    username=User.normalize_username(username),
+                    email=User.objects.normalize_email(user_data.get("email")),
+                    first_name=user_data.get("first_name", ""),
+                    last_name=user_data.get("last_name", ""),
+                    password=password_hash,
+                )
+                user.save()
+            else:
+                user = User.objects.create_user(
+                    username=username,
+                    email=user_data.get("email"),
+                    password=password,
+                    first_name=user_data.get("first_name", ""),
+                    last_name=user_data.get("last_name", ""),
+                )
             self._ensure_diaspora_group(user)
 
         request = self.context.get("request")
-        created_by = request.user if request and request.user.is_authenticated else None
+        created_by = full_user(request.user) if request and request.user.is_authenticated else None
 
         diaspora = Diaspora.objects.create(user=user, created_by=created_by, **validated_data)
         return diaspora
@@ -124,7 +179,7 @@ class DiasporaWriteSerializer(serializers.ModelSerializer):
         return DiasporaSerializer(instance, context=self.context).data
 
 
-class PurposeSerializer(serializers.ModelSerializer):
+class PurposeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     type_display = serializers.CharField(source="get_type_display", read_only=True)
 
     class Meta:
@@ -136,9 +191,11 @@ class PurposeSerializer(serializers.ModelSerializer):
             "preferred_location_note", "status", "created_at",
         ]
         read_only_fields = ["id", "created_at"]
+        expandable = {"diaspora": DiasporaSerializer}
+        field_sources = {"type_display": ("type",)}
 
 
-class CaseSerializer(serializers.ModelSerializer):
+class CaseSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     diaspora = DiasporaSerializer(read_only=True)
     diaspora_id = serializers.PrimaryKeyRelatedField(
         source="diaspora",
@@ -151,17 +208,48 @@ class CaseSerializer(serializers.ModelSerializer):
         model = Case
         fields = ["id", "diaspora", "diaspora_id", "current_stage", "overall_status", "created_at", "updated_at"]
         read_only_fields = ["id", "created_at", "updated_at"]
+        expandable = {"diaspora": DiasporaSerializer}
+        default_expand = ("diaspora",)
+
+    def validate(self, attrs):
+        # the same workflow as the bulk transition action (diaspora/transitions.py)
+        if self.instance is not None:
+            errors = {}
+            for field, allowed, label in (
+                ("current_stage", STAGE_TRANSITIONS, "Stage"), ("overall_status", STATUS_TRANSITIONS, "Status"),
+            ):
+                reason = check_transition(getattr(self.instance, field), attrs.get(field), allowed, label)
+                if reason:
+                    errors[field] = [reason]
+            if errors:
+                raise serializers.ValidationError(errors)
+        return attrs
+
+
+class CaseBulkTransitionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+    current_stage = serializers.ChoiceField(choices=Case.Stage.choices, required=False)
+    overall_status = serializers.ChoiceField(choices=Case.OverallStatus.choices, required=False)
+
+    def validate(self, attrs):
+        if not attrs.get("current_stage") and not attrs.get("overall_status"):
+            raise serializers.ValidationError("Give a target current_stage and/or overall_status.")
+        return attrs
+
 
+class ReferralSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    from_office = OfficeField()
+    to_office = OfficeField()
 
-class ReferralSerializer(serializers.ModelSerializer):
     class Meta:
         model = Referral
         fields = [
             "id", "case", "from_office", "to_office", "reason",
             "payload_json", "status", "received_at", "completed_at",
-            "sla_due_at", "created_at", "last_synced_at",
+            "sla_due_at", "sla_breached_at", "created_at", "last_synced_at",
         ]
-        read_only_fields = ["id", "created_at", "last_synced_at"]
+        read_only_fields = ["id", "sla_breached_at", "created_at", "last_synced_at"]
+        expandable = {"case": CaseSerializer, "from_office": OfficeSerializer, "to_office": OfficeSerializer}
 
 class AnnouncementSerializer(serializers.ModelSerializer):
 
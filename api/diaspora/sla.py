@@ -0,0 +1,98 @@
+# diaspora/sla.py
+"""
+SLA breach evaluation for referrals.
+
+``evaluate()`` runs periodically (``manage.py evaluate_sla``). Each run only
+scans open referrals whose ``sla_due_at`` fell between the previous run's
+watermark and now – a range scan on the (status, sla_due_at) index – so the
+work per run is proportional to the new breaches, not to the table. Those
+rows get ``sla_breached_at`` in one UPDATE over that range, and ``referrals_breached`` is sent
+so escalation (notifications, reassignment) can hook in; by default the breaches
+are only logged. ``overdue()`` is the one definition of "past its deadline" that
+both the marker and the overdue report use.
+
+A deadline moved into the past after the watermark passed it is only picked
+up by a full sweep (``evaluate(full=True)`` / ``evaluate_sla --full``).
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Referral, Watermark
+from .reports import with_offices
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = "referral-sla"
+
+OPEN_STATUSES = (
+    Referral.ReferralStatus.SENT,
+    Referral.ReferralStatus.RECEIVED,
+    Referral.ReferralStatus.IN_PROGRESS,
+)
+
+# sent with referral_ids=[...] and breached_at=<datetime> after each run that marked breaches
+referrals_breached = Signal()
+
+
+def overdue(now):
+    """Open referrals whose deadline has been reached by ``now``."""
+    return Q(status__in=OPEN_STATUSES, sla_due_at__lte=now)
+
+
+def evaluate(now=None, full=False):
+    """Mark referrals that crossed their deadline since the last run; returns how many."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        mark, first_run = Watermark.objects.select_for_update().get_or_create(name=WATERMARK, defaults={"value": now})
+        window = Referral.objects.filter(overdue(now))
+        if not (full or first_run):
+            window = window.filter(sla_due_at__gt=mark.value)
+        # UPDATE by the range itself, then read the ids back from it: a full run may
+        # breach more referrals than the database accepts bound variables
+        ids = []
+        if window.filter(sla_breached_at__isnull=True).update(sla_breached_at=now):
+            ids = list(window.filter(sla_breached_at=now).values_list("pk", flat=True))
+        mark.value = max(mark.value, now)
+        mark.save(update_fields=["value"])
+    if ids:
+        referrals_breached.send(sender=Referral, referral_ids=ids, breached_at=now)
+    return len(ids)
+
+
+def _overdue(now):
+    return (
+        Referral.objects.filter(overdue(now))
+        .values("to_office__id")
+        .annotate(overdue=Count("pk"), oldest_due_at=Min("sla_due_at"))
+        .order_by()
+    )
+
+
+def _overdue_payload(now, rows):
+    rows = with_offices(rows)
+    return {"as_of": now, "rows": rows, "total": sum(r["overdue"] for r in rows)}
+
+
+def overdue_by_office(now=None):
+    """Open referrals past their deadline, per receiving office (served by the (status, sla_due_at) index)."""
+    now = now or timezone.now()
+    return _overdue_payload(now, _overdue(now))
+
+
+async def aoverdue_by_office(now=None):
+    now = now or timezone.now()
+    rows = [row async for row in _overdue(now)]
+    return await sync_to_async(_overdue_payload)(now, rows)
+
+
+def _log_breaches(sender, referral_ids, breached_at, **kwargs):
+    logger.warning("%d referral(s) breached their SLA at %s: %s", len(referral_ids), breached_at, referral_ids[:20])
+
+
+referrals_breached.connect(_log_breaches, dispatch_uid="sla-log-breaches")
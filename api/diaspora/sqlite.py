@@ -0,0 +1,185 @@
+# diaspora/sqlite.py
+"""
+Hardened SQLite profile for deployments that stay on SQLite.
+
+Two parts, both driven by ``settings.SQLITE_PROFILE``:
+
+- ``PRAGMAS`` are applied to every new SQLite connection: WAL journaling, so
+  readers no longer block the writer (or the other way round),
+  ``synchronous=NORMAL`` (durable across application crashes; WAL only syncs at
+  checkpoints), a memory-mapped read path and a larger page cache. The busy
+  timeout and ``BEGIN IMMEDIATE`` transactions (``BUSY_TIMEOUT`` /
+  ``TRANSACTION_MODE``) are connection options, so settings.py copies them
+  into ``DATABASES['default']['OPTIONS']`` when the profile is enabled.
+
+- ``writer`` applies write transactions from one thread. SQLite takes one
+  writer at a time whatever we do; queueing in-process instead of on the file
+  lock means no ``database is locked`` errors and no busy-wait polling, and
+  jobs that queue up meanwhile commit together (group commit): up to
+  ``GROUP_COMMIT_MAX`` jobs, each in its own savepoint, per transaction. A job
+  that raises only rolls back its own savepoint. Jobs' ``on_commit`` callbacks
+  run as robust callbacks, so one that raises is logged and the other jobs'
+  callbacks still run.
+
+Jobs run in a copy of the caller's context, so per-request instrumentation and
+routing (instrumentation.py, routing.py) still see their queries. Callers
+already inside a transaction, or on a non-SQLite primary, run inline.
+"""
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+
+from . import routing
+
+logger = logging.getLogger(__name__)
+
+
+def _profile():
+    return getattr(settings, "SQLITE_PROFILE", {})
+
+
+def _apply_pragmas(sender, connection, **kwargs):
+    profile = _profile()
+    if connection.vendor != "sqlite" or not profile.get("ENABLED"):
+        return
+    with connection.cursor() as cur:
+        for name, value in profile.get("PRAGMAS", {}).items():
+            cur.execute(f"PRAGMA {name} = {value}")
+
+
+connection_created.connect(_apply_pragmas, dispatch_uid="diaspora-sqlite-pragmas")
+
+
+# ---------------------------
+# Serialized writer
+# ---------------------------
+
+class SerializedWriter:
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {"jobs": 0, "commits": 0}
+
+    def enabled(self, using=None):
+        profile = _profile()
+        using = using or routing.primary()
+        return bool(
+            profile.get("ENABLED") and profile.get("SERIALIZED_WRITES")
+            and connections[using].vendor == "sqlite"
+        )
+
+    def _inline(self, using):
+        # a caller's open transaction can't be moved to another thread
+        return (
+            not self.enabled(using)
+            or connections[using].in_atomic_block
+            or threading.current_thread() is self._thread
+        )
+
+    def run(self, fn, *args, **kwargs):
+        """Run ``fn`` in a write transaction on the writer thread and return its result."""
+        using = routing.primary()
+        if self._inline(using):
+            with transaction.atomic(using=using):
+                return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def arun(self, fn, *args, **kwargs):
+        """``run()`` for async callers; the event loop is not blocked while the job waits."""
+        using = routing.primary()
+        if not self.enabled(using):
+            return await sync_to_async(self.run)(fn, *args, **kwargs)
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, contextvars.copy_context(), fn, args, kwargs))
+        self._start()
+        return future
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+                    self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            profile = _profile()
+            limit = profile.get("GROUP_COMMIT_MAX", 64)
+            deadline = time.monotonic() + profile.get("GROUP_COMMIT_WAIT_MS", 2) / 1000
+            while len(batch) < limit:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as exc:  # never let one bad batch stop the writer
+                logger.exception("SQLite writer batch failed")
+                for future, *_ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                # start the next batch on a fresh connection; SQLite's is_usable() is always
+                # True, so close_if_unusable_or_obsolete() would keep a broken one
+                connections[routing.primary()].close()
+
+    def _commit(self, batch):
+        using = routing.primary()
+        connection = connections[using]
+        jobs = [job for job in batch if job[0].set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            with transaction.atomic(using=using):
+                for future, context, fn, args, kwargs in jobs:
+                    hooks = len(connection.run_on_commit)
+                    try:
+                        with transaction.atomic(using=using):
+                            outcomes.append((context.run(fn, *args, **kwargs), None))
+                    except Exception as exc:
+                        outcomes.append((None, exc))
+                    # one job's failing callback must not skip the callbacks of the jobs after it
+                    connection.run_on_commit[hooks:] = [
+                        (sids, func, True) for sids, func, robust in connection.run_on_commit[hooks:]
+                    ]
+        except Exception as exc:
+            for future, *_ in jobs:
+                future.set_exception(exc)
+            return
+        self.stats["jobs"] += len(jobs)
+        self.stats["commits"] += 1
+        for (future, *_), (result, exc) in zip(jobs, outcomes):
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+
+writer = SerializedWriter()
+
+
+class SerializedWriteMixin:
+    """Run a viewset's create/update/destroy (validation included) through ``writer``."""
+
+    def create(self, request, *args, **kwargs):
+        return writer.run(super().create, request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        return writer.run(super().update, request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        return writer.run(super().destroy, request, *args, **kwargs)
@@ -0,0 +1,197 @@
+# diaspora/stage_history.py
+"""
+Case stage history and the time-in-stage rollups behind the stage funnel report.
+
+``Case.current_stage`` / ``overall_status`` are overwritten in place, so every
+change is also appended to ``CaseStageTransition``: saves through the signal
+receivers below, bulk moves through ``record()`` (diaspora/transitions.py).
+Each row snapshots the case's owner office and purpose type and, when it
+leaves a stage, how long the case sat in it.
+
+Two daily rollups are kept alongside, the same way diaspora/rollups.py keeps
+the others: cases entering each stage (the funnel) and a histogram of time
+spent in each stage, per owner office and purpose type. Medians and p90s are
+read off the histogram – log-spaced buckets, four per doubling, so an
+estimate is never off by more than one bucket (19%) – which keeps the
+report's cost independent of how much history there is. ``rebuild()`` (run by
+``manage.py rebuild_rollups``) recomputes both from the history table.
+"""
+import math
+from collections import Counter, namedtuple
+
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_init, post_save, pre_save
+from django.utils import timezone
+
+from . import rollups
+from .models import (
+    Case, Purpose, CaseStageTransition, CaseStageEntryDailyRollup, CaseStageDurationDailyRollup,
+)
+
+ENTRY_FIELDS = ("stage", "owner_office_id", "purpose_type")
+DURATION_FIELDS = ENTRY_FIELDS + ("bucket",)
+
+# a case with several purposes is counted under the first of its types in this order
+PURPOSE_PRECEDENCE = list(Purpose.PurposeType.values)
+
+# duration histogram: bucket 0 is under BUCKET_BASE seconds, then BUCKETS_PER_DOUBLING per doubling
+BUCKET_BASE = 60
+BUCKETS_PER_DOUBLING = 4
+
+Change = namedtuple("Change", ["case_id", "from_stage", "to_stage", "from_status", "to_status"])
+
+
+def bucket(seconds):
+    if seconds < BUCKET_BASE:
+        return 0
+    return 1 + int(BUCKETS_PER_DOUBLING * math.log2(seconds / BUCKET_BASE))
+
+
+def bucket_bounds(b):
+    if b == 0:
+        return 0, BUCKET_BASE
+    return BUCKET_BASE * 2 ** ((b - 1) / BUCKETS_PER_DOUBLING), BUCKET_BASE * 2 ** (b / BUCKETS_PER_DOUBLING)
+
+
+def percentile(histogram, q):
+    """``q``-th percentile of a {bucket: count} histogram, interpolated geometrically inside its bucket."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = q / 100 * total
+    seen = 0
+    for b in sorted(histogram):
+        n = histogram[b]
+        if n and seen + n >= rank:
+            low, high = bucket_bounds(b)
+            fraction = (rank - seen) / n
+            return round(low * (high / low) ** fraction if low else high * fraction)
+        seen += n
+    return round(bucket_bounds(max(histogram))[1])
+
+
+def lead_purpose_type(types):
+    types = set(types)
+    return next((t for t in PURPOSE_PRECEDENCE if t in types), "")
+
+
+# ---------------------------
+# Writing history
+# ---------------------------
+
+def record(changes, at=None):
+    """
+    Append one history row per ``Change`` (``from_*`` None for a new case)
+    and count them in the stage rollups. A fixed number of queries however
+    many cases change: the cases' dimensions, their latest history row, one
+    INSERT, then the rollup buckets.
+    """
+    changes = list(changes)
+    if not changes:
+        return []
+    at = at or timezone.now()
+    ids = [c.case_id for c in changes]
+    created, offices, types = {}, {}, {}
+    for pk, created_at, office_id, ptype in (
+        Case.objects.filter(pk__in=ids).values_list("pk", "created_at", "diaspora__owner_office_id", "diaspora__purposes__type")
+    ):
+        created[pk], offices[pk] = created_at, office_id
+        types.setdefault(pk, []).append(ptype)
+    since = dict(
+        CaseStageTransition.objects.filter(
+            pk__in=CaseStageTransition.objects.filter(case_id__in=ids).values("case_id").annotate(last=Max("pk")).values("last")
+        ).values_list("case_id", "stage_since")
+    )
+
+    rows = []
+    for change in changes:
+        entered = change.from_stage != change.to_stage
+        # cases older than the history entered their stage when they were created, as far as we know
+        previous = since.get(change.case_id) or created.get(change.case_id) or at
+        rows.append(CaseStageTransition(
+            case_id=change.case_id,
+            from_stage=change.from_stage, to_stage=change.to_stage,
+            from_status=change.from_status, to_status=change.to_status,
+            stage_since=at if entered else previous,
+            stage_seconds=max(0, int((at - previous).total_seconds())) if entered and change.from_stage else None,
+            owner_office_id=offices.get(change.case_id),
+            purpose_type=lead_purpose_type(t for t in types.get(change.case_id, ()) if t),
+            created_at=at,
+        ))
+    CaseStageTransition.objects.bulk_create(rows)
+    add(rows)
+    return rows
+
+
+def _count(rows):
+    entries, durations = Counter(), Counter()
+    for row in rows:
+        day = timezone.localdate(row.created_at)
+        dims = (row.owner_office_id, row.purpose_type)
+        if row.from_stage != row.to_stage:
+            entries[(day, row.to_stage, *dims)] += 1
+        if row.stage_seconds is not None:
+            durations[(day, row.from_stage, *dims, bucket(row.stage_seconds))] += 1
+    return entries, durations
+
+
+def add(rows):
+    """Count history rows in the stage rollups (``record()`` does; so does the synthetic generator)."""
+    entries, durations = _count(rows)
+    rollups.bump_many(CaseStageEntryDailyRollup, ENTRY_FIELDS, entries)
+    rollups.bump_many(CaseStageDurationDailyRollup, DURATION_FIELDS, durations)
+
+
+def rebuild():
+    """Recompute both stage rollups from the history table."""
+    entries, durations = _count(CaseStageTransition.objects.all().iterator(chunk_size=2000))
+    with transaction.atomic():
+        for rollup, fields, counts in (
+            (CaseStageEntryDailyRollup, ENTRY_FIELDS, entries),
+            (CaseStageDurationDailyRollup, DURATION_FIELDS, durations),
+        ):
+            rollup.objects.all().delete()
+            rollup.objects.bulk_create(
+                [rollup(row_count=n, **dict(zip(("day",) + fields, key))) for key, n in counts.items()],
+                batch_size=1000,
+            )
+    return len(entries) + len(durations)
+
+
+# ---------------------------
+# Signal receivers
+# ---------------------------
+
+def _state(instance):
+    data = instance.__dict__
+    if "current_stage" not in data or "overall_status" not in data:
+        return None  # deferred
+    return data["current_stage"], data["overall_status"]
+
+
+def _remember(sender, instance, **kwargs):
+    instance._stage_state = _state(instance)
+
+
+def _load_old_state(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding or getattr(instance, "_stage_state", None) is not None:
+        return
+    instance._stage_state = (
+        Case.objects.filter(pk=instance.pk).values_list("current_stage", "overall_status").first()
+    )
+
+
+def _on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = (None, None) if created else getattr(instance, "_stage_state", None)
+    new = _state(instance)
+    if old is not None and new is not None and old != new:
+        record([Change(instance.pk, old[0], new[0], old[1], new[1])], at=instance.created_at if created else None)
+    instance._stage_state = new
+
+
+post_init.connect(_remember, sender=Case, dispatch_uid="stage-history-init")
+pre_save.connect(_load_old_state, sender=Case, dispatch_uid="stage-history-pre")
+post_save.connect(_on_save, sender=Case, dispatch_uid="stage-history-save")
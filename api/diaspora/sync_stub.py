@@ -0,0 +1,80 @@
+# diaspora/sync_stub.py
+"""
+Local stand-in for a receiving office's referral endpoint, for exercising
+diaspora/outbox.py offline. Accepts POSTed referrals, honours
+Idempotency-Key (a repeated key is acknowledged, not counted twice), and can
+inject latency, 500 failures and 429 throttling at given rates.
+GET returns the counters as JSON.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubDestination(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=8765, latency_ms=0, fail_rate=0.0, throttle_rate=0.0, retry_after=1):
+        super().__init__((host, port), _Handler)
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.keys = set()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/referrals/"
+
+    def start(self):
+        """Serve from a daemon thread (for in-process benchmarks); returns self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body=None, headers=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        with self.server.lock:
+            self._reply(200, {**self.server.stats, "unique_keys": len(self.server.keys)})
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if server.latency:
+            time.sleep(server.latency)
+        roll = random.random()
+        with server.lock:
+            server.stats["requests"] += 1
+            if roll < server.throttle_rate:
+                server.stats["throttled"] += 1
+                return self._reply(429, {"detail": "slow down"}, {"Retry-After": str(server.retry_after)})
+            if roll < server.throttle_rate + server.fail_rate:
+                server.stats["failed"] += 1
+                return self._reply(500, {"detail": "internal error"})
+            key = self.headers.get("Idempotency-Key")
+            if key in server.keys:
+                server.stats["duplicates"] += 1
+                return self._reply(200, {"duplicate": True})
+            server.keys.add(key)
+            server.stats["accepted"] += 1
+        self._reply(201, {"accepted": True})
@@ -0,0 +1,348 @@
+# diaspora/synthetic.py
+"""
+Deterministic synthetic registry for benchmarks (``manage.py seed_diaspora --diasporas N``).
+
+Rows are written with bulk_create in chunks: one transaction per chunk
+holding its users, group memberships, diasporas, purposes, cases and
+referrals. Every user shares one password hash computed up front, so no
+time goes into PBKDF2.
+
+Each chunk draws from its own ``Random(f"{seed}:{offset}")``, so a given seed
+always produces the same rows. A re-run with the same seed continues after
+the rows it already generated instead of colliding with them.
+
+bulk_create sends no signals, so the generator does what the signal
+receivers would: it adds to the daily rollups (rollups.add), writes each
+case's stage history (the transitions that led to its stage, spread between
+its created_at and updated_at; stage_history.add) and reindexes search after
+each chunk, and bumps the report cache at the end.
+ReferralOutbox is deliberately left alone, so synthetic referrals are never
+synced. ``created_at`` / ``updated_at`` are back-dated across ``days``, so
+their auto_now handling is switched off while generating.
+"""
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.utils import timezone
+
+from . import report_cache, rollups, search, stage_history
+from .facets import normalize_country
+from .ids import allocator
+from .models import Office, Diaspora, Purpose, Case, Referral, CaseStageTransition
+
+User = get_user_model()
+
+# (country, weight, cities)
+COUNTRIES = [
+    ("Saudi Arabia", 18, ["Riyadh", "Jeddah", "Dammam"]),
+    ("USA", 16, ["Washington", "Minneapolis", "Seattle", "Atlanta", "Dallas"]),
+    ("UAE", 12, ["Dubai", "Abu Dhabi", "Sharjah"]),
+    ("UK", 8, ["London", "Manchester", "Birmingham"]),
+    ("Canada", 7, ["Toronto", "Calgary", "Edmonton"]),
+    ("Germany", 5, ["Frankfurt", "Berlin", "Munich"]),
+    ("Sweden", 4, ["Stockholm", "Gothenburg"]),
+    ("Israel", 4, ["Tel Aviv", "Jerusalem"]),
+    ("Kenya", 4, ["Nairobi", "Mombasa"]),
+    ("South Africa", 4, ["Johannesburg", "Cape Town"]),
+    ("Australia", 3, ["Melbourne", "Sydney"]),
+    ("Norway", 2, ["Oslo"]),
+    ("Italy", 2, ["Rome", "Milan"]),
+    ("Qatar", 2, ["Doha"]),
+    ("Kuwait", 2, ["Kuwait City"]),
+]
+FIRST_NAMES = [
+    "Abdi", "Abdulahi", "Ahmed", "Ayan", "Biftu", "Chaltu", "Dawit", "Eyerusalem", "Fatuma", "Genet",
+    "Hamza", "Hanna", "Ibrahim", "Kedir", "Lensa", "Meron", "Michael", "Nasra", "Rahel", "Samira",
+    "Selam", "Tigist", "Yonas", "Yusuf", "Zemzem", "Zenebech", "Mohammed", "Amina", "Bilal", "Hawa",
+]
+LAST_NAMES = [
+    "Abdella", "Ahmed", "Aliyi", "Bekele", "Beker", "Dinsa", "Gemechu", "Hassen", "Ibrahim", "Jemal",
+    "Kedir", "Mohammed", "Mume", "Omer", "Sherif", "Tesfaye", "Umer", "Usman", "Wako", "Yusuf",
+]
+LANGUAGES = [("English", 45), ("Amharic", 25), ("Harari", 15), ("Afaan Oromo", 10), ("Arabic", 5)]
+STAYS = ["1 week", "2 weeks", "1 month", "3 months", "6 months", "Permanent"]
+
+PURPOSE_TYPES = [
+    (Purpose.PurposeType.FAMILY, 30), (Purpose.PurposeType.TOURISM, 25), (Purpose.PurposeType.INVESTMENT, 20),
+    (Purpose.PurposeType.CHARITY_NGO, 10), (Purpose.PurposeType.STUDY, 8), (Purpose.PurposeType.OTHER, 7),
+]
+PURPOSE_STATUSES = [
+    ("DRAFT", 10), ("SUBMITTED", 30), ("UNDER_REVIEW", 20), ("APPROVED", 25), ("REJECTED", 8), ("ON_HOLD", 7),
+]
+SECTORS = {
+    "Manufacturing": ["Light Industry", "Agro-processing", "Textiles"],
+    "Hospitality": ["Hotels", "Restaurants", "Tour operation"],
+    "Agriculture": ["Horticulture", "Livestock", "Coffee"],
+    "Real Estate": ["Residential", "Commercial"],
+    "Trade": ["Import/Export", "Wholesale", "Retail"],
+    "ICT": ["Software", "Telecom services"],
+}
+INVESTMENT_TYPES = ["New Company", "Expansion", "Joint Venture", "Branch"]
+
+# (stage, weight, [(overall status, weight)])
+CASE_STATES = [
+    (Case.Stage.INTAKE, 25, [(Case.OverallStatus.ACTIVE, 90), (Case.OverallStatus.PAUSED, 10)]),
+    (Case.Stage.SCREENING, 20, [(Case.OverallStatus.ACTIVE, 85), (Case.OverallStatus.PAUSED, 15)]),
+    (Case.Stage.REFERRAL, 20, [(Case.OverallStatus.ACTIVE, 80), (Case.OverallStatus.PAUSED, 20)]),
+    (Case.Stage.PROCESSING, 15, [(Case.OverallStatus.ACTIVE, 85), (Case.OverallStatus.PAUSED, 15)]),
+    (Case.Stage.COMPLETED, 12, [(Case.OverallStatus.DONE, 100)]),
+    (Case.Stage.CLOSED, 8, [(Case.OverallStatus.DONE, 40), (Case.OverallStatus.REJECTED, 60)]),
+]
+# the way through the workflow; a CLOSED case left it after one of these
+WORKFLOW = [Case.Stage.INTAKE, Case.Stage.SCREENING, Case.Stage.REFERRAL, Case.Stage.PROCESSING, Case.Stage.COMPLETED]
+REFERRAL_STATUSES = [
+    (Referral.ReferralStatus.SENT, 20), (Referral.ReferralStatus.RECEIVED, 20),
+    (Referral.ReferralStatus.IN_PROGRESS, 25), (Referral.ReferralStatus.COMPLETED, 28),
+    (Referral.ReferralStatus.REJECTED, 7),
+]
+OPEN_REFERRALS = {
+    Referral.ReferralStatus.SENT, Referral.ReferralStatus.RECEIVED, Referral.ReferralStatus.IN_PROGRESS,
+}
+REFERRAL_REASONS = [
+    "Investment license application", "Land allocation request", "Trade license renewal",
+    "Document verification", "Family support follow-up", "Business registration",
+]
+
+
+def _weighted(pairs):
+    values, weights = zip(*pairs)
+    cumulative, total = [], 0
+    for w in weights:
+        total += w
+        cumulative.append(total)
+    return list(values), cumulative
+
+
+def _pick(rng, table):
+    values, cumulative = table
+    return rng.choices(values, cum_weights=cumulative)[0]
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the given created_at/updated_at instead of stamping now()."""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class SyntheticGenerator:
+
+    def __init__(self, seed=42, purposes_per=1.5, case_rate=0.9, referral_rate=0.4, days=730,
+                 chunk_size=5000, password="Pass12345!", progress=None):
+        self.seed = seed
+        self.purposes_per = purposes_per
+        self.case_rate = case_rate
+        self.referral_rate = referral_rate
+        self.days = days
+        self.chunk_size = chunk_size
+        self.password_hash = make_password(password)
+        self.progress = progress or (lambda stats: None)
+        self.prefix = f"syn{seed}-"
+
+        self._countries = _weighted([(c, w) for c, w, _ in COUNTRIES])
+        self._cities = {c: cities for c, _, cities in COUNTRIES}
+        self._languages = _weighted(LANGUAGES)
+        self._purpose_types = _weighted(PURPOSE_TYPES)
+        self._purpose_statuses = _weighted(PURPOSE_STATUSES)
+        self._stages = _weighted([(s, w) for s, w, _ in CASE_STATES])
+        self._case_statuses = {s: _weighted(statuses) for s, _, statuses in CASE_STATES}
+        self._referral_statuses = _weighted(REFERRAL_STATUSES)
+
+    def run(self, count):
+        offices = list(Office.objects.order_by("pk"))
+        if not offices:
+            raise ValueError("No offices; run seed_diaspora without --diasporas first.")
+        home = next((o for o in offices if o.type == Office.OfficeType.DIASPORA), offices[0])
+        self._home, self._targets = home, [o for o in offices if o.pk != home.pk] or offices
+        group, _ = Group.objects.get_or_create(name="Diaspora")
+
+        start = User.objects.filter(username__startswith=self.prefix).count()
+        totals = {"diasporas": 0, "purposes": 0, "cases": 0, "referrals": 0}
+        began = time.perf_counter()
+        with explicit_timestamps(Diaspora, Purpose, Case, Referral):
+            for offset in range(start, start + count, self.chunk_size):
+                n = min(self.chunk_size, start + count - offset)
+                for key, value in self._chunk(offset, n, group).items():
+                    totals[key] += value
+                elapsed = time.perf_counter() - began
+                self.progress({
+                    **totals, "target": count, "elapsed": elapsed,
+                    "rows_per_s": sum(totals.values()) / elapsed if elapsed else 0,
+                })
+        report_cache.bump(Diaspora, Purpose, Case, Referral)
+        return totals
+
+    # ---------------------------
+    # One chunk
+    # ---------------------------
+
+    def _chunk(self, offset, n, group):
+        rng = random.Random(f"{self.seed}:{offset}")
+        # a stream of its own, so the other rows don't depend on whether history is generated
+        history_rng = random.Random(f"{self.seed}:{offset}:history")
+        now = timezone.now()
+        users, diasporas, purposes, cases, referrals, history = [], [], [], [], [], []
+        case_types = []
+
+        for i in range(offset, offset + n):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            username = f"{self.prefix}{i:08d}"
+            # sqrt skews registrations toward the recent end of the window (growth)
+            created_at = now - timedelta(days=self.days * (1 - math.sqrt(rng.random())), seconds=rng.randrange(86400))
+            users.append(User(
+                username=username, email=f"{username}@example.com", password=self.password_hash,
+                first_name=first, last_name=last, date_joined=created_at,
+            ))
+            diasporas.append(self._diaspora(rng, i, created_at))
+
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            User.groups.through.objects.bulk_create(
+                [User.groups.through(user_id=u.pk, group_id=group.pk) for u in users]
+            )
+            by_year = {}
+            for user, diaspora in zip(users, diasporas):
+                diaspora.user = user
+                by_year.setdefault(diaspora.created_at.year, []).append(diaspora)
+            for year, batch in by_year.items():
+                for diaspora, diaspora_id in zip(batch, allocator.take(len(batch), year=year)):
+                    diaspora.diaspora_id = diaspora_id
+
+            for diaspora in diasporas:
+                own = self._purposes(rng, diaspora, now)
+                purposes += own
+                if rng.random() < self.case_rate:
+                    cases.append(self._case(rng, diaspora, now))
+                    case_types.append(stage_history.lead_purpose_type(p.type for p in own))
+
+            Diaspora.objects.bulk_create(diasporas)
+            Purpose.objects.bulk_create(purposes)
+            Case.objects.bulk_create(cases)
+            for case, ptype in zip(cases, case_types):
+                history += self._history(history_rng, case, ptype)
+            CaseStageTransition.objects.bulk_create(history)
+            for case in cases:
+                referrals += self._referrals(rng, case, now)
+            Referral.objects.bulk_create(referrals)
+
+            for model, rows in ((Diaspora, diasporas), (Purpose, purposes), (Case, cases), (Referral, referrals)):
+                rollups.add(model, rows)
+            stage_history.add(history)
+            pks = [d.pk for d in diasporas]
+            transaction.on_commit(lambda: search.safe_reindex(pks, fresh=True))
+        return {"diasporas": len(diasporas), "purposes": len(purposes), "cases": len(cases), "referrals": len(referrals)}
+
+    def _after(self, rng, start, now, max_days):
+        return min(now, start + timedelta(days=rng.uniform(0, max_days)))
+
+    def _diaspora(self, rng, i, created_at):
+        country = _pick(rng, self._countries)
+        phone = f"+2519{i % 100000000:08d}"
+        return Diaspora(
+            gender=rng.choice((Diaspora.Gender.MALE, Diaspora.Gender.FEMALE)),
+            dob=(created_at - timedelta(days=rng.randint(18 * 365, 70 * 365))).date(),
+            primary_phone=phone,
+            whatsapp=phone if rng.random() < 0.7 else None,
+            country_of_residence=country,
+            country_canonical=normalize_country(country),
+            city_of_residence=rng.choice(self._cities[country]),
+            arrival_date=(created_at + timedelta(days=rng.randint(-10, 60))).date() if rng.random() < 0.8 else None,
+            expected_stay_duration=rng.choice(STAYS),
+            is_returnee=rng.random() < 0.15,
+            preferred_language=_pick(rng, self._languages),
+            communication_opt_in=rng.random() < 0.85,
+            passport_no=f"EP{i:08d}" if rng.random() < 0.9 else None,
+            id_number=f"HR-{i:08d}" if rng.random() < 0.4 else None,
+            owner_office=self._home,
+            created_at=created_at,
+            updated_at=created_at,
+        )
+
+    def _purposes(self, rng, diaspora, now):
+        k = max(0, round(rng.gauss(self.purposes_per, self.purposes_per / 2)))
+        rows = []
+        for _ in range(k):
+            ptype = _pick(rng, self._purpose_types)
+            purpose = Purpose(
+                diaspora=diaspora, type=ptype, status=_pick(rng, self._purpose_statuses),
+                description=f"{ptype.label} purpose",
+                created_at=self._after(rng, diaspora.created_at, now, 30),
+            )
+            if ptype == Purpose.PurposeType.INVESTMENT:
+                sector = rng.choice(list(SECTORS))
+                purpose.sector, purpose.sub_sector = sector, rng.choice(SECTORS[sector])
+                purpose.investment_type = rng.choice(INVESTMENT_TYPES)
+                purpose.estimated_capital = Decimal(rng.randrange(5, 2000) * 50000)
+                purpose.currency = rng.choice(("ETB", "ETB", "USD"))
+                purpose.jobs_expected = rng.randint(2, 300)
+                purpose.land_requirement = rng.random() < 0.4
+                purpose.land_size = round(rng.uniform(0.1, 20), 2) if purpose.land_requirement else None
+            rows.append(purpose)
+        return rows
+
+    def _case(self, rng, diaspora, now):
+        stage = _pick(rng, self._stages)
+        created_at = self._after(rng, diaspora.created_at, now, 7)
+        return Case(
+            diaspora=diaspora, current_stage=stage, overall_status=_pick(rng, self._case_statuses[stage]),
+            created_at=created_at, updated_at=self._after(rng, created_at, now, 90),
+        )
+
+    def _history(self, rng, case, purpose_type):
+        stage = case.current_stage
+        if stage == Case.Stage.CLOSED:
+            path = WORKFLOW[: rng.randint(1, len(WORKFLOW) - 1)] + [stage]
+        else:
+            path = WORKFLOW[: WORKFLOW.index(stage) + 1]
+        span = case.updated_at - case.created_at
+        times = [case.created_at] + [case.created_at + span * cut for cut in sorted(rng.random() for _ in path[1:])]
+        rows = []
+        for i, (stage, at) in enumerate(zip(path, times)):
+            rows.append(CaseStageTransition(
+                case=case, from_stage=path[i - 1] if i else None, to_stage=stage,
+                from_status=Case.OverallStatus.ACTIVE if i else None,
+                to_status=case.overall_status if i == len(path) - 1 else Case.OverallStatus.ACTIVE,
+                stage_since=at, stage_seconds=int((at - times[i - 1]).total_seconds()) if i else None,
+                owner_office=self._home, purpose_type=purpose_type, created_at=at,
+            ))
+        return rows
+
+    def _referrals(self, rng, case, now):
+        rows = []
+        if rng.random() >= self.referral_rate:
+            return rows
+        # most referred cases go to one office, some to two or three
+        for to_office in rng.sample(self._targets, k=min(len(self._targets), rng.choices((1, 2, 3), (75, 20, 5))[0])):
+            status = _pick(rng, self._referral_statuses)
+            created_at = self._after(rng, case.created_at, now, 14)
+            received_at = None if status == Referral.ReferralStatus.SENT else self._after(rng, created_at, now, 5)
+            completed_at = (
+                self._after(rng, received_at, now, 30) if status == Referral.ReferralStatus.COMPLETED else None
+            )
+            sla_due_at = created_at + timedelta(days=rng.choice((7, 14, 30)))
+            rows.append(Referral(
+                case=case, from_office=self._home, to_office=to_office,
+                reason=rng.choice(REFERRAL_REASONS), payload_json={"synthetic": True},
+                status=status, received_at=received_at, completed_at=completed_at,
+                sla_due_at=sla_due_at, created_at=created_at,
+                # as if the SLA evaluator had been running all along
+                sla_breached_at=sla_due_at if status in OPEN_REFERRALS and sla_due_at < now else None,
+            ))
+        return rows
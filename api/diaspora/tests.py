@@ -1,3 +1,1123 @@
-from django.test import TestCase
+import contextvars
+import csv
+import json
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.conf import settings
+from django.core.cache import cache
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import authentication, outbox, report_cache, rollups, routing, search, sla, stage_history
+from .compiled import get_compiled
+from .hashing import HashingGate
+from .ids import allocator
+from .importer import DiasporaImporter
+from .instrumentation import budget_url, query_budget
+from .management.commands.bench_reports import LegacyReports
+from .models import (
+    Announcement, Case, CaseStageDurationDailyRollup, CaseStageEntryDailyRollup, CaseStageTransition, Diaspora, Office,
+    Purpose, Referral, ReferralOutbox, Watermark,
+)
+from .offices import registry
+from .reports import LiveReports, RollupReports, in_window
+from .sqlite import writer
+from .synthetic import SyntheticGenerator
+from .serializers import (
+    CaseSerializer, DiasporaSerializer, DiasporaWriteSerializer, PurposeSerializer, ReferralSerializer,
+)
+from .urls import router
+
+User = get_user_model()
+
+
+class SeededTestCase(TestCase):
+    """The demo offices plus 60 synthetic registrations, and an admin client."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_diaspora", diasporas=60, stdout=StringIO())
+        cls.admin = User.objects.create_superuser("test-admin", "admin@example.com", "pw")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assertRollupsCurrent(self):
+        """The rollups (diaspora/rollups.py) hold what a rebuild from the source tables would."""
+        for model, (rollup, fields) in rollups.ROLLUPS.items():
+            kept = set(rollup.objects.filter(row_count__gt=0).values_list("day", *fields, "row_count"))
+            rollups.rebuild(model)
+            rebuilt = set(rollup.objects.values_list("day", *fields, "row_count"))
+            self.assertEqual(kept, rebuilt, model.__name__)
+
+
+class RollupTests(SeededTestCase):
+    """Signals keep the daily rollups (diaspora/rollups.py) equal to a rebuild from the source tables."""
+
+    def test_seeded(self):
+        self.assertRollupsCurrent()
+
+    def test_update_moves_bucket(self):
+        case = Case.objects.filter(current_stage=Case.Stage.INTAKE).first()
+        case.current_stage = Case.Stage.SCREENING
+        case.save()
+        referral = Referral.objects.exclude(status=Referral.ReferralStatus.COMPLETED).first()
+        referral.status = Referral.ReferralStatus.COMPLETED
+        referral.save(update_fields=["status"])
+        purpose = Purpose.objects.only("pk").first()  # deferred dimensions are read back before the save
+        purpose.status = "APPROVED"
+        purpose.save()
+        self.assertRollupsCurrent()
+
+    def test_delete_leaves_bucket(self):
+        Referral.objects.first().delete()
+        Diaspora.objects.filter(case__isnull=False).first().delete()  # cascades to its case, purposes, referrals
+        self.assertRollupsCurrent()
+
+
+@override_settings(DIASPORA_ID_BLOCK_SIZE=10)
+class ReportCacheTests(SeededTestCase):
+    """Report payloads are cached until a model they read is written, and only once that write commits."""
+    url = "/api/reports/cases_by_status/"
+
+    def setUp(self):
+        super().setUp()
+        report_cache.bump(*report_cache.DEPENDENCIES)
+
+    def get(self):
+        before = report_cache.stats()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), report_cache.stats()["hits"] > before["hits"]
+
+    def test_hit_until_a_dependency_commits(self):
+        first, hit = self.get()
+        self.assertFalse(hit)
+        self.assertEqual(self.get(), (first, True))
+
+        # another model's write leaves the entry alone
+        with self.captureOnCommitCallbacks(execute=True):
+            Purpose.objects.first().save()
+        self.assertEqual(self.get(), (first, True))
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Case.objects.all().delete()
+        # not committed yet: still answered from the cache
+        self.assertEqual(self.get(), (first, True))
+        for callback in callbacks:
+            callback()
+        data, hit = self.get()
+        self.assertFalse(hit)
+        self.assertNotEqual(data, first)
+
+
+class ReportEngineTests(SeededTestCase):
+    """The live and rollup report sources answer like the pre-engine queries (bench_reports' baseline)."""
+
+    def assertSourcesAgree(self, run):
+        legacy = run(LegacyReports())
+        self.assertEqual(run(LiveReports()), legacy)
+        self.assertEqual(run(RollupReports()), legacy)
+
+    def test_reports_agree(self):
+        today = timezone.localdate()
+        for f, t in [(today.replace(year=today.year - 1), today), (today - timedelta(days=90), today - timedelta(days=30))]:
+            with self.subTest(f"{f}..{t}"):
+                self.assertSourcesAgree(lambda s: s.summary(f, t))
+                self.assertSourcesAgree(lambda s: s.cases_by_status())
+                self.assertSourcesAgree(lambda s: s.referrals_by_office(f, t))
+                for group in ("monthly", "quarterly", "yearly"):
+                    self.assertSourcesAgree(lambda s: s.diasporas_by_period(group, f, t))
+                for ptype in (None, Purpose.PurposeType.INVESTMENT):
+                    self.assertSourcesAgree(lambda s: s.progress_by_purpose(f, t, ptype))
+
+
+class ExportTests(SeededTestCase):
+    """Streaming exports (diaspora/exports.py): every filtered row, one line each, in both formats."""
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response, body = self.export("/api/diasporas/export/?fmt=csv")
+        self.assertTrue(response["Content-Type"].startswith("text/csv"))
+        self.assertIn('filename="diasporas-', response["Content-Disposition"])
+        header, *rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(header[:3], ["id", "diaspora_id", "first_name"])
+        self.assertEqual(len(rows), Diaspora.objects.count())
+        diaspora = Diaspora.objects.select_related("user").get(pk=rows[0][0])
+        self.assertEqual(rows[0][1:3], [diaspora.diaspora_id, diaspora.user.first_name])
+
+    def test_ndjson_follows_filters(self):
+        case = Case.objects.select_related("diaspora__user", "diaspora__owner_office").first()
+        diaspora, user = case.diaspora, case.diaspora.user
+        response, body = self.export(f"/api/cases/export/?fmt=ndjson&search={diaspora.diaspora_id}")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        (line,) = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual({k: v for k, v in line.items() if not k.endswith("_at")}, {
+            "id": case.pk, "diaspora_id": diaspora.diaspora_id,
+            "first_name": user.first_name, "last_name": user.last_name, "email": user.email,
+            "primary_phone": diaspora.primary_phone,
+            "owner_office_code": diaspora.owner_office.code if diaspora.owner_office else None,
+            "current_stage": case.current_stage, "overall_status": case.overall_status,
+        })
+        self.assertEqual(line["created_at"], DjangoJSONEncoder().default(case.created_at))
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get("/api/referrals/export/?fmt=xml").status_code, 400)
+
+
+class ImportTests(SeededTestCase):
+    """Bulk import (diaspora/importer.py): good rows land, bad ones are reported by row number."""
+
+    CSV = (
+        "email,first_name,last_name,country_of_residence,owner_office,password\n"
+        "new.one@example.com,New,One,u.s.a.,DIASP,pw12345\n"            # row 2: ok
+        "not-an-email,Bad,Email,,,\n"                                   # row 3: invalid email
+        "NEW.ONE@example.com,Dup,Licate,,,\n"                           # row 4: duplicate of row 2
+        "TAKEN@EXAMPLE.COM,Taken,Email,,,\n"                            # row 5: existing account, other case
+        "new.two@example.com,New,Two,,NOPE,\n"                          # row 6: unknown office
+        "new.three@example.com,New,Three,Sweden,,\n"                    # row 7: ok
+    )
+
+    def upload(self, query=""):
+        upload = SimpleUploadedFile("people.csv", self.csv.encode(), content_type="text/csv")
+        response = self.client.post(f"/api/diasporas/import/{query}", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user("taken", "Taken@Example.com", "pw")
+        self.office = Office.objects.order_by("pk").first()
+        self.csv = self.CSV.replace("DIASP", self.office.code)
+
+    def test_row_errors(self):
+        report = self.upload()
+        self.assertEqual((report["rows"], report["created"], report["failed"]), (6, 2, 4))
+        self.assertEqual([(e["row"], list(e["errors"])) for e in report["errors"]], [
+            (3, ["email"]), (4, ["email"]), (5, ["email"]), (6, ["owner_office"]),
+        ])
+        diaspora = Diaspora.objects.select_related("user").get(user__email="new.one@example.com")
+        self.assertEqual((diaspora.owner_office_id, diaspora.country_canonical), (self.office.pk, "USA"))
+        self.assertTrue(diaspora.user.check_password("pw12345"))
+        self.assertTrue(diaspora.user.groups.filter(name="Diaspora").exists())
+
+    def test_dry_run_writes_nothing(self):
+        before = Diaspora.objects.count()
+        report = self.upload("?dry_run=1")
+        self.assertEqual((report["created"], report["failed"]), (0, 4))
+        self.assertEqual(Diaspora.objects.count(), before)
+
+    def test_account_created_during_import(self):
+        validate = DiasporaImporter._validate
+
+        def validate_then_clash(importer, chunk):
+            valid = validate(importer, chunk)
+            User.objects.create_user("new.three@example.com", "elsewhere@example.com", "pw")
+            return valid
+
+        with mock.patch.object(DiasporaImporter, "_validate", validate_then_clash):
+            report = self.upload()
+        self.assertEqual((report["created"], report["failed"]), (1, 5))
+        self.assertEqual(report["errors"][-1], {
+            "row": 7, "errors": {"non_field_errors": ["Clashes with an account created during the import."]},
+        })
+        self.assertTrue(Diaspora.objects.filter(user__email="new.one@example.com").exists())
+
+
+class AsyncPasswordTests(SeededTestCase):
+    """ASGI login and registration (diaspora/views.py) hash in the bounded pool of diaspora/hashing.py."""
+
+    def post(self, path, data):
+        return async_to_sync(AsyncClient().post)(path, data, content_type="application/json")
+
+    def test_login(self):
+        response = self.post("/api/async/login/", {"username": "test-admin", "password": "pw"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("access", response.json())
+        self.assertEqual(self.post("/api/async/login/", {"email": "admin@example.com", "password": "pw"}).status_code, 200)
+        self.assertEqual(self.post("/api/async/login/", {"username": "test-admin", "password": "nope"}).status_code, 401)
+        self.assertEqual(self.post("/api/async/login/", {"username": "nobody", "password": "pw"}).status_code, 401)
+        self.assertEqual(self.post("/api/async/login/", {"username": "test-admin"}).status_code, 400)
+
+    def test_full_pool_answers_503(self):
+        gate = HashingGate(max_workers=1, max_queue=0)
+        gate._slots.acquire()  # the only slot is taken
+        with mock.patch("diaspora.views.get_gate", return_value=gate):
+            response = self.post("/api/async/login/", {"username": "test-admin", "password": "pw"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+    # inline writes: the writer thread's connection can't see this test's transaction
+    @override_settings(SQLITE_PROFILE={**settings.SQLITE_PROFILE, "SERIALIZED_WRITES": False})
+    def test_register(self):
+        data = {"user": {"email": "Async.New@example.com", "password": "s3cret!", "first_name": "Async"}}
+        response = self.post("/api/async/public/register/", data)
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email__iexact="async.new@example.com")
+        self.assertTrue(user.check_password("s3cret!"))
+        self.assertTrue(Diaspora.objects.filter(user=user).exists())
+        self.assertEqual(self.post("/api/async/public/register/", data).status_code, 400)  # email taken
+
+
+class SparseFieldsetTests(SeededTestCase):
+    """``?fields=`` / ``?expand=`` (diaspora/fieldsets.py) shape both the payload and the query."""
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), " ".join(q["sql"] for q in ctx.captured_queries)
+
+    def test_fields(self):
+        body, sql = self.get("/api/cases/?fields=id,current_stage,diaspora.full_name")
+        self.assertTrue(body["results"])
+        for row in body["results"]:
+            self.assertEqual(set(row), {"id", "current_stage", "diaspora"})
+            self.assertEqual(set(row["diaspora"]), {"full_name"})
+        self.assertNotIn('"overall_status"', sql)
+        self.assertNotIn("diaspora_office", sql)
+
+        body, sql = self.get("/api/cases/?fields=id,overall_status")
+        self.assertEqual(set(body["results"][0]), {"id", "overall_status"})
+        self.assertNotIn("auth_user", sql)  # the default diaspora.user expansion isn't joined
+
+        case = Case.objects.first()
+        body, _ = self.get(f"/api/cases/{case.pk}/?fields=current_stage")
+        self.assertEqual(body, {"current_stage": case.current_stage})
+
+    def test_expand(self):
+        referral = Referral.objects.select_related("to_office").first()
+        body, _ = self.get(f"/api/referrals/{referral.pk}/")
+        self.assertEqual(body["to_office"], referral.to_office_id)
+        body, _ = self.get(f"/api/referrals/{referral.pk}/?expand=to_office,case.diaspora&fields=to_office,case")
+        self.assertEqual(body["to_office"]["code"], referral.to_office.code)
+        self.assertEqual(body["case"]["diaspora"]["id"], str(referral.case.diaspora_id))
+
+    def test_unknown_names(self):
+        self.assertEqual(self.client.get("/api/cases/?fields=nope").status_code, 400)
+        self.assertEqual(self.client.get("/api/cases/?expand=current_stage").status_code, 400)
+
+
+class CompiledListTests(SeededTestCase):
+    """Compiled list serialization (diaspora/compiled.py) returns exactly what the serializers would."""
+
+    def test_registry_serializers_compile(self):
+        for serializer_class in (DiasporaSerializer, PurposeSerializer, CaseSerializer, ReferralSerializer):
+            self.assertIsNotNone(get_compiled(serializer_class), serializer_class.__name__)
+
+    def test_same_output_as_serializers(self):
+        urls = [
+            "/api/diasporas/", "/api/purposes/", "/api/cases/", "/api/referrals/",
+            "/api/diasporas/?fields=id,full_name,user.email,owner_office&expand=owner_office",
+            "/api/purposes/?fields=id,type_display,diaspora.diaspora_id",
+            "/api/cases/?fields=id,current_stage,diaspora.user.username",
+            "/api/referrals/?expand=case,to_office&ordering=-created_at",
+        ]
+        for url in urls:
+            with self.subTest(url):
+                compiled = self.client.get(url)
+                with override_settings(COMPILED_LIST_SERIALIZERS=False):
+                    expected = self.client.get(url)
+                self.assertEqual(compiled.status_code, 200)
+                self.assertEqual(compiled.content, expected.content)
+
+
+class ClaimsAuthenticationTests(SeededTestCase):
+    """Tokens carry role/office claims (diaspora/authentication.py); only is_active is read per user."""
+
+    def setUp(self):
+        super().setUp()
+        authentication._users.clear()
+        self.diaspora = Diaspora.objects.select_related("user").filter(
+            owner_office__isnull=False, user__username__startswith="syn",
+        ).first()
+        self.user = self.diaspora.user
+
+    def login(self, path="/api/login/"):
+        data = {"username": self.user.username, "password": "Pass12345!"}  # diaspora/synthetic.py's
+        if path.startswith("/api/async/"):
+            response = async_to_sync(AsyncClient().post)(path, data, content_type="application/json")
+        else:
+            response = self.client.post(path, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["access"]
+
+    def get(self, token, url="/api/offices/"):
+        return APIClient().get(url, headers={"Authorization": f"Bearer {token}"})
+
+    def test_claims(self):
+        token = AccessToken(self.login())
+        self.assertEqual(
+            (token["role"], token["groups"], token["office"], token["is_staff"]),
+            ("Diaspora", ["Diaspora"], self.diaspora.owner_office_id, False),
+        )
+        user = authentication.ClaimsUser(token)
+        self.assertEqual(list(user.groups.values_list("name", flat=True)), ["Diaspora"])
+        self.assertFalse(user.has_perm("diaspora.delete_office"))
+        admin = authentication.ClaimsUser(AccessToken(self.client.post(
+            "/api/login/", {"username": "test-admin", "password": "pw"}, format="json",
+        ).json()["access"]))
+        self.assertTrue(admin.has_perm("diaspora.delete_office"))
+
+    def test_no_group_queries_per_request(self):
+        token = self.login()
+        self.assertEqual(self.get(token).status_code, 200)  # loads the user row once
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.get(token).status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if "auth_" in q["sql"]])
+
+    def test_last_login(self):
+        for path in ("/api/login/", "/api/async/login/"):
+            with self.subTest(path):
+                User.objects.filter(pk=self.user.pk).update(last_login=None)
+                self.login(path)
+                self.user.refresh_from_db()
+                self.assertIsNotNone(self.user.last_login)
+
+    def test_inactive_or_deleted_user_rejected(self):
+        token = self.login()
+        self.assertEqual(self.get(token).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        response = self.get(token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["code"], "user_inactive")
+        self.user.delete()
+        self.assertEqual(self.get(token).json()["code"], "user_not_found")
+
+
+class KeysetPaginationTests(SeededTestCase):
+    """Cursor pages (diaspora/pagination.py) visit every row exactly once, whatever the ties and NULLs."""
+
+    def walk(self, url, direction="next"):
+        seen, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            page = [row["id"] for row in body["results"]]
+            seen.extend(page if direction == "next" else reversed(page))
+            url, pages = body[direction], pages + 1
+            last = body
+        return seen, pages, last
+
+    def test_walks_past_ties_both_ways(self):
+        # every purpose created in the same instant: only the pk tiebreaker orders them
+        Purpose.objects.update(created_at=timezone.now())
+        total = Purpose.objects.count()
+        for ordering in ("", "status", "-estimated_capital", "type,-created_at"):
+            with self.subTest(ordering=ordering):
+                forward, pages, last = self.walk(f"/api/purposes/?page_size=7&ordering={ordering}")
+                self.assertEqual(len(forward), total)
+                self.assertEqual(len(set(forward)), total)
+                self.assertGreater(pages, 2)
+                # from the last page back to the first, the same rows in reverse
+                previous = last["previous"]
+                backward, _, _ = self.walk(previous, direction="previous")
+                tail = len(last["results"])
+                self.assertEqual(backward, list(reversed(forward[:-tail])))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/api/purposes/?cursor=bogus").status_code, 404)
+
+
+class SearchTests(SeededTestCase):
+    """IndexedSearchFilter (diaspora/search.py) matches what SearchFilter's icontains would."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        search.rebuild()  # the seeded rows were indexed on commit, which TestCase never reaches
+
+    def assertSameAsIcontains(self, queryset, query, search_fields, search_index_path=None):
+        view = type("View", (), {"search_fields": search_fields, "search_index_path": search_index_path})()
+        request = Request(APIRequestFactory().get("/", {"search": query}))
+        indexed = set(search.IndexedSearchFilter().filter_queryset(request, queryset, view).values_list("pk", flat=True))
+        expected = set(SearchFilter().filter_queryset(request, queryset, view).values_list("pk", flat=True))
+        self.assertEqual(indexed, expected, query)
+        return indexed
+
+    def test_diaspora_search(self):
+        diaspora = Diaspora.objects.select_related("user").first()
+        fields = list(search.DOCUMENT_FIELDS)
+        for query in (diaspora.user.first_name, diaspora.diaspora_id[-6:], f"{diaspora.user.last_name} {diaspora.user.email[:2]}"):
+            self.assertTrue(self.assertSameAsIcontains(Diaspora.objects.all(), query, fields, ""))
+        # past the cap every match is still returned, only the first ones ranked
+        with override_settings(SEARCH_INDEX_MAX_HITS=3):
+            self.assertGreater(len(self.assertSameAsIcontains(Diaspora.objects.all(), "a", fields, "")), 3)
+
+    def test_terms_split_between_index_and_other_fields(self):
+        purpose = Purpose.objects.select_related("diaspora__user").first()
+        fields = [f"diaspora__{f}" for f in search.DOCUMENT_FIELDS] + ["type", "status"]
+        query = f"{purpose.diaspora.user.first_name} {purpose.type}"
+        self.assertIn(purpose.pk, self.assertSameAsIcontains(Purpose.objects.all(), query, fields, "diaspora"))
+
+    def test_partial_document_is_not_indexed(self):
+        # the document's email must not make a names-only search match
+        diaspora = Diaspora.objects.select_related("user").first()
+        fields = ["diaspora__user__first_name", "diaspora__user__last_name"]
+        self.assertSameAsIcontains(Case.objects.all(), diaspora.user.email, fields, "diaspora")
+
+
+class SlaTests(SeededTestCase):
+    """The SLA evaluator (diaspora/sla.py) marks each breach once and agrees with the overdue report."""
+
+    def setUp(self):
+        super().setUp()
+        Watermark.objects.filter(name=sla.WATERMARK).delete()
+        Referral.objects.update(status=Referral.ReferralStatus.SENT, sla_due_at=None, sla_breached_at=None)
+        self.now = timezone.now()
+        self.referrals = list(Referral.objects.order_by("pk")[:5])
+
+    def due(self, referral, delta, **fields):
+        Referral.objects.filter(pk=referral.pk).update(sla_due_at=self.now + delta, **fields)
+
+    def evaluate(self, offset=timedelta(0), full=False):
+        received = []
+
+        def receiver(sender, referral_ids, **kwargs):
+            received.extend(referral_ids)
+
+        sla.referrals_breached.connect(receiver)
+        try:
+            with self.assertLogs("diaspora.sla", "WARNING"):  # the default escalation
+                count = sla.evaluate(now=self.now + offset, full=full)
+        finally:
+            sla.referrals_breached.disconnect(receiver)
+        self.assertEqual(count, len(received))
+        return set(received)
+
+    def test_marks_each_breach_once(self):
+        late, on_time, upcoming, closed, moved = self.referrals
+        self.due(late, -timedelta(hours=1))
+        self.due(on_time, timedelta(0))  # due this very instant: breached, and counted overdue
+        self.due(upcoming, timedelta(hours=1))
+        self.due(closed, -timedelta(hours=1), status=Referral.ReferralStatus.COMPLETED)
+
+        self.assertEqual(self.evaluate(), {late.pk, on_time.pk})
+        self.assertEqual(sla.overdue_by_office(now=self.now)["total"], 2)
+        self.assertEqual(Referral.objects.filter(sla_breached_at=self.now).count(), 2)
+
+        self.assertEqual(self.evaluate(timedelta(hours=2)), {upcoming.pk})
+        self.assertEqual(sla.overdue_by_office(now=self.now + timedelta(hours=2))["total"], 3)
+
+        # a deadline moved behind the watermark is only seen by a full sweep
+        self.due(moved, -timedelta(hours=3))
+        with self.assertNoLogs("diaspora.sla"):
+            self.assertEqual(sla.evaluate(now=self.now + timedelta(hours=3)), 0)
+        self.assertEqual(self.evaluate(timedelta(hours=3), full=True), {moved.pk})
+
+
+class OutboxTests(SeededTestCase):
+    """The referral outbox (diaspora/outbox.py) sends only the newest snapshot, and backs off on failures."""
+
+    def setUp(self):
+        super().setUp()
+        busiest = Referral.objects.values("to_office").annotate(n=Count("pk")).order_by("-n")[0]["to_office"]
+        self.referral = Referral.objects.select_related("to_office").filter(to_office=busiest).first()
+        self.code = self.referral.to_office.code
+        destinations = {self.code: {"URL": "http://receiver.invalid/referrals/", "CONCURRENCY": 2}}
+        sync = {"DESTINATIONS": destinations, "MAX_ATTEMPTS": 3, "BACKOFF_BASE": 2, "PAUSE_AFTER_FAILURES": 100}
+        self.enterContext(override_settings(REFERRAL_SYNC=sync))
+        self.worker = outbox.OutboxWorker()
+        self.addCleanup(self.worker.close)
+        ReferralOutbox.objects.all().delete()
+
+    def touch(self, reason):
+        self.referral.reason = reason
+        self.referral.save()
+        return ReferralOutbox.objects.filter(referral=self.referral).latest("pk")
+
+    def drain(self, outcome=None, **by_reason):
+        """
+        Deliver what's due, answering ``outcome`` – an (outcome, error, retry_after)
+        tuple or an exception to raise – or the one given for the message's reason.
+        Returns the reasons delivered.
+        """
+        def send(message):
+            result = by_reason.get(message.payload["reason"], outcome)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        with mock.patch.object(outbox.Destination, "send", side_effect=send) as sent:
+            self.worker.drain()
+        return sorted(call.args[0].payload["reason"] for call in sent.call_args_list)
+
+    def status(self, message):
+        message.refresh_from_db()
+        return message.status
+
+    def test_only_the_newest_snapshot_is_sent(self):
+        first, second = self.touch("first"), self.touch("second")
+        self.assertEqual(self.status(first), ReferralOutbox.Status.SUPERSEDED)
+        self.assertEqual(self.drain((outbox.SENT, "", None)), ["second"])
+        self.assertEqual(self.status(second), ReferralOutbox.Status.SENT)
+        self.referral.refresh_from_db()
+        self.assertIsNotNone(self.referral.last_synced_at)
+        # stamping last_synced_at doesn't enqueue again
+        self.assertEqual(ReferralOutbox.objects.filter(status=ReferralOutbox.Status.PENDING).count(), 0)
+
+    def test_backoff_then_dead_letter(self):
+        message = self.touch("flaky")
+        before = timezone.now()
+        self.assertEqual(self.drain((outbox.RETRY, "HTTP 502", None)), ["flaky"])
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts, message.last_error), ("PENDING", 1, "HTTP 502"))
+        # BACKOFF_BASE seconds with jitter in [0.5, 1]
+        delay = (message.next_attempt_at - before).total_seconds()
+        self.assertGreaterEqual(delay, 1)
+        self.assertLess(delay, 3)
+        self.assertEqual(self.drain(), [])  # not due yet
+
+        for attempts in (2, 3):
+            ReferralOutbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+            self.drain((outbox.RETRY, "HTTP 502", None))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ("DEAD", 3))
+        self.assertEqual(self.worker.stats["dead_letters"], 1)
+
+    def test_retry_superseded_by_a_newer_snapshot(self):
+        stale = self.touch("stale")
+        batch = self.worker.claim()
+        newer = self.touch("newer")  # enqueued while the stale one is in flight
+        with mock.patch.object(outbox.Destination, "send", return_value=(outbox.RETRY, "timeout", None)):
+            self.worker.process(batch)
+        self.assertEqual(self.status(stale), ReferralOutbox.Status.SUPERSEDED)
+        self.assertEqual(self.drain((outbox.SENT, "", None)), ["newer"])
+        self.assertEqual(self.status(newer), ReferralOutbox.Status.SENT)
+
+    def test_delivery_exception_fails_only_that_message(self):
+        other = Referral.objects.filter(to_office=self.referral.to_office).exclude(pk=self.referral.pk).first()
+        crashing = self.touch("crash")
+        other.reason = "fine"
+        other.save()
+        sent = self.drain(crash=ValueError("bad URL"), fine=(outbox.SENT, "", None))
+        self.assertEqual(sent, ["crash", "fine"])
+        crashing.refresh_from_db()
+        self.assertEqual((crashing.status, crashing.attempts, crashing.last_error), ("PENDING", 1, "ValueError: bad URL"))
+        self.assertEqual(ReferralOutbox.objects.get(referral=other).status, ReferralOutbox.Status.SENT)
+
+
+class CaseTransitionTests(SeededTestCase):
+    """Bulk and single case updates follow the same workflow (diaspora/transitions.py)."""
+
+    def case(self, stage, status=Case.OverallStatus.ACTIVE):
+        case = Case.objects.exclude(pk__in=self.used).first()
+        Case.objects.filter(pk=case.pk).update(current_stage=stage, overall_status=status)
+        self.used.append(case.pk)
+        return case.pk
+
+    def setUp(self):
+        super().setUp()
+        self.used = []
+
+    def test_bulk(self):
+        moving, closed, already = self.case("INTAKE"), self.case("CLOSED"), self.case("SCREENING")
+        rollups.rebuild(Case)  # the fixture moved cases behind the rollups' back
+        response = self.client.post(
+            "/api/cases/transition/", {"ids": [moving, closed, already, 999999], "current_stage": "SCREENING"}, format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"updated": 1, "results": [
+            {"id": moving, "result": "updated"},
+            {"id": closed, "result": "rejected", "detail": "Stage CLOSED -> SCREENING is not allowed."},
+            {"id": already, "result": "unchanged"},
+            {"id": 999999, "result": "not_found"},
+        ]})
+        self.assertEqual(Case.objects.get(pk=moving).current_stage, "SCREENING")
+        self.assertEqual(Case.objects.get(pk=closed).current_stage, "CLOSED")
+        self.assertTrue(CaseStageTransition.objects.filter(case_id=moving, from_stage="INTAKE", to_stage="SCREENING").exists())
+        self.assertRollupsCurrent()
+
+    def test_single_update_follows_the_same_workflow(self):
+        closed, done, open_ = self.case("CLOSED"), self.case("PROCESSING", "DONE"), self.case("SCREENING")
+        response = self.client.patch(f"/api/cases/{closed}/", {"current_stage": "SCREENING"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"current_stage": ["Stage CLOSED -> SCREENING is not allowed."]})
+        response = self.client.patch(f"/api/cases/{done}/", {"overall_status": "ACTIVE"}, format="json")
+        self.assertEqual(response.json(), {"overall_status": ["Status DONE -> ACTIVE is not allowed."]})
+        response = self.client.patch(f"/api/cases/{open_}/", {"current_stage": "PROCESSING"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["current_stage"], "PROCESSING")
+
+
+class AsyncReadTests(SeededTestCase):
+    """The async/ twins of the read routes (diaspora/async_views.py) answer exactly as the sync ones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Announcement.objects.create(title="Async", content="Fixture", created_by=cls.admin)
+
+    def setUp(self):
+        super().setUp()
+        self.headers = {"Authorization": f"Bearer {AccessToken.for_user(self.admin)}"}
+        self.client = APIClient(headers=self.headers)
+
+    def aget(self, url, **headers):
+        return async_to_sync(AsyncClient().get)(url, headers={**self.headers, **headers})
+
+    def urls(self):
+        for prefix, viewset, basename in router.registry:
+            if hasattr(viewset, "alist"):
+                yield f"/api/{prefix}/"
+                yield f"/api/{prefix}/?page_size=3&ordering=-created_at&search=a"
+            for extra in viewset.get_extra_actions():
+                if not extra.detail and hasattr(viewset, f"a{extra.__name__}"):
+                    yield f"/api/{prefix}/{extra.url_path}/"
+            if hasattr(viewset, "aretrieve"):
+                yield f"/api/{prefix}/{viewset.queryset.model.objects.order_by('pk').first().pk}/"
+
+    def test_same_answers(self):
+        urls = list(self.urls())
+        self.assertIn("/api/reports/stage_funnel/", urls)
+        now = timezone.now()  # overdue_by_office reports the time it was computed at
+        for url in urls:
+            with self.subTest(url), mock.patch("django.utils.timezone.now", return_value=now):
+                expected = self.client.get(url)
+                response = self.aget(url.replace("/api/", "/api/async/", 1))
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response.get("ETag"), expected.get("ETag"))
+
+    def test_errors(self):
+        self.assertEqual(self.aget("/api/async/diasporas/999999/").status_code, 404)
+        self.assertEqual(async_to_sync(AsyncClient().get)("/api/async/diasporas/").status_code, 401)
+        etag = self.aget("/api/async/announcements/")["ETag"]
+        self.assertEqual(self.aget("/api/async/announcements/", if_none_match=etag).status_code, 304)
+
+
+class OfficeRegistryTests(SeededTestCase):
+    """The office registry (diaspora/offices.py) catches up with edits made through other workers."""
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+        self.office = Office.objects.create(name="Elsewhere", code="ELSE", type=Office.OfficeType.OTHER)
+        self.assertEqual(registry.get(self.office.pk), self.office)
+
+    def test_created_elsewhere_is_found_on_a_miss(self):
+        # bulk_create sends no signals, as with a save in another worker
+        created, = Office.objects.bulk_create([Office(name="Later", code="LATER", type=Office.OfficeType.OTHER)])
+        with mock.patch("diaspora.offices.MISS_RELOAD_INTERVAL", 0):
+            self.assertEqual(registry.by_code("LATER").pk, created.pk)
+
+    @override_settings(OFFICE_REGISTRY_TTL=0)
+    def test_edits_elsewhere_show_after_the_ttl(self):
+        Office.objects.filter(pk=self.office.pk).update(name="Renamed")
+        self.assertEqual(registry.get(self.office.pk).name, "Renamed")
+
+    def test_write_rejects_an_office_deleted_elsewhere(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {Office._meta.db_table} WHERE id = %s", [self.office.pk])
+        case = Case.objects.first()
+        response = self.client.post("/api/referrals/", {
+            "case": case.pk, "from_office": Office.objects.first().pk, "to_office": self.office.pk,
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["to_office"])
+        self.assertIsNone(registry.get(self.office.pk))
+
+
+class ConditionalGetTests(SeededTestCase):
+    """Read endpoints answer 304 while their validators (diaspora/conditional.py) hold."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.announcement = Announcement.objects.create(title="Closures", content="Fixture", created_by=cls.admin)
+
+    def assertNotModified(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_list_gets_an_etag_only(self):
+        response = self.client.get("/api/announcements/")
+        self.assertNotIn("Last-Modified", response)
+        self.assertNotModified("/api/announcements/", if_none_match=response["ETag"])
+        Announcement.objects.create(title="Holiday", content="Fixture", created_by=self.admin)
+        changed = self.client.get("/api/announcements/", headers={"if-none-match": response["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_retrieve(self):
+        url = f"/api/announcements/{self.announcement.pk}/"
+        response = self.client.get(url)
+        self.assertNotModified(url, if_none_match=response["ETag"])
+        self.assertNotModified(url, if_modified_since=response["Last-Modified"])
+
+    def test_embedded_user_edits_change_the_etag(self):
+        diaspora = Diaspora.objects.select_related("user").first()
+        case = Case.objects.filter(diaspora=diaspora).first() or Case.objects.create(diaspora=diaspora)
+        urls = [f"/api/diasporas/{diaspora.pk}/", f"/api/cases/{case.pk}/"]
+        etags = {}
+        for url in urls:
+            response = self.client.get(url)
+            self.assertNotIn("Last-Modified", response)  # the user has no timestamp to date the body with
+            self.assertNotModified(url, if_none_match=response["ETag"])
+            etags[url] = response["ETag"]
+        self.assertEqual(self.client.get("/api/diasporas/not-a-uuid/").status_code, 404)
+
+        diaspora.user.first_name = "Renamed"
+        diaspora.user.save()
+        self.assertEqual(Diaspora.objects.get(pk=diaspora.pk).updated_at, diaspora.updated_at)
+        for url in urls:
+            response = self.client.get(url, headers={"if-none-match": etags[url]})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etags[url])
+
+
+class SyntheticGeneratorTests(SeededTestCase):
+    """seed_diaspora's generator (diaspora/synthetic.py) is repeatable and keeps the derived tables current."""
+
+    def generate(self, count, seed=7, chunk_size=4, keep=False):
+        with transaction.atomic():
+            totals = SyntheticGenerator(seed=seed, chunk_size=chunk_size).run(count)
+            rows = list(
+                Diaspora.objects.filter(user__username__startswith=f"syn{seed}-").order_by("user__username").values_list(
+                    "user__username", "user__first_name", "user__last_name", "gender", "country_of_residence",
+                    "passport_no", "case__current_stage", "case__overall_status",
+                )
+            )
+            transaction.set_rollback(not keep)
+        return totals, rows
+
+    def test_same_seed_same_rows(self):
+        totals, rows = self.generate(10)
+        self.assertEqual(self.generate(10), (totals, rows))
+        self.assertNotEqual(self.generate(10, seed=8)[1], rows)
+
+    def test_rerun_continues(self):
+        _, rows = self.generate(8)
+        self.generate(4, keep=True)
+        _, continued = self.generate(4)
+        self.assertEqual(continued, rows)
+
+    def test_counts_and_derived_tables(self):
+        before = {model: model.objects.count() for model in (Diaspora, Purpose, Case, Referral)}
+        totals, _ = self.generate(10, keep=True)
+        self.assertEqual(totals, {
+            "diasporas": Diaspora.objects.count() - before[Diaspora], "purposes": Purpose.objects.count() - before[Purpose],
+            "cases": Case.objects.count() - before[Case], "referrals": Referral.objects.count() - before[Referral],
+        })
+        self.assertEqual(totals["diasporas"], 10)
+        new_cases = Case.objects.filter(diaspora__user__username__startswith="syn7-")
+        history = CaseStageTransition.objects.filter(case__in=new_cases).order_by("created_at", "pk")
+        self.assertEqual(dict(history.values_list("case", "to_stage")), dict(new_cases.values_list("pk", "current_stage")))
+
+        self.assertRollupsCurrent()
+        stage_rollups = {
+            model: [f.attname for f in model._meta.concrete_fields if not f.primary_key]
+            for model in (CaseStageEntryDailyRollup, CaseStageDurationDailyRollup)
+        }
+        kept = [set(model.objects.values_list(*fields)) for model, fields in stage_rollups.items()]
+        stage_history.rebuild()
+        self.assertEqual(kept, [set(model.objects.values_list(*fields)) for model, fields in stage_rollups.items()])
+
+
+@override_settings(DATABASE_ROUTING={**settings.DATABASE_ROUTING, "REPLICAS": ["default"]})
+class ReplicaRoutingTests(SeededTestCase):
+    """Reads go to a healthy replica unless the user just wrote (diaspora/routing.py); the primary stands in for one."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        routing.health.clear()
+        routing.health.beat()  # as if replication had carried a heartbeat over
+
+    def replica(self, **headers):
+        response = self.client.get("/api/diasporas/?page_size=1", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get("X-DB-Replica")
+
+    def test_writer_is_pinned_to_the_primary(self):
+        self.assertEqual(self.replica(), "default")
+        response = self.client.post("/api/announcements/", {"title": "Pinned", "content": "Fixture"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(routing.PIN_COOKIE, response.cookies)
+        self.assertIsNone(self.replica())
+        self.assertEqual(self.replica(x_db_route="replica"), "default")
+
+        del self.client.cookies[routing.PIN_COOKIE]
+        self.assertIsNone(self.replica())  # the cache keeps the pin for clients that drop the cookie
+        cache.clear()
+        self.assertEqual(self.replica(), "default")
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("reader", "reader@example.com", "pw"))
+        self.client = other
+        self.assertEqual(self.replica(), "default")
+        self.assertIsNone(self.replica(x_db_route="primary"))
+
+    def test_health_follows_the_heartbeat(self):
+        now = timezone.now()
+        cases = [
+            (None, False),  # never received a heartbeat
+            (now - timedelta(seconds=1), True),
+            (now - timedelta(seconds=60), False),
+        ]
+        for seen, healthy in cases:
+            Watermark.objects.filter(name=routing.HEARTBEAT).delete()
+            if seen is not None:
+                Watermark.objects.create(name=routing.HEARTBEAT, value=seen)
+            with self.subTest(seen=seen), mock.patch.object(routing.ReplicaHealth, "beat", return_value=now), \
+                    self.assertNoLogs("diaspora.routing") if healthy else self.assertLogs("diaspora.routing", "WARNING"):
+                self.assertEqual(routing.health.check("default"), healthy)
+        # a replica holding the primary's latest stamp is current however old the stamp
+        with mock.patch.object(routing.ReplicaHealth, "beat", return_value=now - timedelta(seconds=60)):
+            self.assertTrue(routing.health.check("default"))
+
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(routing.ReplicaHealth, "check", return_value=False) as check:
+            self.assertIsNone(self.replica())
+            self.assertIsNone(self.replica())
+        self.assertEqual(check.call_count, 1)  # re-checked every HEALTH_CHECK_INTERVAL, not per request
+
+
+class StageHistoryTests(SeededTestCase):
+    """Case stage changes are kept as history (diaspora/stage_history.py) behind the stage funnel report."""
+
+    def test_history_rows(self):
+        diaspora = Diaspora.objects.filter(case__isnull=True).first()
+        start = timezone.now()
+        with mock.patch("django.utils.timezone.now", return_value=start):
+            case = Case.objects.create(diaspora=diaspora)
+        with mock.patch("django.utils.timezone.now", return_value=start + timedelta(hours=2)):
+            case.current_stage = Case.Stage.SCREENING
+            case.save()
+        with mock.patch("django.utils.timezone.now", return_value=start + timedelta(hours=3)):
+            Case.objects.only("pk").get(pk=case.pk).save()  # deferred stage and status: nothing changed
+            case.overall_status = Case.OverallStatus.PAUSED
+            case.save()
+
+        self.assertEqual(list(case.stage_history.order_by("pk").values_list(
+            "from_stage", "to_stage", "from_status", "to_status", "stage_since", "stage_seconds",
+        )), [
+            (None, "INTAKE", None, "ACTIVE", start, None),
+            ("INTAKE", "SCREENING", "ACTIVE", "ACTIVE", start + timedelta(hours=2), 7200),
+            ("SCREENING", "SCREENING", "ACTIVE", "PAUSED", start + timedelta(hours=2), None),
+        ])
+        self.assertTrue(case.stage_history.filter(owner_office=diaspora.owner_office_id).exists())
+
+    def test_stage_funnel(self):
+        today = timezone.localdate()
+        f, t = today - timedelta(days=365), today
+        rollup = RollupReports().stage_funnel(f, t)
+        self.assertTrue(rollup["funnel"])
+        self.assertEqual(LiveReports().stage_funnel(f, t), rollup)
+
+        history = CaseStageTransition.objects.filter(in_window(f, t))
+        entered = Counter(history.exclude(from_stage=F("to_stage")).values_list("to_stage", flat=True))
+        self.assertEqual({row["stage"]: row["entered"] for row in rollup["funnel"] if row["entered"]}, dict(entered))
+        for row in rollup["funnel"]:
+            seconds = sorted(history.filter(from_stage=row["stage"], stage_seconds__isnull=False).values_list("stage_seconds", flat=True))
+            self.assertEqual(row["left"], len(seconds))
+            if seconds:  # read off the histogram: within one bucket of the exact median
+                exact = seconds[(len(seconds) - 1) // 2]
+                self.assertLessEqual(abs(stage_history.bucket(row["median_seconds"]) - stage_history.bucket(exact)), 1)
+
+        response = self.client.get(f"/api/reports/stage_funnel/?from={f}&to={t}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["funnel"], json.loads(json.dumps(rollup["funnel"], cls=DjangoJSONEncoder)))
+
+
+class DiasporaIdAllocationTests(TransactionTestCase):
+    """Parallel registrations draw diaspora_ids from the block-reserved sequence (diaspora/ids.py)."""
+    threads = 8
+    per_thread = 25
+
+    def setUp(self):
+        allocator._blocks.clear()
+
+    def test_parallel_registrations_get_unique_ids(self):
+        password_hash = make_password("123456")  # hash once: this is about ids, not PBKDF2
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.threads)
+        ids, errors, sequence_queries = [], [], Counter()
+
+        def count_sequence_queries(execute, sql, params, many, context):
+            if "diaspora_diasporaidsequence" in sql:
+                with lock:
+                    sequence_queries[sql.split()[0]] += 1
+            return execute(sql, params, many, context)
+
+        def register(t):
+            barrier.wait()
+            try:
+                with connection.execute_wrapper(count_sequence_queries):
+                    for i in range(self.per_thread):
+                        serializer = DiasporaWriteSerializer(
+                            data={"user": {"email": f"ids-{t}-{i}@example.com"}},
+                            context={"password_hash": password_hash},
+                        )
+                        try:
+                            serializer.is_valid(raise_exception=True)
+                            diaspora = serializer.save()
+                        except Exception as exc:
+                            with lock:
+                                errors.append(repr(exc))
+                            continue
+                        with lock:
+                            ids.append(diaspora.diaspora_id)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=register, args=(t,)) for t in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        total = self.threads * self.per_thread
+        self.assertEqual(errors, [])
+        self.assertEqual(len(ids), total)
+        self.assertEqual(len(set(ids)), total)
+        self.assertEqual(Diaspora.objects.values("diaspora_id").distinct().count(), total)
+        self.assertTrue(all(i.startswith("HR-DIAS-") for i in ids))
+
+        # one UPDATE (+ SELECT) per reserved block, never per insert: with 10 ids per block,
+        # at most one block per 10 inserts plus one partly used block per thread
+        blocks = sequence_queries["UPDATE"]
+        self.assertLessEqual(blocks, total // 10 + self.threads)
+        self.assertLessEqual(sum(sequence_queries.values()), 2 * blocks + 2)  # + the year's row creation
+
+
+class QueryBudgetTests(SeededTestCase):
+    """Every read action declaring a ``query_budget`` (diaspora/api.py) stays within it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Announcement.objects.create(title="Budget", content="Fixture", created_by=cls.admin)
+
+    def setUp(self):
+        super().setUp()
+        # start cold, as check_query_budgets does: cached reports and the office registry reload
+        report_cache.bump(*report_cache.DEPENDENCIES)
+
+    def test_declared_budgets(self):
+        checked = 0
+        for prefix, viewset, basename in router.registry:
+            for action, budget in getattr(viewset, "query_budget", {}).items():
+                with self.subTest(f"{prefix}.{action}"):
+                    url = budget_url(viewset, basename, action)
+                    self.assertIsNotNone(url, "no fixture row to retrieve")
+                    with query_budget(budget, label=f"{prefix}.{action}"):
+                        response = self.client.get(url)
+                        if response.streaming:
+                            b"".join(response.streaming_content)
+                    self.assertEqual(response.status_code, 200)
+                    checked += 1
+        self.assertGreater(checked, 0)
+
+
+class FacetTests(SeededTestCase):
+    """Facet counts (diaspora/facets.py) on the sync and async routes, and the country facet."""
+
+    def setUp(self):
+        super().setUp()
+        token = self.client.post(
+            "/api/login/", {"username": "test-admin", "password": "pw"}, format="json",
+        ).json()["access"]
+        self.auth = {"Authorization": f"Bearer {token}"}
+
+    def facets(self, **params):
+        return self.client.get("/api/diasporas/facets/", params, headers=self.auth)
+
+    def afacets(self, **params):
+        return async_to_sync(AsyncClient().get)("/api/async/diasporas/facets/", params, headers=self.auth)
+
+    def test_async_route_matches_sync(self):
+        expected = self.facets()
+        self.assertEqual(expected.status_code, 200)
+        registry.clear()  # labelling then loads offices from the database, off the event loop
+        response = self.afacets()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected.json())
+        self.assertTrue(all(e["label"] for e in response.json()["facets"]["owner_office"] if e["value"]))
+
+    def test_country_update_fields_and_null(self):
+        first, second = Diaspora.objects.order_by("pk")[:2]
+        first.country_of_residence = "u.s.a."
+        first.save(update_fields=["country_of_residence"])
+        second.country_of_residence = ""
+        second.save(update_fields=["country_of_residence"])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.country_canonical, second.country_canonical), ("USA", ""))
+
+        blank = Diaspora.objects.filter(country_canonical="").count()
+        response = self.facets(country="null")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], blank)
+        self.assertGreater(blank, 0)
+
+
+class SerializedWriterTests(TransactionTestCase):
+    """Group commit (diaspora/sqlite.py) isolates jobs from each other's failures."""
+
+    def announce(self, title, fail=False, hook=None):
+        def job():
+            Announcement.objects.create(title=title, content="Fixture")
+            if hook is not None:
+                transaction.on_commit(hook)
+            if fail:
+                raise ValueError(title)
+            return title
+        return job
+
+    def test_failing_job_rolls_back_only_itself(self):
+        ran = []
+
+        def broken_hook():
+            raise RuntimeError("hook")
+
+        jobs = [
+            self.announce("first", hook=lambda: ran.append("first")),
+            self.announce("failing", fail=True, hook=lambda: ran.append("failing")),
+            self.announce("broken hook", hook=broken_hook),
+            self.announce("last", hook=lambda: ran.append("last")),
+        ]
+        batch = [(Future(), contextvars.copy_context(), job, (), {}) for job in jobs]
+        commits = writer.stats["commits"]
+        with self.assertLogs("django.db.backends.base", "ERROR"):
+            writer._commit(batch)
+
+        self.assertEqual(writer.stats["commits"], commits + 1)
+        self.assertEqual(batch[0][0].result(), "first")
+        with self.assertRaisesMessage(ValueError, "failing"):
+            batch[1][0].result()
+        self.assertEqual(set(Announcement.objects.values_list("title", flat=True)), {"first", "broken hook", "last"})
+        self.assertEqual(ran, ["first", "last"])
+
+    def test_writer_thread_survives_a_failing_job(self):
+        with self.assertRaisesMessage(ValueError, "failing"):
+            writer.submit(self.announce("failing", fail=True)).result(timeout=10)
+        self.assertEqual(writer.submit(self.announce("next")).result(timeout=10), "next")
+        self.assertEqual(list(Announcement.objects.values_list("title", flat=True)), ["next"])
@@ -0,0 +1,105 @@
+# diaspora/transitions.py
+"""
+Case workflow transitions, applied in bulk.
+
+``bulk_transition()`` moves many cases to one target stage and/or overall
+status with a fixed number of queries however many cases are involved: one
+locking SELECT for the current state, one ``UPDATE ... WHERE id IN (...)``,
+one rollup adjustment per distinct (day, old stage, old status) bucket, and
+the stage history (``stage_history.record()``). QuerySet.update() sends no
+signals, so the rollups, the history and the report cache are maintained
+here.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import report_cache, rollups, stage_history
+from .models import Case
+
+Stage = Case.Stage
+Status = Case.OverallStatus
+
+# current stage -> stages it may move to (any stage may be closed)
+STAGE_TRANSITIONS = {
+    Stage.INTAKE: {Stage.SCREENING, Stage.REFERRAL, Stage.CLOSED},
+    Stage.SCREENING: {Stage.INTAKE, Stage.REFERRAL, Stage.PROCESSING, Stage.CLOSED},
+    Stage.REFERRAL: {Stage.SCREENING, Stage.PROCESSING, Stage.CLOSED},
+    Stage.PROCESSING: {Stage.REFERRAL, Stage.COMPLETED, Stage.CLOSED},
+    Stage.COMPLETED: {Stage.CLOSED},
+    Stage.CLOSED: set(),
+}
+
+# DONE and REJECTED are final
+STATUS_TRANSITIONS = {
+    Status.ACTIVE: {Status.PAUSED, Status.DONE, Status.REJECTED},
+    Status.PAUSED: {Status.ACTIVE, Status.DONE, Status.REJECTED},
+    Status.DONE: set(),
+    Status.REJECTED: set(),
+}
+
+UPDATED, UNCHANGED, NOT_FOUND, REJECTED = "updated", "unchanged", "not_found", "rejected"
+
+
+def check(current, target, allowed, label):
+    """None if ``current`` -> ``target`` is allowed (or a no-op), else the reason."""
+    if target is None or target == current:
+        return None
+    if target not in allowed.get(current, ()):
+        return f"{label} {current} -> {target} is not allowed."
+    return None
+
+
+def bulk_transition(ids, stage=None, status=None):
+    """
+    Move the cases in ``ids`` to ``stage`` / ``status``. Returns one
+    ``{"id", "result"[, "detail"]}`` per requested id, in request order.
+    """
+    ids = list(dict.fromkeys(ids))
+    results, moving = {}, []
+    with transaction.atomic():
+        rows = (
+            Case.objects.select_for_update().filter(pk__in=ids)
+            .values_list("pk", "created_at", "current_stage", "overall_status")
+        )
+        current = {pk: (created_at, s, o) for pk, created_at, s, o in rows}
+        for pk in ids:
+            if pk not in current:
+                results[pk] = {"id": pk, "result": NOT_FOUND}
+                continue
+            _, old_stage, old_status = current[pk]
+            reason = (
+                check(old_stage, stage, STAGE_TRANSITIONS, "Stage")
+                or check(old_status, status, STATUS_TRANSITIONS, "Status")
+            )
+            if reason:
+                results[pk] = {"id": pk, "result": REJECTED, "detail": reason}
+            elif (stage or old_stage) == old_stage and (status or old_status) == old_status:
+                results[pk] = {"id": pk, "result": UNCHANGED}
+            else:
+                results[pk] = {"id": pk, "result": UPDATED}
+                moving.append(pk)
+
+        if moving:
+            changes = {"updated_at": timezone.now()}
+            if stage:
+                changes["current_stage"] = stage
+            if status:
+                changes["overall_status"] = status
+            Case.objects.filter(pk__in=moving).update(**changes)
+
+            buckets = Counter(
+                (timezone.localdate(current[pk][0]), current[pk][1], current[pk][2]) for pk in moving
+            )
+            for (day, old_stage, old_status), n in buckets.items():
+                rollups.move(Case, (day, old_stage, old_status), (day, stage or old_stage, status or old_status), n)
+            stage_history.record(
+                [
+                    stage_history.Change(pk, current[pk][1], stage or current[pk][1], current[pk][2], status or current[pk][2])
+                    for pk in moving
+                ],
+                at=changes["updated_at"],
+            )
+            transaction.on_commit(lambda: report_cache.bump(Case))
+    return [results[pk] for pk in ids]
@@ -3,6 +3,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .api import *
 from .views import *
+from .async_views import async_urlpatterns
 
 router = DefaultRouter()
 router.register(r"offices", OfficeViewSet, basename="offices")
@@ -17,5 +18,10 @@ urlpatterns = [
     path("", include(router.urls)),
     path("login/", user_login, name="user_login"),  
     path("public/register/", PublicRegisterView.as_view(), name="public-register"),
+    # ASGI variants with off-loop password hashing (api/asgi.py maps the two paths above here)
+    path("async/login/", user_login_async, name="user_login_async"),
+    path("async/public/register/", public_register_async, name="public-register-async"),
+    # async list/retrieve and report reads (diaspora/async_views.py); api/asgi.py routes GET/HEAD here
+    *async_urlpatterns(router),
 ]
 
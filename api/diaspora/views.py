@@ -1,16 +1,25 @@
+import json
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from django.contrib.auth import authenticate, login 
+from django.contrib.auth.hashers import make_password
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib.auth.models import User
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.views import APIView
 from rest_framework import status, permissions
 from rest_framework.throttling import AnonRateThrottle
 
 from .serializers import DiasporaWriteSerializer, DiasporaSerializer
 from .models import Diaspora
+from .hashing import HashingBusy, get_gate
+from .sqlite import writer
+from .authentication import login_candidates, login_payload, login_rows, verify_password
 
 class PublicRegisterView(APIView):
     """
@@ -46,7 +55,9 @@ class PublicRegisterView(APIView):
         if not ser.is_valid():
             return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        diaspora: Diaspora = ser.save()  # creates User, adds to Diaspora group, creates Diaspora
+        # hash here: the serialized writer (diaspora/sqlite.py) should only ever wait on the database
+        ser.context["password_hash"] = make_password(pwd or "123456")
+        diaspora: Diaspora = writer.run(ser.save)  # creates User, adds to Diaspora group, creates Diaspora
 
         # Return your standard read shape
         out = DiasporaSerializer(diaspora, context={"request": request}).data
@@ -64,29 +75,105 @@ def user_login(request):
     if not identifier or not password:
         return Response("Email and/or Password are Incorrect", status=status.HTTP_400_BAD_REQUEST)
 
-    # Try authenticating directly as username
-    user = authenticate(request, username=identifier, password=password)
-    print(user)
-    # If that fails, try resolving identifier as email to a username
-    if user is None and '@' in identifier:
-        try:
-            resolved_user = User.objects.get(email=identifier)
-            user = authenticate(request, username=resolved_user.username, password=password)
-        except User.DoesNotExist:
-            user = None
-    if user is not None:
-        login(request, user)
-        print(user.groups.first().name)
-        # Generate JWT token
-        refresh = RefreshToken.for_user(user)   
-        # Create a custom response with the token
-        response_data = {
-            'access': str(refresh.access_token),
-            'refresh': str(refresh),
-            'user_id': user.id,
-            'role': user.groups.first().name if user.groups.exists() else 'Diaspora',  # Assuming first group is the role
-        }
-        return Response(response_data, status=status.HTTP_200_OK)
-
-    else:
-        return Response({"detail": "Invalid login credentials."}, status=status.HTTP_401_UNAUTHORIZED)
+    # One query loads the user(s) with groups and office; role/office go into the JWT,
+    # so neither this view nor later requests need to look them up again.
+    candidates = login_candidates(login_rows(identifier), identifier)
+    for user, groups, office_id in candidates:
+        if verify_password(user, password):
+            return Response(login_payload(user, groups, office_id), status=status.HTTP_200_OK)
+    if not candidates:
+        make_password(password)  # same cost as a wrong password
+    return Response({"detail": "Invalid login credentials."}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+# ---------------------------
+# ASGI variants (api/asgi.py routes /api/login/ and /api/public/register/ here)
+# Password hashing/verification runs in the bounded pool from diaspora/hashing.py,
+# so a burst of logins or registrations never blocks the event loop.
+# ---------------------------
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+
+def _busy():
+    response = JsonResponse({"detail": "Server is busy, please retry shortly."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response["Retry-After"] = "1"
+    return response
+
+
+def _verify_password(user, password):
+    if user is None:
+        # hash anyway so unknown identifiers take as long as wrong passwords
+        make_password(password)
+        return False
+    return verify_password(user, password)
+
+
+@csrf_exempt
+@require_POST
+async def user_login_async(request):
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({"detail": "Invalid JSON body."}, status=status.HTTP_400_BAD_REQUEST)
+    identifier = data.get('username') or data.get('email')
+    password = data.get('password')
+    if not identifier or not password:
+        return JsonResponse("Email and/or Password are Incorrect", safe=False, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = [row async for row in login_rows(identifier)]
+    candidates = login_candidates(rows, identifier) or [(None, [], None)]
+    gate = get_gate()
+    try:
+        for user, groups, office_id in candidates:
+            if await gate.run(_verify_password, user, password):
+                return JsonResponse(await sync_to_async(login_payload)(user, groups, office_id))
+    except HashingBusy:
+        return _busy()
+    return JsonResponse({"detail": "Invalid login credentials."}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+def _validate_registration(data, password_hash):
+    ser = DiasporaWriteSerializer(data=data, context={"password_hash": password_hash})
+    ser.is_valid()
+    return ser
+
+
+def _registration_payload(diaspora):
+    return DiasporaSerializer(diaspora).data
+
+
+@csrf_exempt
+@require_POST
+async def public_register_async(request):
+    data = _json_body(request)
+    if not isinstance(data, dict):
+        return JsonResponse({"detail": "Invalid JSON body."}, status=status.HTTP_400_BAD_REQUEST)
+
+    user_payload = (data.get("user") or {})
+    pwd = user_payload.get("password") or ""
+    confirm = data.get("confirm_password") or user_payload.get("confirm_password") or ""
+    if confirm and pwd != confirm:
+        return JsonResponse({"detail": "Passwords do not match."}, status=status.HTTP_400_BAD_REQUEST)
+
+    email = (user_payload.get("email") or "").strip().lower()
+    if not email:
+        return JsonResponse({"detail": "Email is required."}, status=status.HTTP_400_BAD_REQUEST)
+    if await User.objects.filter(email__iexact=email).aexists():
+        return JsonResponse({"detail": "An account with this email already exists."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        password_hash = await get_gate().run(make_password, pwd or "123456")
+    except HashingBusy:
+        return _busy()
+
+    ser = await sync_to_async(_validate_registration)(data, password_hash)
+    if ser.errors:
+        return JsonResponse(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+    # outside sync_to_async's single thread, so concurrent registrations can share a commit
+    diaspora = await writer.arun(ser.save)
+    out = await sync_to_async(_registration_payload)(diaspora)
+    return JsonResponse(out, encoder=DjangoJSONEncoder, status=status.HTTP_201_CREATED)